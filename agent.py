@@ -2,11 +2,20 @@ import asyncio
 import os
 import base64
 import json
-from playwright.async_api import async_playwright
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+import logging
+import time
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, messages_to_dict, messages_from_dict
 from utils import draw_bounding_boxes
+from llm_clients import get_chat_client, get_hedge_client, hedge_target, registry
+from hedging import LatencyTracker, HedgeStats, hedge_stats, hedged_call
+from trajectory_cache import trajectory_cache, dom_fingerprint, caller_scope
+from ws_stream import Screencast
+from browser_pool import open_page
+from checkpoints import RunCheckpointer, restore_browser
+from auth_cache import AuthSession
+from state_encoding import StateEncoder, AGENT_LEGEND, count_tokens
+import tracing
+import metrics
 import imageio
 from pydantic import BaseModel
 
@@ -125,28 +134,56 @@ class Controller:
 
 # --- Agent ---
 
+# Metric children resolved once; updating them on the hot path is a plain attribute write.
+RUNS = metrics.RUNS.labels("agent")
+STEPS = metrics.STEPS.labels("agent")
+SCREENSHOT_BYTES = metrics.SCREENSHOT_BYTES.labels("agent")
+JSON_PARSE_FAILURES = metrics.PARSE_FAILURES.labels("json")
+ACTION_PARSE_FAILURES = metrics.PARSE_FAILURES.labels("action")
+
 class Agent:
-    def __init__(self, websocket, task):
+    def __init__(self, websocket, task, browser_pool=None):
         self.websocket = websocket
         self.task = task
+        self.browser_pool = browser_pool # Shared browsers for batch runs; None launches one per run
         self.history = []
         self.frames = []
         self.controller = Controller()
 
-        if task.model == 'gemini':
-            self.client = ChatGoogleGenerativeAI(
-                model=task.geminiModel,
-                google_api_key=task.geminiApiKey,
-                generation_config={"response_mime_type": "application/json"}
-            )
-        else:
-            self.client = ChatOpenAI(
-                model=task.openaiModel,
-                openai_api_key=task.openaiApiKey,
-                model_kwargs={"response_format": {"type": "json_object"}}
-            )
+        client_options = {
+            "openai_options": {"model_kwargs": {"response_format": {"type": "json_object"}}},
+            "gemini_options": {"generation_config": {"response_mime_type": "application/json"}},
+        }
+        self.client = get_chat_client(task, **client_options)
+        self.client_warm = registry.is_warm(self.client)
+        self.llm_calls = 0
+
+        # Optional secondary provider for latency hedging
+        self.hedge_client = get_hedge_client(task, **client_options)
+        self.hedge_stats = HedgeStats()
+
+        self.step_timer = metrics.Timer(metrics.STEP_DURATION.labels("agent"))
+        self.model_name = task.geminiModel if task.model == 'gemini' else task.openaiModel
+        self.llm_latency = metrics.LLM_LATENCY.labels(task.model, self.model_name)
+        self.hedge_latency = metrics.LLM_LATENCY.labels(*hedge_target(task)) if self.hedge_client else None
+
+        # Trajectory cache replay state
+        self.replay_steps = None
+        self.replayed_steps = 0
+        self.cache_scope = caller_scope(task)
+        self.last_action_str = None
+
+        # Optional CDP live view streamed alongside the per-step screenshots
+        self.screencast = Screencast.for_task(websocket, task)
+        self.checkpointer = RunCheckpointer("agent", task)
+        self.auth = AuthSession(task)
+
+        # Compact state: short keys and only the changes since the previous step
+        self.state_encoder = StateEncoder() if task.compactState else None
+        self.state_tokens = metrics.STATE_TOKENS.labels("agent", "compact" if task.compactState else "json")
 
     async def run(self):
+        RUNS.inc()
         await self.send_log(f"[AGENT] Starting task: {self.task.instruction}")
 
         system_prompt = """
@@ -180,57 +217,146 @@ class Agent:
         - GoTo("url")
         - Done("summary")
         """
+        if self.task.compactState:
+            system_prompt += AGENT_LEGEND
 
-        self.history.append(SystemMessage(content=system_prompt))
-        self.history.append(HumanMessage(content=f"The task is: {self.task.instruction}"))
-
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            await page.goto(self.task.url)
-
-            for _ in range(15): # Increased step limit
-                browser_state = await self.observe(page)
-                screenshot_bytes = await self.send_screenshot(page, browser_state.dom_state)
+        checkpoint = await self.checkpointer.load()
+        if checkpoint:
+            self.history = messages_from_dict(checkpoint["history"])
+            await self.send_log(f"[AGENT] Resuming from the checkpoint after step {checkpoint['step']}")
+        else:
+            if self.task.resumeFrom:
+                await self.send_log(f"[AGENT] No checkpoint found for run {self.task.resumeFrom}, starting from scratch")
+            self.history.append(SystemMessage(content=system_prompt))
+            self.history.append(HumanMessage(content=f"The task is: {self.task.instruction}"))
+        await self.send_log(f"[CHECKPOINT]{self.checkpointer.key}")
+
+        storage_state = checkpoint["browser"]["storage_state"] if checkpoint else self.auth.storage_state()
+        async with open_page(self.browser_pool, storage_state) as page:
+            if checkpoint:
+                with tracing.span("browser.restore", tabs=len(checkpoint["browser"]["tabs"])):
+                    page = await restore_browser(page, checkpoint["browser"])
+            else:
+                with tracing.span("browser.navigate", url=self.task.url):
+                    await page.goto(self.task.url)
+                if await self.auth.check_seeded(page):
+                    await self.send_log(f"[AGENT] Reusing the cached session of profile '{self.task.authProfile}'")
+            if self.screencast:
+                await self.screencast.start(page)
+
+            saved = checkpoint["extra"] if checkpoint else {}
+            start_fingerprint = saved.get("start_fingerprint")
+            recorded_steps = saved.get("recorded_steps", [])
+            completed = False
+
+            for step_count in range(checkpoint["step"] if checkpoint else 0, 15): # Increased step limit
+                STEPS.inc()
+                with tracing.span("agent.step", step=step_count + 1), self.step_timer:
+                    browser_state = await self.observe(page)
+                    fingerprint = dom_fingerprint(browser_state.dom_state)
+                    if step_count == 0 and self.task.useTrajectoryCache:
+                        start_fingerprint = fingerprint
+                        self.replay_steps = trajectory_cache.get(self.task.url, self.task.instruction, fingerprint, self.cache_scope)
+                        if self.replay_steps:
+                            await self.send_log(f"[AGENT] Found a cached trajectory with {len(self.replay_steps)} steps, replaying it")
+
+                    with tracing.span("agent.screenshot"):
+                        screenshot_bytes = await self.send_screenshot(page, browser_state.dom_state)
                 
-                image_b64 = base64.b64encode(screenshot_bytes).decode()
+                    image_b64 = base64.b64encode(screenshot_bytes).decode()
                 
-                text_part = {"type": "text", "text": browser_state.model_dump_json()}
-                image_part = {
-                    "type": "image_url",
-                    "image_url": f"data:image/jpeg;base64,{image_b64}"
-                }
-
-                # OpenAI's gpt-4o uses a slightly different format for image_url
-                if self.task.model == 'openai':
-                    image_part["image_url"] = {"url": image_part["image_url"]}
-
-                self.history.append(HumanMessage(content=[text_part, image_part]))
-
-                action = await self.think(browser_state.dom_state)
+                    text_part = {"type": "text", "text": await self.encode_state(browser_state)}
+                    image_part = {
+                        "type": "image_url",
+                        "image_url": f"data:image/jpeg;base64,{image_b64}"
+                    }
+
+                    # OpenAI's gpt-4o uses a slightly different format for image_url.
+                    # Gemini accepts it too, so it is also used when hedging across providers.
+                    if self.task.model == 'openai' or self.hedge_client:
+                        image_part["image_url"] = {"url": image_part["image_url"]}
+
+                    self.history.append(HumanMessage(content=[text_part, image_part]))
+
+                    action = None
+                    if self.replay_steps:
+                        action = await self.replay(fingerprint, browser_state.dom_state)
+                        if action is None:
+                            trajectory_cache.invalidate(self.task.url, self.task.instruction, start_fingerprint, self.cache_scope)
+                    if action is None:
+                        action = await self.think(browser_state.dom_state)
                 
-                if action is None:
-                    continue
+                    if action is None:
+                        continue
 
-                if isinstance(action, Done):
-                    break
+                    recorded_steps.append({"fingerprint": fingerprint, "action": self.last_action_str})
+
+                    if isinstance(action, Done):
+                        completed = True
+                        break
                 
-                await self.controller.execute_action(action, page)
+                    with tracing.span("agent.action", action=type(action).__name__):
+                        await self.controller.execute_action(action, page)
                 
-                # Re-observe the page after each action to get the updated state
-                browser_state = await self.observe(page)
-
-            await browser.close()
-
-        await self.send_log("[FINAL_AGENT] Task finished. Saving video...")
-        video_filename = "agent_run.mp4"
-        imageio.mimsave(video_filename, self.frames, fps=3)
-        await self.send_log(f"[VIDEO]/{video_filename}")
+                    # Re-observe the page after each action to get the updated state
+                    with tracing.span("agent.settle"):
+                        browser_state = await self.observe(page)
+                    self.auth.observe_url(page.url)
+
+                    await self.checkpointer.save(page, step_count + 1, messages_to_dict(self.history), {
+                        "start_fingerprint": start_fingerprint,
+                        "recorded_steps": recorded_steps,
+                    })
+
+            await self.auth.save(page)
+            if self.screencast:
+                await self.screencast.stop()
+        await self.checkpointer.finish()
+
+        if start_fingerprint:
+            # A run that merely ran out of steps leaves the entry alone; only a replay divergence drops it
+            if completed and not trajectory_cache.put(self.task.url, self.task.instruction, start_fingerprint,
+                                                      self.cache_scope, recorded_steps):
+                await self.send_log("[AGENT] Not caching the trajectory since it types into inputs")
+            trajectory_cache.record_saved_calls(self.replayed_steps)
+            await self.send_log(f"[AGENT] Replayed {self.replayed_steps} cached steps. Trajectory cache: {trajectory_cache.stats()}")
+
+        if self.hedge_client:
+            hedge_stats.merge(self.hedge_stats)
+            await self.send_log(f"[AGENT] Hedging stats: {self.hedge_stats.as_dict()}")
+
+        video_filename = None
+        if self.frames:
+            await self.send_log("[FINAL_AGENT] Task finished. Saving video...")
+            video_filename = "agent_run.mp4"
+            with tracing.span("agent.video", frames=len(self.frames)):
+                imageio.mimsave(video_filename, self.frames, fps=3)
+            await self.send_log(f"[VIDEO]/{video_filename}")
         await self.send_log("[DONE]")
 
         return self.history, video_filename
 
+    async def encode_state(self, browser_state):
+        with tracing.span("agent.encode_state") as encode_span:
+            if self.state_encoder:
+                text = self.state_encoder.encode(browser_state.model_dump())
+            else:
+                text = browser_state.model_dump_json()
+            # Tokenizing a large page takes milliseconds, so it runs off the event loop
+            tokens = await asyncio.to_thread(count_tokens, text, self.model_name)
+            self.state_tokens.observe(tokens)
+            encode_span.set(tokens=tokens)
+            if self.state_encoder and tracing.enabled():
+                # The full-JSON size is only needed to compare the encodings in a trace
+                full = browser_state.model_dump_json()
+                encode_span.set(full_json_tokens=await asyncio.to_thread(count_tokens, full, self.model_name))
+        return text
+
     async def observe(self, page):
+        with tracing.span("agent.observe") as observe_span:
+            return await self._observe(page, observe_span)
+
+    async def _observe(self, page, observe_span):
         page_state = await page.evaluate("""
             () => {
                 return {
@@ -266,6 +392,7 @@ class Agent:
                     "bounding_box": bounding_box,
                 })
 
+        observe_span.set(elements=len(elements), visible=len(dom_state))
         return BrowserStateSummary(
             dom_state=dom_state,
             url=page_state["url"],
@@ -275,8 +402,90 @@ class Agent:
         )
 
     async def think(self, dom_state):
-        response = await self.client.ainvoke(self.history)
+        start = time.perf_counter()
+        if self.hedge_client:
+            try:
+                with tracing.span("agent.llm", model=self.task.model, hedged=True, messages=len(self.history)):
+                    (response, response_json, action), client, seconds = await self.hedged_think(dom_state)
+            except ValueError as e:
+                ACTION_PARSE_FAILURES.inc()
+                await self.send_log(f"[AGENT] No provider returned a valid action: {e}")
+                return None
+            except Exception as e:
+                # Timeouts, rate limits or auth failures from both providers; retry on the next step
+                await self.send_log(f"[AGENT] No provider answered: {type(e).__name__}: {e}")
+                return None
+            (self.hedge_latency if client is self.hedge_client else self.llm_latency).observe(seconds)
+        else:
+            with tracing.span("agent.llm", model=self.task.model, messages=len(self.history)):
+                response = await self.client.ainvoke(self.history)
+            with tracing.span("agent.parse"):
+                response_json = self.parse_response(response)
+            action = None
+            self.llm_latency.observe(time.perf_counter() - start)
+        self.llm_calls += 1
+        if self.llm_calls == 1:
+            logging.info(f"First LLM response in {(time.perf_counter() - start) * 1000:.0f} ms (warm client: {self.client_warm})")
+
+        thinking = response_json.get("thinking", "")
+        action_str = response_json.get("action", "")
         
+        self.history.append(AIMessage(content=response.content))
+        await self.send_log(f"[AGENT] Thinking: {thinking}")
+        await self.send_log(f"[AGENT] Chose action: {action_str}")
+
+        self.last_action_str = action_str
+        if action is None:
+            action = self.parse_action(action_str, dom_state)
+            if action is None:
+                ACTION_PARSE_FAILURES.inc()
+        return action
+
+    async def replay(self, fingerprint, dom_state):
+        """
+        Returns the next cached action if the page still matches the fingerprint recorded for it,
+        otherwise drops the rest of the trajectory so the LLM takes over from this step.
+        """
+        step = self.replay_steps.pop(0)
+        action = None
+        if step["fingerprint"] == fingerprint:
+            action = self.parse_action(step["action"], dom_state)
+        if action is None:
+            await self.send_log("[AGENT] Page diverged from the cached trajectory, falling back to the LLM")
+            self.replay_steps = None
+            return None
+
+        self.replayed_steps += 1
+        self.last_action_str = step["action"]
+        # Keep the conversation complete in case a later step falls back to the LLM
+        self.history.append(AIMessage(content=json.dumps({
+            "thinking": "Replayed from the trajectory cache.",
+            "action": step["action"],
+        })))
+        await self.send_log(f"[AGENT] Replayed cached action: {step['action']}")
+        return action
+
+    async def hedged_think(self, dom_state):
+        """
+        Races the primary and secondary providers; the first valid parsed action wins.
+        Returns `((response, response_json, action), client, seconds)` as given by `hedged_call`.
+        """
+        async def call(client):
+            response = await client.ainvoke(self.history)
+            response_json = self.parse_response(response)
+            action = self.parse_action(response_json.get("action", ""), dom_state)
+            if action is None:
+                raise ValueError(f"unparseable action {response_json.get('action')!r}")
+            return response, response_json, action
+
+        primary_tracker = registry.derive(self.client, "latency", lambda client: LatencyTracker())
+        secondary_tracker = registry.derive(self.hedge_client, "latency", lambda client: LatencyTracker())
+        deadline = primary_tracker.percentile(self.task.hedgePercentile) or self.task.hedgeDeadlineMs / 1000
+        return await hedged_call(
+            call, self.client, self.hedge_client, primary_tracker, secondary_tracker, deadline, self.hedge_stats
+        )
+
+    def parse_response(self, response):
         content = response.content
         # Extract string content if it's a list (multimodal output)
         if isinstance(content, list):
@@ -296,23 +505,15 @@ class Agent:
             if json_start != -1 and json_end != 0:
                 cleaned_content = cleaned_content[json_start:json_end]
             
-            response_json = json.loads(cleaned_content)
+            return json.loads(cleaned_content)
         except json.JSONDecodeError:
             # Fallback for markdown-formatted JSON
             if cleaned_content.startswith("```json"):
                 cleaned_content = cleaned_content[7:-3].strip()
-                response_json = json.loads(cleaned_content)
+                return json.loads(cleaned_content)
             else:
+                JSON_PARSE_FAILURES.inc()
                 raise
-        thinking = response_json.get("thinking", "")
-        action_str = response_json.get("action", "")
-        
-        self.history.append(AIMessage(content=response.content))
-        await self.send_log(f"[AGENT] Thinking: {thinking}")
-        await self.send_log(f"[AGENT] Chose action: {action_str}")
-
-        return self.parse_action(action_str, dom_state)
-
 
     def parse_action(self, action_str, dom_state):
         if isinstance(action_str, dict):
@@ -372,8 +573,12 @@ class Agent:
 
     async def send_screenshot(self, page, elements):
         screenshot_bytes = await page.screenshot(type='jpeg', quality=95)
+        if not self.task.streamFrames:
+            return screenshot_bytes # Headless run: no annotation, streaming or video frames
         self.frames.append(imageio.imread(screenshot_bytes))
         
-        screenshot_with_boxes = draw_bounding_boxes(screenshot_bytes, elements)
+        with tracing.span("agent.annotate", elements=len(elements)):
+            screenshot_with_boxes = draw_bounding_boxes(screenshot_bytes, elements)
+        SCREENSHOT_BYTES.observe(len(screenshot_with_boxes))
         await self.websocket.send_bytes(screenshot_with_boxes)
         return screenshot_bytes
@@ -0,0 +1,213 @@
+"""
+Cache of authenticated browser state (Playwright `storage_state`: cookies and localStorage),
+keyed by target origin, credential profile and caller.
+
+A task opts in with `authProfile`, a name for the credentials it logs in with. Its context
+is seeded from the cached state, so the run starts already logged in. When the run ends
+still logged in, its state is stored back. A seeded run that lands on a login page, or
+any run that visits a logout URL, invalidates the entry.
+
+Profile names are chosen by clients, so they are not trusted on their own: entries are also
+keyed by the caller (a hash of the task's LLM API key, see `caller_scope`). A client only
+ever gets sessions stored by tasks carrying the same API key, and tasks without an API key
+of their own never use the cache.
+
+With `WEBPILOT_AUTH_CACHE_DIR` set, entries are also written there (one file per key,
+readable only by the owner since they hold session cookies) and survive restarts.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit
+
+from trajectory_cache import normalize_url, caller_scope
+
+AUTH_CACHE_TTL = float(os.getenv("WEBPILOT_AUTH_CACHE_TTL", str(6 * 3600)))
+AUTH_CACHE_DIR = os.getenv("WEBPILOT_AUTH_CACHE_DIR", "")
+
+LOGIN_PATH = re.compile(r"/(log[-_]?in|sign[-_]?in|auth|sso)(/|$|\?|\.)", re.IGNORECASE)
+LOGOUT_PATH = re.compile(r"/(log[-_]?out|sign[-_]?out|log[-_]?off)(/|$|\?|\.)", re.IGNORECASE)
+
+VISIBLE_PASSWORD_FIELD = """
+    () => [...document.querySelectorAll('input[type=password]')].some(input => input.offsetParent !== null)
+"""
+
+
+def origin_of(url: str) -> str:
+    parts = urlsplit(normalize_url(url))
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+async def looks_logged_out(page) -> bool:
+    """A login URL or a visible password field means the page wants credentials."""
+    if LOGIN_PATH.search(urlsplit(page.url).path):
+        return True
+    try:
+        return await page.evaluate(VISIBLE_PASSWORD_FIELD)
+    except Exception:
+        return False
+
+
+class AuthStateCache:
+    """LRU cache with TTL of storage states, optionally mirrored to a directory."""
+    def __init__(self, maxsize: int = 256, ttl: float = AUTH_CACHE_TTL, directory: str = AUTH_CACHE_DIR):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.lookups = 0
+        self.hits = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _file(self, key: tuple) -> str:
+        digest = hashlib.sha256("|".join(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def _read_file(self, key: tuple) -> Optional[dict]:
+        try:
+            with open(self._file(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_file(self, key: tuple, entry: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._file(key)
+        temp_path = f"{path}.tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"origin": key[0], "profile": key[1], "scope": key[2], **entry}, f)
+        os.replace(temp_path, path)
+
+    def get(self, url: str, profile: str, scope: str) -> Optional[dict]:
+        key = (origin_of(url), profile, scope)
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is None and self.directory:
+                entry = self._read_file(key)
+                if entry is not None:
+                    self._entries[key] = entry
+                    self._evict()
+            if entry is None:
+                return None
+            # Wall-clock timestamps, since entries on disk outlive the process
+            if time.time() - entry["created"] > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["storage_state"]
+
+    def put(self, url: str, profile: str, scope: str, storage_state: dict):
+        key = (origin_of(url), profile, scope)
+        entry = {"storage_state": storage_state, "created": time.time()}
+        with self._lock:
+            self._entries[key] = entry
+            self._evict()
+            if self.directory:
+                try:
+                    self._write_file(key, entry)
+                except OSError as e:
+                    logging.warning(f"Could not persist auth state for {key[0]}: {e}")
+
+    def invalidate(self, url: str, profile: str, scope: str):
+        with self._lock:
+            self.invalidations += 1
+            self._remove((origin_of(url), profile, scope))
+
+    def clear(self, scope: str, profile: Optional[str] = None):
+        """Drops the caller's entries, or only those of one of its credential profiles."""
+        def matches(key: tuple) -> bool:
+            return key[2] == scope and (profile is None or key[1] == profile)
+
+        with self._lock:
+            for key in list(self._entries):
+                if matches(key):
+                    del self._entries[key]
+            if not (scope and self.directory and os.path.isdir(self.directory)):
+                return
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    with open(path) as f:
+                        entry = json.load(f)
+                    if not matches((entry.get("origin"), entry.get("profile"), entry.get("scope"))):
+                        continue
+                    os.remove(path)
+                except (OSError, ValueError, AttributeError):
+                    continue
+
+    def _evict(self):
+        """Keeps the most recently used `maxsize` entries in memory; files on disk are kept."""
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _remove(self, key: tuple):
+        self._entries.pop(key, None)
+        if self.directory:
+            try:
+                os.remove(self._file(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+                "invalidations": self.invalidations,
+                "persistent": bool(self.directory),
+            }
+
+
+auth_cache = AuthStateCache()
+
+
+class AuthSession:
+    """Connects one run to the cache; every method is a no-op for tasks without `authProfile`."""
+    def __init__(self, task, cache: AuthStateCache = auth_cache):
+        self.url = task.url
+        self.scope = caller_scope(task)
+        # Without an API key there is no caller to scope the entries to
+        self.profile = task.authProfile if self.scope else ""
+        self.cache = cache
+        self.seeded = False
+        self.logged_out = False
+
+    def storage_state(self) -> Optional[dict]:
+        if not self.profile:
+            return None
+        state = self.cache.get(self.url, self.profile, self.scope)
+        self.seeded = state is not None
+        return state
+
+    async def check_seeded(self, page) -> bool:
+        """Call after the first navigation; returns False (and invalidates) if the cached session expired."""
+        if self.seeded and await looks_logged_out(page):
+            self.cache.invalidate(self.url, self.profile, self.scope)
+            self.seeded = False
+            return False
+        return self.seeded
+
+    def observe_url(self, url: str):
+        if self.profile and not self.logged_out and LOGOUT_PATH.search(urlsplit(url).path):
+            self.logged_out = True
+            self.cache.invalidate(self.url, self.profile, self.scope)
+
+    async def save(self, page):
+        """Stores the context's state unless the run logged out or ended on a login page."""
+        if not self.profile or self.logged_out or await looks_logged_out(page):
+            return
+        self.cache.put(self.url, self.profile, self.scope, await page.context.storage_state())
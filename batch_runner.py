@@ -0,0 +1,290 @@
+"""
+Batch execution of agent tasks without a UI connection.
+
+Submitted tasks are stored as `BatchTask` rows and queued for a fixed pool of workers,
+which share a `BrowserPool` (one context per run) and persist each result as soon as it
+finishes. Runs are headless: frames are neither annotated, streamed nor recorded to video.
+
+Progress can be polled (`page`) or followed as server-sent events (`events`), which first
+replays results that finished before the client subscribed.
+
+The queue lives in memory, so tasks still pending when the server stops are not resumed.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+
+import run_search
+from database import SessionLocal, Batch, BatchTask, Run, PentestRun
+
+BATCH_WORKERS = int(os.getenv("WEBPILOT_BATCH_WORKERS", "4"))
+BATCH_BROWSERS = int(os.getenv("WEBPILOT_BATCH_BROWSERS", "2"))
+
+AGENT_KINDS = ("agent", "pentest")
+
+# Kept in memory for the run only, never written to the batch_tasks table.
+SECRET_FIELDS = {"openaiApiKey", "geminiApiKey"}
+
+
+class LogSink:
+    """Stands in for the WebSocket of an interactive run: keeps the text logs, ignores frames."""
+    def __init__(self):
+        self.logs = []
+
+    async def send_text(self, message):
+        self.logs.append(message)
+
+    async def send_bytes(self, data):
+        pass
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def progress(batch: Batch) -> dict:
+    return {
+        "id": batch.id,
+        "agent": batch.agent,
+        "status": batch.status,
+        "total": batch.total,
+        "completed": batch.completed,
+        "failed": batch.failed,
+        "pending": batch.total - batch.completed - batch.failed,
+        "created_at": batch.created_at.isoformat() if batch.created_at else None,
+        "finished_at": batch.finished_at.isoformat() if batch.finished_at else None,
+    }
+
+
+def task_result(batch_task: BatchTask) -> dict:
+    return {
+        "id": batch_task.id,
+        "position": batch_task.position,
+        "url": batch_task.url,
+        "instruction": batch_task.instruction,
+        "status": batch_task.status,
+        "run_id": batch_task.run_id,
+        "result": batch_task.result,
+        "error": batch_task.error,
+        "finished_at": batch_task.finished_at.isoformat() if batch_task.finished_at else None,
+    }
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class BatchRunner:
+    def __init__(self, workers: int = BATCH_WORKERS, browsers: int = BATCH_BROWSERS):
+        self.worker_count = max(1, workers)
+        self.browser_count = browsers
+        self.queue = None
+        self.pool = None
+        self.workers = []
+        self.subscribers = defaultdict(set)
+
+    def start(self):
+        """Starts the workers on first use, so servers that never run batches pay nothing."""
+        if self.workers:
+            return
+        # Playwright is only imported once a batch arrives, keeping server startup fast.
+        from browser_pool import BrowserPool
+        self.queue = asyncio.Queue()
+        self.pool = BrowserPool(self.browser_count)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.pool is not None:
+            await self.pool.stop()
+
+    def queue_depth(self) -> int:
+        """Tasks waiting for a worker; sampled when metrics are scraped."""
+        return self.queue.qsize() if self.queue is not None else 0
+
+    # --- Submission ---
+
+    def create_batch(self, db, agent: str) -> Batch:
+        # "submitting" keeps the batch open while an NDJSON upload is still streaming in
+        batch = Batch(agent=agent, status="submitting", total=0, completed=0, failed=0, created_at=_now())
+        db.add(batch)
+        db.commit()
+        db.refresh(batch)
+        return batch
+
+    def add_tasks(self, db, batch: Batch, entries):
+        """
+        Stores and queues a chunk of tasks. `entries` holds `(task, error)` pairs: a validated
+        AgentTask, or the validation error of an entry, which is recorded as a failed task.
+        """
+        rows = []
+        failed = 0
+        for task, error in entries:
+            position = batch.total + len(rows)
+            if task is None:
+                rows.append(BatchTask(batch_id=batch.id, position=position, status="failed",
+                                      error=error, finished_at=_now()))
+                failed += 1
+                continue
+            rows.append(BatchTask(
+                batch_id=batch.id,
+                position=position,
+                url=task.url,
+                instruction=task.instruction,
+                task=task.model_dump(exclude=SECRET_FIELDS),
+                status="pending",
+            ))
+        db.add_all(rows)
+        # Counters are updated in SQL since workers may be incrementing them concurrently
+        db.execute(update(Batch).where(Batch.id == batch.id).values(total=Batch.total + len(rows), failed=Batch.failed + failed))
+        db.commit()
+
+        self.start()
+        for row, (task, _) in zip(rows, entries):
+            if task is not None:
+                headless = task.model_copy(update={"streamFrames": False, "liveView": False})
+                self.queue.put_nowait((batch.id, row.id, headless))
+
+    def finish_submission(self, db, batch: Batch):
+        batch.status = "running"
+        db.commit()
+        self._check_finished(db, batch.id)
+        db.refresh(batch)
+
+    # --- Execution ---
+
+    async def _worker(self):
+        while True:
+            batch_id, task_id, task = await self.queue.get()
+            try:
+                await self._run_task(batch_id, task_id, task)
+            except Exception as e:
+                logging.error(f"Batch task {task_id} could not be recorded: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    async def _run_task(self, batch_id: int, task_id: int, task):
+        db = SessionLocal()
+        try:
+            batch = db.get(Batch, batch_id)
+            db.execute(update(BatchTask).where(BatchTask.id == task_id).values(status="running"))
+            db.commit()
+
+            sink = LogSink()
+            values = {"status": "done"}
+            try:
+                run, values["result"] = await self._run_agent(batch.agent, task, sink)
+                db.add(run)
+                db.commit()
+                values["run_id"] = run.id
+                run_search.index_run(db, batch.agent, run)
+            except Exception as e:
+                logging.warning(f"Batch {batch_id} task {task_id} failed: {e}")
+                db.rollback()
+                values.update(status="failed", error=f"{type(e).__name__}: {e}", result={"logs": sink.logs[-20:]})
+            values["finished_at"] = _now()
+
+            db.execute(update(BatchTask).where(BatchTask.id == task_id).values(**values))
+            counter = Batch.completed if values["status"] == "done" else Batch.failed
+            db.execute(update(Batch).where(Batch.id == batch_id).values({counter: counter + 1}))
+            db.commit()
+
+            self._publish(batch_id, "result", task_result(db.get(BatchTask, task_id)))
+            self._check_finished(db, batch_id)
+        finally:
+            db.close()
+
+    async def _run_agent(self, kind: str, task, sink):
+        if kind == "pentest":
+            from pentest_agent import PentestAgent
+            agent = PentestAgent(sink, task, browser_pool=self.pool)
+            _, video_filename, report = await agent.run()
+            report = report.model_dump() if hasattr(report, "model_dump") else {"summary": str(report)}
+            run = PentestRun(url=task.url, instruction=task.instruction, report=report, video_url=video_filename)
+            return run, {"report": report}
+
+        from agent import Agent
+        from langchain_core.messages import messages_to_dict
+        agent = Agent(sink, task, browser_pool=self.pool)
+        logs, video_filename = await agent.run()
+        run = Run(url=task.url, instruction=task.instruction, logs=json.dumps(messages_to_dict(logs)), video_url=video_filename)
+        return run, {"final_action": agent.last_action_str}
+
+    def _check_finished(self, db, batch_id: int):
+        batch = db.get(Batch, batch_id)
+        db.refresh(batch)
+        if batch.status == "running" and batch.completed + batch.failed >= batch.total:
+            batch.status = "done"
+            batch.finished_at = _now()
+            db.commit()
+            self._publish(batch_id, "done", progress(batch))
+
+    # --- Progress ---
+
+    def page(self, db, batch: Batch, offset: int = 0, limit: int = 100, status: str = None) -> dict:
+        query = db.query(BatchTask).filter(BatchTask.batch_id == batch.id)
+        if status:
+            query = query.filter(BatchTask.status == status)
+        rows = query.order_by(BatchTask.position).offset(offset).limit(limit + 1).all()
+        return {
+            "batch": progress(batch),
+            "results": [task_result(row) for row in rows[:limit]],
+            "next_offset": offset + limit if len(rows) > limit else None,
+        }
+
+    @contextmanager
+    def subscribe(self, batch_id: int):
+        queue = asyncio.Queue()
+        self.subscribers[batch_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers[batch_id].discard(queue)
+            if not self.subscribers[batch_id]:
+                del self.subscribers[batch_id]
+
+    def _publish(self, batch_id: int, event: str, data: dict):
+        for queue in self.subscribers.get(batch_id, ()):
+            queue.put_nowait((event, data))
+
+    async def events(self, batch_id: int):
+        """Server-sent events: already finished results, then live results until the batch is done."""
+        with self.subscribe(batch_id) as queue:
+            db = SessionLocal()
+            try:
+                batch = db.get(Batch, batch_id)
+                finished = (
+                    db.query(BatchTask)
+                    .filter(BatchTask.batch_id == batch_id, BatchTask.status.in_(("done", "failed")))
+                    .order_by(BatchTask.finished_at, BatchTask.position)
+                    .all()
+                )
+                sent = {row.id for row in finished}
+                for row in finished:
+                    yield _sse("result", task_result(row))
+                yield _sse("progress", progress(batch))
+                if batch.status == "done":
+                    yield _sse("done", progress(batch))
+                    return
+            finally:
+                db.close()
+
+            while True:
+                event, data = await queue.get()
+                if event == "result" and data["id"] in sent:
+                    continue
+                yield _sse(event, data)
+                if event == "done":
+                    return
+
+
+batch_runner = BatchRunner()
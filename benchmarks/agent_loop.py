@@ -0,0 +1,382 @@
+"""
+End-to-end benchmark of the agent loop against local fixture sites with a scripted fake LLM.
+
+    python benchmarks/agent_loop.py --iterations 5 --output bench.json
+    python benchmarks/agent_loop.py --iterations 5 --compare baseline.json
+    python benchmarks/agent_loop.py --results bench.json --compare baseline.json   # compare only
+
+Reports per-phase p50/p95 (observe, screenshot, annotate, llm, action, db_save), wall time,
+peak RSS, the bytes each run sends over the WebSocket and the tokens of the browser state
+sent to the LLM (`--compact-state` switches to the compact encoding). Phase times are exclusive: the
+annotate time is not counted again inside screenshot.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+PHASES = ("observe", "screenshot", "annotate", "llm", "action", "db_save")
+
+SCENARIOS = {
+    "form": {
+        "path": "/form",
+        "instruction": "Fill in and send the contact form",
+        "actions": ['Type(0, "Ada Lovelace")', 'Type(1, "ada@example.com")', 'Type(2, "Hello there")', 'Click(3)', 'Done("Form sent")'],
+    },
+    "links": {
+        "path": "/links?n=5000",
+        "instruction": "Open link number 25",
+        "actions": ['Scroll("down")', 'Scroll("down")', 'Click(25)', 'Done("Opened link 25")'],
+    },
+    "spa": {
+        "path": "/spa",
+        "instruction": "Add two widgets to the dashboard",
+        "actions": ['Click(0)', 'Click(0)', 'Scroll("down")', 'Done("Added two widgets")'],
+    },
+    "tabs": {
+        "path": "/tabs",
+        "instruction": "Open the details page in a new tab",
+        "actions": ['Click(0)', 'SwitchTab(1)', 'Done("Opened the details tab")'],
+    },
+}
+
+PENTEST_TOOL_CALLS = [("get_page_content", {}), ("scroll_page", {"direction": "down"})]
+
+
+class PhaseTimer:
+    """Collects exclusive durations per phase; nested phases are subtracted from their parent."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._stack = []
+
+    def _start(self, phase):
+        self._stack.append([phase, time.perf_counter(), 0.0])
+
+    def _stop(self):
+        phase, start, child_time = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.samples[phase].append(elapsed - child_time)
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def wrap_async(self, phase, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            self._start(phase)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self._stop()
+        return wrapper
+
+    def wrap_sync(self, phase, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._start(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._stop()
+        return wrapper
+
+
+class CountingWebSocket:
+    """Stands in for the FastAPI WebSocket and counts the bytes an agent sends."""
+    def __init__(self):
+        self.text_bytes = 0
+        self.binary_bytes = 0
+        self.frames = 0
+        self.state_tokens = 0
+
+    def observe(self, tokens):
+        """Replaces the agent's state-token histogram, so the tokens of one run can be summed."""
+        self.state_tokens += tokens
+
+    async def send_text(self, message):
+        self.text_bytes += len(message.encode())
+        self.frames += 1
+
+    async def send_bytes(self, data):
+        self.binary_bytes += len(data)
+        self.frames += 1
+
+
+class ScriptedChatModel:
+    """Returns the scripted responses in order, then `fallback` forever, after a fixed latency."""
+    def __init__(self, responses, fallback, latency: float):
+        self.responses = deque(responses)
+        self.fallback = fallback
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.responses.popleft() if self.responses else self.fallback
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2) if values else None,
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2) if values else None,
+    }
+
+
+def start_fixture_server():
+    from fixtures.site_server import serve
+    server = serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+async def run_agent_once(scenario, base_url, timer, llm_latency, compact_state=False):
+    import agent as agent_module
+    from langchain_core.messages import AIMessage, messages_to_dict
+    from database import SessionLocal, Run
+    from server import AgentTask
+
+    task = AgentTask(url=base_url + scenario["path"], instruction=scenario["instruction"],
+                     openaiApiKey="benchmark", useTrajectoryCache=False, compactState=compact_state)
+    websocket = CountingWebSocket()
+    agent = agent_module.Agent(websocket, task)
+    agent.state_tokens = websocket
+
+    def reply(action):
+        return AIMessage(content=json.dumps({"thinking": "Scripted benchmark step.", "action": action}))
+
+    llm = ScriptedChatModel([reply(action) for action in scenario["actions"]], reply('Done("Script exhausted")'), llm_latency)
+    agent.client = llm
+    agent.client.ainvoke = timer.wrap_async("llm", llm.ainvoke)
+    agent.observe = timer.wrap_async("observe", agent.observe)
+    agent.send_screenshot = timer.wrap_async("screenshot", agent.send_screenshot)
+    agent.controller.execute_action = timer.wrap_async("action", agent.controller.execute_action)
+
+    start = time.perf_counter()
+    logs, video_filename = await agent.run()
+    wall = time.perf_counter() - start
+
+    save = timer.wrap_sync("db_save", _save_run)
+    save(SessionLocal, Run(url=task.url, instruction=task.instruction,
+                           logs=json.dumps(messages_to_dict(logs)), video_url=video_filename))
+    return wall, websocket, llm.calls
+
+
+async def run_pentest_once(scenario, base_url, timer, llm_latency, compact_state=False):
+    import pentest_agent as pentest_module
+    from langchain_core.messages import AIMessage
+    from database import SessionLocal, PentestRun
+    from server import AgentTask
+
+    task = AgentTask(url=base_url + scenario["path"], instruction=scenario["instruction"], openaiApiKey="benchmark",
+                     compactState=compact_state)
+    websocket = CountingWebSocket()
+    agent = pentest_module.PentestAgent(websocket, task)
+    agent.state_tokens = websocket
+
+    final = AIMessage(content='{"vulnerabilities": []}')
+    tool_replies = [
+        AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:8]}"}])
+        for name, args in PENTEST_TOOL_CALLS
+    ]
+    tool_llm = ScriptedChatModel(tool_replies, final, llm_latency)
+    report_llm = ScriptedChatModel([], pentest_module.VulnerabilityReport(vulnerabilities=[]), llm_latency)
+    agent.llm_for_tool_calling = tool_llm
+    tool_llm.ainvoke = timer.wrap_async("llm", tool_llm.ainvoke)
+    agent.llm_for_structured_output = report_llm
+    report_llm.ainvoke = timer.wrap_async("llm", report_llm.ainvoke)
+    agent.observe = timer.wrap_async("observe", agent.observe)
+    agent.send_screenshot = timer.wrap_async("screenshot", agent.send_screenshot)
+
+    start = time.perf_counter()
+    logs, video_filename, report = await agent.run()
+    wall = time.perf_counter() - start
+
+    save = timer.wrap_sync("db_save", _save_run)
+    save(SessionLocal, PentestRun(url=task.url, instruction=task.instruction,
+                                  report=report.model_dump(), video_url=video_filename))
+    return wall, websocket, tool_llm.calls + report_llm.calls
+
+
+def _save_run(session_factory, run):
+    db = session_factory()
+    try:
+        db.add(run)
+        db.commit()
+        db.refresh(run)
+    finally:
+        db.close()
+
+
+def instrument_modules(timer):
+    """Patches module-level functions that the agents call by name; returns an undo callback."""
+    import agent as agent_module
+    import pentest_agent as pentest_module
+    from src.agent_tools.tools import AgentTools
+
+    originals = [
+        (agent_module, "draw_bounding_boxes", agent_module.draw_bounding_boxes),
+        (pentest_module, "draw_bounding_boxes", pentest_module.draw_bounding_boxes),
+    ]
+    for name in dir(AgentTools):
+        member = getattr(AgentTools, name)
+        if not name.startswith("_") and asyncio.iscoroutinefunction(member):
+            originals.append((AgentTools, name, member))
+
+    for owner, name, original in originals:
+        if owner is AgentTools:
+            setattr(owner, name, timer.wrap_async("action", original))
+        else:
+            setattr(owner, name, timer.wrap_sync("annotate", original))
+
+    def undo():
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+    return undo
+
+
+async def run_benchmarks(args):
+    from database import init_db
+    init_db()
+
+    server, base_url = start_fixture_server()
+    results = {}
+    try:
+        for kind in args.agents:
+            runner = run_agent_once if kind == "agent" else run_pentest_once
+            for name in args.scenarios:
+                timer = PhaseTimer()
+                undo = instrument_modules(timer)
+                walls, text_bytes, binary_bytes, frames, llm_calls, state_tokens = [], [], [], [], [], []
+                try:
+                    for _ in range(args.iterations):
+                        wall, websocket, calls = await runner(SCENARIOS[name], base_url, timer, args.llm_latency_ms / 1000,
+                                                              compact_state=args.compact_state)
+                        walls.append(wall)
+                        text_bytes.append(websocket.text_bytes)
+                        binary_bytes.append(websocket.binary_bytes)
+                        frames.append(websocket.frames)
+                        llm_calls.append(calls)
+                        state_tokens.append(websocket.state_tokens)
+                finally:
+                    undo()
+                key = f"{kind}/{name}"
+                results[key] = {
+                    "wall": summarize(walls),
+                    "phases": {phase: summarize(timer.samples.get(phase, [])) for phase in PHASES},
+                    "ws_bytes_per_run": {
+                        "text": round(sum(text_bytes) / len(text_bytes)),
+                        "binary": round(sum(binary_bytes) / len(binary_bytes)),
+                    },
+                    "ws_frames_per_run": round(sum(frames) / len(frames), 1),
+                    "llm_calls_per_run": round(sum(llm_calls) / len(llm_calls), 1),
+                    "state_tokens_per_run": round(sum(state_tokens) / len(state_tokens)),
+                }
+                print(f"{key}: wall p50 {results[key]['wall']['p50_ms']} ms, p95 {results[key]['wall']['p95_ms']} ms")
+    finally:
+        server.shutdown()
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "iterations": args.iterations,
+        "llm_latency_ms": args.llm_latency_ms,
+        "compact_state": args.compact_state,
+        "python": sys.version.split()[0],
+        # ru_maxrss is in kilobytes on Linux; the browser runs in child processes.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold, min_delta_ms):
+    """Returns a list of human-readable regressions of `current` against `baseline`."""
+    regressions = []
+
+    def check(label, new, old, unit, min_delta):
+        if new is None or old is None:
+            return
+        if new > old * (1 + threshold) and new - old > min_delta:
+            regressions.append(f"{label}: {old} -> {new} {unit} (+{(new / old - 1) * 100 if old else float('inf'):.0f}%)")
+
+    for key, base in baseline["results"].items():
+        new = current["results"].get(key)
+        if new is None:
+            continue
+        for stat in ("p50_ms", "p95_ms"):
+            check(f"{key} wall {stat}", new["wall"][stat], base["wall"][stat], "ms", min_delta_ms)
+            for phase in PHASES:
+                check(f"{key} {phase} {stat}", new["phases"][phase][stat], base["phases"][phase][stat], "ms", min_delta_ms)
+        for channel in ("text", "binary"):
+            check(f"{key} ws {channel} bytes", new["ws_bytes_per_run"][channel], base["ws_bytes_per_run"][channel], "B", 0)
+    check("peak RSS", current["peak_rss_mb"], baseline["peak_rss_mb"], "MB", 5)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent loop benchmark")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--agents", default="agent,pentest")
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--compact-state", action="store_true", help="Send tasks with compactState enabled")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--results", help="Skip running and compare an existing results file")
+    parser.add_argument("--compare", help="Baseline results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+    args.scenarios = args.scenarios.split(",")
+    args.agents = args.agents.split(",")
+    # The benchmark changes directory below, so resolve user-supplied paths first.
+    args.output, args.results, args.compare = (
+        os.path.abspath(path) if path else path for path in (args.output, args.results, args.compare)
+    )
+
+    if args.results:
+        with open(args.results) as f:
+            current = json.load(f)
+    else:
+        # Agents write their videos to the working directory, so keep them out of the repo.
+        workdir = tempfile.mkdtemp(prefix="webpilot-bench-")
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        os.chdir(workdir)
+        current = asyncio.run(run_benchmarks(args))
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.compare}:")
+            for regression in regressions:
+                print(f"  REGRESSION {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Import-time benchmark for server startup.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter, prints the
+slowest imports by cumulative time and optionally fails when the total exceeds a budget.
+
+    python benchmarks/import_time.py                      # server cold start
+    python benchmarks/import_time.py --module agent       # an agent module on its own
+    python benchmarks/import_time.py --budget-ms 800      # exit 1 when over budget
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_imports(module: str) -> list[dict]:
+    """Returns one entry per imported module with its self and cumulative time in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time breakdown via -X importtime")
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    entries = measure_imports(args.module)
+    target = next(entry for entry in reversed(entries) if entry["module"] == args.module)
+    total_ms = target["cumulative_us"] / 1000
+
+    print(f"Import of '{args.module}': {total_ms:.1f} ms cumulative, {len(entries)} modules")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for entry in sorted(entries, key=lambda e: e["cumulative_us"], reverse=True)[:args.top]:
+        print(f"{entry['cumulative_us'] / 1000:>14.1f} {entry['self_us'] / 1000:>9.1f}  {'  ' * entry['depth']}{entry['module']}")
+
+    heavy = [name for name in ("langchain_openai", "langchain_google_genai", "imageio", "playwright")
+             if any(entry["module"] == name for entry in entries)]
+    if heavy:
+        print(f"Heavy packages loaded eagerly: {', '.join(heavy)}")
+
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"FAIL: {total_ms:.1f} ms exceeds the {args.budget_ms:.1f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
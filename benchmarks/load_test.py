@@ -0,0 +1,369 @@
+"""
+Load generator for concurrent `/ws` and `/ws/pentest` sessions against a running server.
+
+    python server.py                                    # in another shell
+    python benchmarks/load_test.py --stages 5x30,10x30,20x60 --server-pid $(pgrep -f server.py)
+    python benchmarks/load_test.py --saturate --slo-ms 5000 --output saturation.json
+
+Each virtual client keeps one WebSocket open and submits `AgentTask` payloads back to back,
+pointing the agents at the local fixture sites and the OpenAI-compatible fake LLM (both
+started in-process unless `--site-url` / `--llm-url` are given). A stage `NxS` holds N
+clients for S seconds; clients are added or stopped between stages, so a list of stages is
+a ramp profile.
+
+Per stage it reports completed runs per minute, step latency percentiles (time between
+consecutive screenshot frames of one run), run durations, errors, dropped frames (steps
+logged by the agent without a matching screenshot frame) and, with `--server-pid`, the
+server's RSS and CPU sampled once a second (summed over its child processes, i.e. the
+Chromium instances).
+
+`--saturate` doubles the client count stage by stage until p95 step latency exceeds
+`--slo-ms` or the error rate exceeds `--max-error-rate`, then bisects between the last good
+and the first bad count and reports the highest sustainable concurrency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+import websockets
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+SCENARIOS = {
+    "form": ("/form", "Fill in and send the contact form"),
+    "links": ("/links?n=2000", "Open link number 25"),
+    "spa": ("/spa", "Add two widgets to the dashboard"),
+    "tabs": ("/tabs", "Open the details page in a new tab"),
+}
+
+# Log lines that mark one agent step; each step is preceded by one screenshot frame.
+STEP_MARKERS = (
+    "[AGENT] Chose action:",
+    "[AGENT] Replayed cached action:",
+    "[PENTEST AGENT] Calling tool:",
+    "[PENTEST AGENT] LLM provided a final text response",
+)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def summarize_ms(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 1) if values else None,
+        "p95_ms": round(percentile(values, 0.95) * 1000, 1) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 1) if values else None,
+        "max_ms": round(max(values) * 1000, 1) if values else None,
+    }
+
+
+def parse_stages(spec: str):
+    stages = []
+    for part in spec.split(","):
+        clients, seconds = part.lower().split("x")
+        stages.append((int(clients), float(seconds)))
+    return stages
+
+
+class StageStats:
+    """Everything observed by the clients while one stage was active."""
+    def __init__(self, clients: int, duration: float):
+        self.clients = clients
+        self.duration = duration
+        self.runs = 0
+        self.errors = []
+        self.step_latencies = []
+        self.run_durations = []
+        self.steps = 0
+        self.frames = 0
+        self.text_bytes = 0
+        self.binary_bytes = 0
+        self.resources = []
+
+    def as_dict(self) -> dict:
+        attempts = self.runs + len(self.errors)
+        return {
+            "clients": self.clients,
+            "duration_s": self.duration,
+            "runs": self.runs,
+            "runs_per_minute": round(self.runs * 60 / self.duration, 2) if self.duration else None,
+            "steps_per_second": round(self.steps / self.duration, 2) if self.duration else None,
+            "errors": len(self.errors),
+            "error_rate": round(len(self.errors) / attempts, 3) if attempts else 0.0,
+            "error_samples": self.errors[:5],
+            "step_latency": summarize_ms(self.step_latencies),
+            "run_duration": summarize_ms(self.run_durations),
+            "frames": self.frames,
+            "dropped_frames": max(0, self.steps - self.frames),
+            "text_bytes": self.text_bytes,
+            "binary_bytes": self.binary_bytes,
+            "server": summarize_resources(self.resources),
+        }
+
+
+class ProcessSampler:
+    """Samples RSS and CPU of a process and its descendants from /proc (Linux only)."""
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.last_cpu = None
+        self.last_time = None
+
+    def descendants(self) -> list[int]:
+        pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            try:
+                for task in os.listdir(f"/proc/{pid}/task"):
+                    with open(f"/proc/{pid}/task/{task}/children") as f:
+                        pending.extend(int(child) for child in f.read().split())
+            except OSError:
+                continue
+        return pids
+
+    def sample(self) -> Optional[dict]:
+        cpu_ticks, rss_pages = 0, 0
+        for pid in self.descendants():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    # The command name may contain spaces, so split after its closing parenthesis.
+                    fields = f.read().rsplit(")", 1)[1].split()
+                with open(f"/proc/{pid}/statm") as f:
+                    rss_pages += int(f.read().split()[1])
+            except OSError:
+                continue
+            cpu_ticks += int(fields[11]) + int(fields[12])
+
+        now = time.monotonic()
+        cpu_seconds = cpu_ticks / self.clock_ticks
+        sample = {"t": now, "rss_mb": round(rss_pages * self.page_size / 1e6, 1), "cpu_percent": None}
+        if self.last_time is not None and now > self.last_time:
+            sample["cpu_percent"] = round(100 * (cpu_seconds - self.last_cpu) / (now - self.last_time), 1)
+        self.last_cpu, self.last_time = cpu_seconds, now
+        return sample
+
+
+def summarize_resources(samples) -> Optional[dict]:
+    if not samples:
+        return None
+    cpu = [sample["cpu_percent"] for sample in samples if sample["cpu_percent"] is not None]
+    return {
+        "rss_mb_max": max(sample["rss_mb"] for sample in samples),
+        "rss_mb_last": samples[-1]["rss_mb"],
+        "cpu_percent_avg": round(sum(cpu) / len(cpu), 1) if cpu else None,
+        "cpu_percent_max": max(cpu) if cpu else None,
+    }
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.stage = None
+        self.sampler = ProcessSampler(args.server_pid) if args.server_pid else None
+        self.timeline = []
+
+    def build_task(self, index: int) -> str:
+        scenario = self.args.scenarios[index % len(self.args.scenarios)]
+        path, instruction = SCENARIOS[scenario]
+        return json.dumps({
+            "url": f"{self.args.site_url}{path}",
+            "instruction": instruction,
+            "model": "openai",
+            "openaiApiKey": "load-test",
+            "openaiModel": "fake-model",
+            "openaiBaseUrl": self.args.llm_url,
+            "useTrajectoryCache": False,
+        })
+
+    async def run_session(self, websocket):
+        stage = self.stage
+        started = last_frame = time.perf_counter()
+        frames = steps = 0
+        while True:
+            message = await asyncio.wait_for(websocket.recv(), timeout=self.args.run_timeout)
+            now = time.perf_counter()
+            if isinstance(message, bytes):
+                if frames:
+                    stage.step_latencies.append(now - last_frame)
+                frames += 1
+                last_frame = now
+                stage.binary_bytes += len(message)
+                continue
+            stage.text_bytes += len(message)
+            if message.startswith(STEP_MARKERS):
+                steps += 1
+            if message == "[DONE]":
+                break
+        # Attribute the run to the stage that was active when it finished.
+        stage = self.stage
+        stage.runs += 1
+        stage.frames += frames
+        stage.steps += steps
+        stage.run_durations.append(time.perf_counter() - started)
+
+    async def client(self, index: int, stop: asyncio.Event):
+        endpoint = self.args.endpoints[index % len(self.args.endpoints)]
+        url = f"{self.args.server_url}{endpoint}"
+        while not stop.is_set():
+            try:
+                async with websockets.connect(url, max_size=None, open_timeout=30) as websocket:
+                    while not stop.is_set():
+                        await websocket.send(self.build_task(index))
+                        await self.run_session(websocket)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stage.errors.append(f"{endpoint}: {type(e).__name__}: {e}")
+                await asyncio.sleep(1)
+
+    async def sample_resources(self):
+        while True:
+            sample = self.sampler.sample()
+            if sample:
+                self.stage.resources.append(sample)
+                self.timeline.append({"clients": self.stage.clients, **sample})
+            await asyncio.sleep(1)
+
+    async def run_stages(self, stages) -> list[dict]:
+        """Runs a ramp profile; clients persist across stages and are only added or stopped."""
+        clients = []
+        results = []
+        self.stage = StageStats(0, 0)
+        sampler_task = asyncio.create_task(self.sample_resources()) if self.sampler else None
+        try:
+            for count, seconds in stages:
+                self.stage = StageStats(count, seconds)
+                while len(clients) < count:
+                    stop = asyncio.Event()
+                    clients.append((stop, asyncio.create_task(self.client(len(clients), stop))))
+                # Surplus clients finish their current run before disconnecting.
+                while len(clients) > count:
+                    stop, _ = clients.pop()
+                    stop.set()
+                print(f"Stage: {count} clients for {seconds:.0f}s")
+                await asyncio.sleep(seconds)
+                result = self.stage.as_dict()
+                results.append(result)
+                print(f"  runs/min={result['runs_per_minute']} step p95={result['step_latency']['p95_ms']} ms "
+                      f"errors={result['errors']} dropped_frames={result['dropped_frames']}")
+        finally:
+            for stop, task in clients:
+                stop.set()
+                task.cancel()
+            await asyncio.gather(*(task for _, task in clients), return_exceptions=True)
+            if sampler_task:
+                sampler_task.cancel()
+        return results
+
+    def within_slo(self, result: dict) -> bool:
+        p95 = result["step_latency"]["p95_ms"]
+        return (p95 is not None and p95 <= self.args.slo_ms) and result["error_rate"] <= self.args.max_error_rate
+
+    async def saturate(self) -> dict:
+        """Finds the highest client count whose stage stays within the latency SLO and error budget."""
+        probes = {}
+
+        async def probe(count: int) -> bool:
+            # A fresh warm-up + measurement pair per probe, so clients start from a steady state.
+            _, measured = await self.run_stages([(count, self.args.warmup), (count, self.args.stage_seconds)])
+            probes[count] = measured
+            ok = self.within_slo(measured)
+            print(f"  {count} clients: {'within' if ok else 'over'} SLO")
+            return ok
+
+        good, bad = 0, None
+        count = max(1, self.args.start_clients)
+        while count <= self.args.max_clients:
+            if await probe(count):
+                good, count = count, count * 2
+            else:
+                bad = count
+                break
+        if bad is not None:
+            while bad - good > 1:
+                middle = (good + bad) // 2
+                if await probe(middle):
+                    good = middle
+                else:
+                    bad = middle
+        return {"max_sustainable_clients": good, "first_failing_clients": bad, "probes": probes}
+
+
+def start_fixture_servers(args):
+    if not args.site_url:
+        from fixtures.site_server import serve as serve_site
+        server = serve_site(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        args.site_url = f"http://127.0.0.1:{server.server_address[1]}"
+    if not args.llm_url:
+        from fixtures.fake_llm_server import serve as serve_llm
+        server = serve_llm(port=0, latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                           actions=['Scroll("down")', 'Scroll("down")', 'Done("Finished by the fake LLM")'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        args.llm_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+async def run(args) -> dict:
+    load_test = LoadTest(args)
+    results = {
+        "server_url": args.server_url,
+        "endpoints": args.endpoints,
+        "scenarios": args.scenarios,
+        "llm_latency_ms": args.llm_latency_ms,
+    }
+    if args.saturate:
+        results["saturation"] = await load_test.saturate()
+    else:
+        results["stages"] = await load_test.run_stages(parse_stages(args.stages))
+    results["resource_timeline"] = load_test.timeline
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket load test")
+    parser.add_argument("--server-url", default="ws://127.0.0.1:8000")
+    parser.add_argument("--endpoints", default="/ws,/ws/pentest", help="Endpoints assigned to clients round-robin")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--stages", default="5x30,10x30,20x60", help="Ramp profile as CLIENTSxSECONDS,...")
+    parser.add_argument("--site-url", help="Fixture site base URL as seen by the server (default: start one)")
+    parser.add_argument("--llm-url", help="Fake LLM base URL as seen by the server (default: start one)")
+    parser.add_argument("--llm-latency-ms", type=float, default=500)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    parser.add_argument("--server-pid", type=int, help="Sample RSS/CPU of this process and its children")
+    parser.add_argument("--run-timeout", type=float, default=120, help="Seconds without a frame before a run fails")
+    parser.add_argument("--saturate", action="store_true", help="Search for the highest sustainable client count")
+    parser.add_argument("--slo-ms", type=float, default=5000, help="p95 step latency limit for --saturate")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--start-clients", type=int, default=2)
+    parser.add_argument("--max-clients", type=int, default=128)
+    parser.add_argument("--warmup", type=float, default=10, help="Seconds discarded before each saturation probe")
+    parser.add_argument("--stage-seconds", type=float, default=30, help="Measured seconds per saturation probe")
+    parser.add_argument("--output", default="load_results.json")
+    args = parser.parse_args()
+    args.endpoints = args.endpoints.split(",")
+    args.scenarios = args.scenarios.split(",")
+
+    start_fixture_servers(args)
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.saturate:
+        print(f"Max sustainable clients: {results['saturation']['max_sustainable_clients']}")
+
+
+if __name__ == "__main__":
+    main()
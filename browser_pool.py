@@ -0,0 +1,90 @@
+"""
+Browser lifecycle for agent runs.
+
+Interactive runs launch a browser of their own. Batch workers share a small pool of
+Chromium instances instead and give every run its own browser context, which isolates
+cookies and storage at a fraction of the cost of a browser launch.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from playwright.async_api import async_playwright
+
+import metrics
+import tracing
+
+ACTIVE_BROWSERS = metrics.ACTIVE_BROWSERS.labels()
+
+
+async def launch_browser(playwright):
+    browser = await playwright.chromium.launch(headless=True)
+    ACTIVE_BROWSERS.inc()
+    browser.on("disconnected", lambda _: ACTIVE_BROWSERS.dec())
+    return browser
+
+
+class BrowserPool:
+    """A fixed number of shared Chromium instances; runs are spread over the least busy one."""
+    def __init__(self, size: int = 2):
+        self.size = max(1, size)
+        self.playwright = None
+        self.browsers = []
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._lock:
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+
+    async def stop(self):
+        async with self._lock:
+            for browser in self.browsers:
+                try:
+                    await browser.close()
+                except Exception:
+                    pass  # Already gone
+            self.browsers = []
+            if self.playwright is not None:
+                await self.playwright.stop()
+                self.playwright = None
+
+    async def acquire(self):
+        """Returns the connected browser with the fewest open contexts, relaunching crashed ones."""
+        await self.start()
+        async with self._lock:
+            self.browsers = [browser for browser in self.browsers if browser.is_connected()]
+            if len(self.browsers) < self.size:
+                logging.info(f"Launching pooled browser {len(self.browsers) + 1}/{self.size}")
+                self.browsers.append(await launch_browser(self.playwright))
+                return self.browsers[-1]
+            return min(self.browsers, key=lambda browser: len(browser.contexts))
+
+
+@asynccontextmanager
+async def open_page(pool: Optional[BrowserPool] = None, storage_state: Optional[dict] = None):
+    """
+    Yields a fresh page for one run: in a new context on a pooled browser when `pool` is
+    given, otherwise in a browser launched for this run. Both are closed on exit.
+    `storage_state` seeds the context with cookies and localStorage (e.g. from a checkpoint).
+    """
+    if pool is not None:
+        with tracing.span("browser.launch", pooled=True):
+            browser = await pool.acquire()
+            context = await browser.new_context(storage_state=storage_state)
+            page = await context.new_page()
+        try:
+            yield page
+        finally:
+            await context.close()
+        return
+
+    async with async_playwright() as p:
+        with tracing.span("browser.launch"):
+            browser = await launch_browser(p)
+            page = await browser.new_page(storage_state=storage_state)
+        try:
+            yield page
+        finally:
+            await browser.close()
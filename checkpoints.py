@@ -0,0 +1,221 @@
+"""
+Per-step checkpoints so a crashed or interrupted run can be resumed.
+
+After every step an agent saves its history, step count and browser state (URL, open tabs
+and Playwright `storage_state`) under `CHECKPOINTS_DIR/<run key>/`. Screenshots embedded
+in the history are stored once per content hash in `screenshots/` and referenced from the
+JSON, so each checkpoint write only adds the new step's image.
+
+A resumed run restores the context from `storage_state`, reopens the tabs and continues
+the loop at the saved step. The checkpoint is deleted when the run finishes.
+
+Checkpointing is opt-in (`checkpoint`), since `storage_state` holds the session cookies of
+the sites a run logged into. Checkpoint directories are created 0700 and files 0600. Like
+the auth cache, checkpoints belong to the caller that started the run (`caller_scope`):
+only tasks with the same API key can list, resume or delete them, and tasks without an API
+key of their own are not checkpointed.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Optional
+
+import tracing
+from trajectory_cache import caller_scope
+
+CHECKPOINTS_DIR = os.getenv("WEBPILOT_CHECKPOINTS_DIR", "checkpoints")
+
+# Never written to disk; a resume request supplies them again.
+SECRET_FIELDS = {"openaiApiKey", "geminiApiKey"}
+
+IMAGE_REF_PREFIX = "checkpoint-image:"
+
+
+def is_valid_key(key: str) -> bool:
+    # Keys come from clients, so they must not be able to point outside CHECKPOINTS_DIR
+    return bool(key) and os.sep not in key and "/" not in key and not key.startswith(".")
+
+
+def _private_file(path: str, mode: str):
+    """Opens a file for writing that only the server's user can read."""
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), mode)
+
+
+class CheckpointStore:
+    def __init__(self, root: str = CHECKPOINTS_DIR):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        if not is_valid_key(key):
+            raise ValueError(f"Invalid checkpoint key: {key!r}")
+        return os.path.join(self.root, key)
+
+    def _externalize(self, value, screenshots_dir: str):
+        """Replaces inline data-URL images with references to content-addressed files."""
+        if isinstance(value, str) and value.startswith("data:image/"):
+            header, data = value.split(",", 1)
+            digest = hashlib.sha1(data.encode()).hexdigest()
+            image_path = os.path.join(screenshots_dir, f"{digest}.jpg")
+            if not os.path.exists(image_path):
+                with _private_file(image_path, "wb") as f:
+                    f.write(base64.b64decode(data))
+            return f"{IMAGE_REF_PREFIX}{header}:{digest}"
+        if isinstance(value, dict):
+            return {key: self._externalize(item, screenshots_dir) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._externalize(item, screenshots_dir) for item in value]
+        return value
+
+    def _internalize(self, value, screenshots_dir: str):
+        if isinstance(value, str) and value.startswith(IMAGE_REF_PREFIX):
+            header, digest = value[len(IMAGE_REF_PREFIX):].rsplit(":", 1)
+            with open(os.path.join(screenshots_dir, f"{digest}.jpg"), "rb") as f:
+                return f"{header},{base64.b64encode(f.read()).decode()}"
+        if isinstance(value, dict):
+            return {key: self._internalize(item, screenshots_dir) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._internalize(item, screenshots_dir) for item in value]
+        return value
+
+    def save(self, key: str, checkpoint: dict):
+        directory = self.path(key)
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        screenshots_dir = os.path.join(directory, "screenshots")
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.makedirs(screenshots_dir, mode=0o700, exist_ok=True)
+        checkpoint = self._externalize(checkpoint, screenshots_dir)
+        # Write-then-rename, so a crash mid-write leaves the previous checkpoint intact.
+        temp_path = os.path.join(directory, "checkpoint.json.tmp")
+        with _private_file(temp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_path, os.path.join(directory, "checkpoint.json"))
+
+    def _read(self, key: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.path(key), "checkpoint.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _read_owned(self, key: str, scope: str) -> Optional[dict]:
+        checkpoint = self._read(key)
+        if checkpoint is None or not scope or checkpoint.get("scope") != scope:
+            return None
+        return checkpoint
+
+    def owns(self, key: str, scope: str) -> bool:
+        return self._read_owned(key, scope) is not None
+
+    def load(self, key: str, scope: str) -> Optional[dict]:
+        checkpoint = self._read_owned(key, scope)
+        if checkpoint is None:
+            return None
+        return self._internalize(checkpoint, os.path.join(self.path(key), "screenshots"))
+
+    def delete(self, key: str, scope: Optional[str] = None) -> bool:
+        """Deletes a checkpoint; with `scope`, only if it belongs to that caller."""
+        if scope is not None and not self.owns(key, scope):
+            return False
+        shutil.rmtree(self.path(key), ignore_errors=True)
+        return True
+
+    def list(self, scope: str) -> list[dict]:
+        """Summaries of the caller's resumable runs, most recent first."""
+        summaries = []
+        if not scope or not os.path.isdir(self.root):
+            return summaries
+        for key in os.listdir(self.root):
+            checkpoint = self._read_owned(key, scope)
+            if checkpoint is None:
+                continue
+            summaries.append({
+                "key": key,
+                "kind": checkpoint["kind"],
+                "url": checkpoint["task"].get("url"),
+                "instruction": checkpoint["task"].get("instruction"),
+                "step": checkpoint["step"],
+                "current_url": checkpoint["browser"]["url"],
+                "updated_at": checkpoint["updated_at"],
+            })
+        return sorted(summaries, key=lambda summary: summary["updated_at"], reverse=True)
+
+    def resume_task(self, task):
+        """Fills a resume request from its checkpoint; the request only needs to carry API keys."""
+        checkpoint = self._read_owned(task.resumeFrom, caller_scope(task))
+        if checkpoint is None:
+            return task
+        saved = {key: value for key, value in checkpoint["task"].items() if key not in SECRET_FIELDS}
+        return task.model_copy(update=saved)
+
+
+checkpoint_store = CheckpointStore()
+
+
+async def capture_browser(page) -> dict:
+    pages = page.context.pages
+    return {
+        "url": page.url,
+        "tabs": [tab.url for tab in pages],
+        "page_index": pages.index(page) if page in pages else 0,
+        "storage_state": await page.context.storage_state(),
+    }
+
+
+async def restore_browser(page, browser_state: dict):
+    """Reopens the saved tabs in their original order and returns the page the agent was on."""
+    pages = [page]
+    for _ in browser_state["tabs"][1:]:
+        pages.append(await page.context.new_page())
+    for tab, url in zip(pages, browser_state["tabs"]):
+        try:
+            await tab.goto(url)
+        except Exception as e:
+            logging.warning(f"Could not restore tab {url}: {e}")
+    return pages[min(browser_state["page_index"], len(pages) - 1)]
+
+
+class RunCheckpointer:
+    """Saves and loads the checkpoints of one run; a no-op when the task disables checkpoints."""
+    def __init__(self, kind: str, task, store: CheckpointStore = checkpoint_store):
+        self.kind = kind
+        self.task = task
+        self.store = store
+        self.scope = caller_scope(task)
+        # The key doubles as the run key, so it is only reused for the caller's own checkpoint
+        resuming = bool(task.resumeFrom) and store.owns(task.resumeFrom, self.scope)
+        self.key = task.resumeFrom if resuming else uuid.uuid4().hex
+        self.enabled = task.checkpoint and bool(self.scope)
+
+    async def load(self) -> Optional[dict]:
+        if not self.task.resumeFrom or self.key != self.task.resumeFrom:
+            return None
+        checkpoint = await asyncio.to_thread(self.store.load, self.key, self.scope)
+        if checkpoint is None or checkpoint["kind"] != self.kind:
+            return None
+        return checkpoint
+
+    async def save(self, page, step: int, history: list, extra: dict):
+        """`history` must already be serialized (e.g. with `messages_to_dict`)."""
+        if not self.enabled:
+            return
+        with tracing.span(f"{self.kind}.checkpoint", step=step):
+            checkpoint = {
+                "kind": self.kind,
+                "scope": self.scope,
+                "task": self.task.model_dump(exclude=SECRET_FIELDS | {"resumeFrom"}),
+                "step": step,
+                "browser": await capture_browser(page),
+                "history": history,
+                "extra": extra,
+                "updated_at": time.time(),
+            }
+            await asyncio.to_thread(self.store.save, self.key, checkpoint)
+
+    async def finish(self):
+        await asyncio.to_thread(self.store.delete, self.key)
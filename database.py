@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, JSON, DateTime, ForeignKey, LargeBinary, Boolean, DDL
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.dialects.postgresql import JSONB # Import JSONB for PostgreSQL
@@ -25,11 +25,104 @@ class PentestRun(Base):
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String, index=True)
     instruction = Column(String, index=True)
-    report = Column(JSONB)
+    report = Column(JSON().with_variant(JSONB, "postgresql")) # JSONB on Postgres, plain JSON elsewhere (e.g. SQLite for local runs)
     video_url = Column(String, nullable=True)
     screenshot = Column(Text, nullable=True)
 
-Base.metadata.create_all(bind=engine)
+class Batch(Base):
+    __tablename__ = "batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    agent = Column(String) # "agent" or "pentest"
+    status = Column(String, default="running") # running, done
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime)
+    finished_at = Column(DateTime, nullable=True)
+
+class BatchTask(Base):
+    __tablename__ = "batch_tasks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(Integer, ForeignKey("batches.id"), index=True)
+    position = Column(Integer)
+    url = Column(String)
+    instruction = Column(String)
+    task = Column(JSON) # The submitted AgentTask without API keys
+    status = Column(String, default="pending", index=True) # pending, running, done, failed
+    run_id = Column(Integer, nullable=True) # Row in runs / pentest_runs
+    result = Column(JSON().with_variant(JSONB, "postgresql"), nullable=True)
+    error = Column(Text, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class RunEvent(Base):
+    """Logs and status changes of live runs, for the Postgres run-event bus."""
+    __tablename__ = "run_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_key = Column(String, index=True)
+    type = Column(String) # log or status
+    data = Column(Text)
+    created_at = Column(DateTime, index=True)
+
+class RunFrame(Base):
+    """Latest image frame of each live run; frames replace each other instead of piling up."""
+    __tablename__ = "run_frames"
+
+    run_key = Column(String, primary_key=True)
+    data = Column(LargeBinary)
+    live = Column(Boolean, default=False) # Screencast frame rather than a step screenshot
+    updated_at = Column(DateTime, index=True)
+
+class RunOwner(Base):
+    """Caller scope (hash of the API key) that started each run; checked before following or cancelling it."""
+    __tablename__ = "run_owners"
+
+    run_key = Column(String, primary_key=True)
+    scope = Column(String)
+    created_at = Column(DateTime, index=True)
+
+class RunSearchEntry(Base):
+    """Searchable text of a finished run (see run_search.py); one row per runs / pentest_runs row."""
+    __tablename__ = "run_search"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True) # agent or pentest
+    run_id = Column(Integer, index=True)
+    url = Column(String)
+    instruction = Column(Text)
+    summary = Column(Text, nullable=True) # Done() summary, or the pentest report summary
+    findings = Column(Text, nullable=True) # Vulnerability labels and descriptions
+    created_at = Column(DateTime)
+
+class RunSearchFacet(Base):
+    """Facet values of a search entry: severity, owasp and domain."""
+    __tablename__ = "run_search_facets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    entry_id = Column(Integer, ForeignKey("run_search.id"), index=True)
+    facet = Column(String, index=True)
+    value = Column(String, index=True)
+
+# Full-text document of a search entry. Queries must use this exact expression for
+# Postgres to pick the GIN index.
+SEARCH_DOCUMENT = (
+    "to_tsvector('english', coalesce(instruction, '') || ' ' || coalesce(url, '') || ' ' || "
+    "coalesce(summary, '') || ' ' || coalesce(findings, ''))"
+)
+
+event.listen(RunSearchEntry.__table__, "after_create", DDL(
+    f"CREATE INDEX IF NOT EXISTS ix_run_search_document ON run_search USING gin (({SEARCH_DOCUMENT}))"
+).execute_if(dialect="postgresql"))
+# SQLite (local runs) has no tsvector; an FTS5 table keyed by run_search.id stands in.
+event.listen(RunSearchEntry.__table__, "after_create", DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS run_search_fts USING fts5(instruction, url, summary, findings)"
+).execute_if(dialect="sqlite"))
+
+def init_db():
+    """Creates missing tables. Called from the server startup hook rather than at import."""
+    Base.metadata.create_all(bind=engine)
 
 def get_db():
     db = SessionLocal()
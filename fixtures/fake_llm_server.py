@@ -0,0 +1,130 @@
+"""
+A local OpenAI-compatible chat completions server with injectable latency.
+
+Point a task at it with `openaiBaseUrl` (and `hedgeBaseUrl` for a second instance) to
+exercise the agent loop without a real provider:
+
+    python fixtures/fake_llm_server.py --port 8090 --latency-ms 3000 --jitter-ms 500
+    python fixtures/fake_llm_server.py --port 8091 --latency-ms 200
+
+Responses are derived from the request alone, so concurrent sessions do not interfere:
+
+- plain chat requests (Agent) get `--actions[n]`, where n is the number of assistant
+  messages already in the conversation, wrapped in the `{"thinking", "action"}` format;
+- tool-calling requests (PentestAgent) get a `scroll_page` tool call until the conversation
+  holds `--tool-steps` tool results, then a final text answer;
+- structured-output requests (forced tool choice or `json_schema` response format) get
+  `--structured` as their JSON payload.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import argparse
+import json
+import random
+import time
+import uuid
+
+DEFAULT_ACTIONS = ['Scroll("down")', 'Done("Finished by the fake LLM")']
+DEFAULT_STRUCTURED = '{"vulnerabilities": []}'
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    server_version = "FakeLLM/0.1"
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        config = self.server.config
+        delay = max(0.0, config["latency_ms"] + random.uniform(-config["jitter_ms"], config["jitter_ms"])) / 1000
+        time.sleep(delay)
+
+        message, finish_reason = self.build_message(request, config, delay)
+        body = json.dumps({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake-model"),
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": finish_reason,
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def build_message(request: dict, config: dict, delay: float):
+        messages = request.get("messages", [])
+        tool_choice = request.get("tool_choice")
+        response_format = request.get("response_format") or {}
+
+        if isinstance(tool_choice, dict):
+            # with_structured_output(method="function_calling") forces a specific tool
+            name = tool_choice.get("function", {}).get("name", "structured_output")
+            return FakeLLMHandler.tool_call_message(name, config["structured"]), "tool_calls"
+        if response_format.get("type") == "json_schema":
+            return {"role": "assistant", "content": config["structured"]}, "stop"
+        if request.get("tools"):
+            tool_results = sum(1 for message in messages if message.get("role") == "tool")
+            if tool_results < config["tool_steps"]:
+                return FakeLLMHandler.tool_call_message("scroll_page", json.dumps({"direction": "down"})), "tool_calls"
+            return {"role": "assistant", "content": config["structured"]}, "stop"
+
+        step = sum(1 for message in messages if message.get("role") == "assistant")
+        action = config["actions"][min(step, len(config["actions"]) - 1)]
+        content = json.dumps({"thinking": f"Fake LLM step after {delay * 1000:.0f} ms", "action": action})
+        return {"role": "assistant", "content": content}, "stop"
+
+    @staticmethod
+    def tool_call_message(name: str, arguments: str) -> dict:
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": name, "arguments": arguments},
+            }],
+        }
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8090, latency_ms: float = 0, jitter_ms: float = 0,
+          actions: Optional[list[str]] = None, tool_steps: int = 2,
+          structured: str = DEFAULT_STRUCTURED) -> ThreadingHTTPServer:
+    """Creates the fake LLM server; call `serve_forever()` on the result, typically in a thread."""
+    server = ThreadingHTTPServer((host, port), FakeLLMHandler)
+    server.config = {
+        "latency_ms": latency_ms,
+        "jitter_ms": jitter_ms,
+        "actions": actions or DEFAULT_ACTIONS,
+        "tool_steps": tool_steps,
+        "structured": structured,
+    }
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--actions", help="JSON list of action strings to return in order")
+    parser.add_argument("--tool-steps", type=int, default=2, help="Tool calls before a tool-calling conversation ends")
+    parser.add_argument("--structured", default=DEFAULT_STRUCTURED, help="JSON returned for structured-output requests")
+    args = parser.parse_args()
+    actions = json.loads(args.actions) if args.actions else None
+    print(f"Serving fake LLM on http://{args.host}:{args.port}/v1 ({args.latency_ms} ms +/- {args.jitter_ms} ms)")
+    serve(args.host, args.port, args.latency_ms, args.jitter_ms, actions, args.tool_steps, args.structured).serve_forever()
@@ -0,0 +1,127 @@
+"""
+Local fixture sites for benchmarks and offline runs.
+
+    python fixtures/site_server.py --port 8082
+
+Routes:
+    /form           small contact form
+    /links?n=5000   huge list of links
+    /spa            single-page app that mutates its DOM continuously
+    /tabs           link that opens a second tab (/tabs/next)
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+
+FORM_PAGE = """<!doctype html>
+<html>
+<head><title>Contact</title></head>
+<body>
+  <form action="/form/submitted" method="get">
+    <input type="text" name="name" placeholder="Name">
+    <input type="email" name="email" placeholder="Email">
+    <textarea name="message" placeholder="Message"></textarea>
+    <button type="submit">Send</button>
+  </form>
+</body>
+</html>
+"""
+
+SUBMITTED_PAGE = """<!doctype html>
+<html><head><title>Thanks</title></head><body><p>Thanks for your message.</p></body></html>
+"""
+
+SPA_PAGE = """<!doctype html>
+<html>
+<head><title>Dashboard</title></head>
+<body>
+  <button id="add">Add widget</button>
+  <div id="feed"></div>
+  <script>
+    const feed = document.getElementById('feed');
+    let tick = 0;
+    // Re-render a block of rows every 20 ms, like a busy live dashboard
+    setInterval(() => {
+      tick += 1;
+      const rows = [];
+      for (let i = 0; i < 200; i++) {
+        rows.push(`<div role="row" style="height:18px">Row ${i} updated at tick ${tick}</div>`);
+      }
+      feed.innerHTML = rows.join('');
+    }, 20);
+    document.getElementById('add').addEventListener('click', () => {
+      const widget = document.createElement('button');
+      widget.textContent = `Widget ${document.querySelectorAll('button').length}`;
+      document.body.insertBefore(widget, feed);
+    });
+  </script>
+</body>
+</html>
+"""
+
+TABS_PAGE = """<!doctype html>
+<html>
+<head><title>Start</title></head>
+<body><a href="/tabs/next" target="_blank">Open details in a new tab</a></body>
+</html>
+"""
+
+TABS_NEXT_PAGE = """<!doctype html>
+<html>
+<head><title>Details</title></head>
+<body><p>Details page</p><a href="/tabs">Back to start</a></body>
+</html>
+"""
+
+
+def links_page(count: int) -> str:
+    links = "\n".join(f'<li><a href="/links/{i}">Link number {i}</a></li>' for i in range(count))
+    return f"<!doctype html><html><head><title>Links</title></head><body><ul>{links}</ul></body></html>"
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+
+        if parsed.path == "/form":
+            body = FORM_PAGE
+        elif parsed.path == "/form/submitted":
+            body = SUBMITTED_PAGE
+        elif parsed.path == "/links":
+            body = links_page(int(params.get("n", ["5000"])[0]))
+        elif parsed.path.startswith("/links/"):
+            body = f"<html><head><title>{parsed.path}</title></head><body><a href='/links'>Back</a></body></html>"
+        elif parsed.path == "/spa":
+            body = SPA_PAGE
+        elif parsed.path == "/tabs":
+            body = TABS_PAGE
+        elif parsed.path == "/tabs/next":
+            body = TABS_NEXT_PAGE
+        else:
+            self.send_error(404)
+            return
+
+        encoded = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8082) -> ThreadingHTTPServer:
+    """Creates the fixture server; call `serve_forever()` on the result, typically in a thread."""
+    return ThreadingHTTPServer((host, port), SiteHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fixture sites for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    args = parser.parse_args()
+    print(f"Serving fixture sites on http://{args.host}:{args.port}/")
+    serve(args.host, args.port).serve_forever()
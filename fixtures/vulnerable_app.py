@@ -0,0 +1,79 @@
+"""
+A deliberately vulnerable web application for exercising the pentest agent locally.
+
+    python fixtures/vulnerable_app.py --port 8081
+
+DO NOT expose this server outside of localhost.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import html
+
+INDEX_PAGE = """<!doctype html>
+<html>
+<head><title>Vulnerable Fixture</title></head>
+<body>
+  <h1>Vulnerable Fixture</h1>
+  <form action="/search" method="get">
+    <input type="text" name="q" placeholder="Search">
+    <button type="submit">Search</button>
+  </form>
+  <form action="/comment" method="get">
+    <input type="text" name="comment" placeholder="Comment">
+    <button type="submit">Post</button>
+  </form>
+  <form action="/greet" method="get">
+    <input type="text" name="name" placeholder="Your name">
+    <button type="submit">Greet</button>
+  </form>
+</body>
+</html>
+"""
+
+
+class VulnerableHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+
+        if parsed.path == "/":
+            body = INDEX_PAGE
+        elif parsed.path == "/search":
+            # Reflected XSS: the query is written into the page verbatim.
+            body = f"<html><body><p>Results for {params.get('q', [''])[0]}</p><a href='/'>Back</a></body></html>"
+        elif parsed.path == "/comment":
+            # Safe: the comment is HTML-escaped before being rendered.
+            comment = html.escape(params.get('comment', [''])[0])
+            body = f"<html><body><p>Comment: {comment}</p><a href='/'>Back</a></body></html>"
+        elif parsed.path == "/greet":
+            # Attribute injection: the name lands unescaped inside a single-quoted attribute.
+            name = params.get('name', [''])[0]
+            body = f"<html><body><input value='{name}'><p>Hello!</p></body></html>"
+        else:
+            self.send_error(404)
+            return
+
+        encoded = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8081) -> ThreadingHTTPServer:
+    """Creates the fixture server; call `serve_forever()` on the result, typically in a thread."""
+    return ThreadingHTTPServer((host, port), VulnerableHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deliberately vulnerable fixture app")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    print(f"Serving vulnerable fixture on http://{args.host}:{args.port}/")
+    serve(args.host, args.port).serve_forever()
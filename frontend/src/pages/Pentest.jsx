@@ -4,6 +4,7 @@ const Pentest = () => {
   const [runs, setRuns] = useState([]);
   const [url, setUrl] = useState('http://testphp.vulnweb.com/');
   const [instruction, setInstruction] = useState('');
+  const [activeTesting, setActiveTesting] = useState(false);
   const [isRunning, setIsRunning] = useState(false);
   const [logs, setLogs] = useState([]);
   const [imageUrl, setImageUrl] = useState('');
@@ -67,7 +68,7 @@ const Pentest = () => {
       setIsRunning(true);
       setLogs(prevLogs => [...prevLogs, { source: 'client', message: '[CLIENT] Sending pentest task...' }]);
       const settings = JSON.parse(localStorage.getItem('settings')) || {};
-      const task = { url, instruction, ...settings };
+      const task = { url, instruction, activeTesting, ...settings };
       ws.current.send(JSON.stringify(task));
     } else {
       setLogs(prevLogs => [...prevLogs, { source: 'client', message: '[CLIENT] WebSocket not open.' }]);
@@ -105,6 +106,19 @@ const Pentest = () => {
               placeholder="e.g., Find all vulnerabilities"
             ></textarea>
           </div>
+          <div className="flex items-center">
+            <input
+              type="checkbox"
+              id="active-testing-input"
+              className="mr-2"
+              checked={activeTesting}
+              onChange={(e) => setActiveTesting(e.target.checked)}
+              disabled={isRunning}
+            />
+            <label htmlFor="active-testing-input" className="text-gray-700 text-sm font-bold">
+              Active payload testing (only on targets you are authorized to test)
+            </label>
+          </div>
         </div>
         <div className="mt-8">
           <button
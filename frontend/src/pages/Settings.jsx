@@ -6,6 +6,8 @@ const Settings = () => {
   const [geminiApiKey, setGeminiApiKey] = useState('');
   const [openaiModel, setOpenaiModel] = useState('gpt-4o');
   const [geminiModel, setGeminiModel] = useState('gemini-2.5-flash');
+  const [liveView, setLiveView] = useState(false);
+  const [liveViewFps, setLiveViewFps] = useState(5);
 
   useEffect(() => {
     const settings = JSON.parse(localStorage.getItem('settings'));
@@ -15,11 +17,13 @@ const Settings = () => {
       setGeminiApiKey(settings.geminiApiKey || '');
       setOpenaiModel(settings.openaiModel || 'gpt-4o');
       setGeminiModel(settings.geminiModel || 'gemini-2.5-flash');
+      setLiveView(settings.liveView || false);
+      setLiveViewFps(settings.liveViewFps || 5);
     }
   }, []);
 
   const handleSave = () => {
-    const settings = { model, openaiApiKey, geminiApiKey, openaiModel, geminiModel };
+    const settings = { model, openaiApiKey, geminiApiKey, openaiModel, geminiModel, liveView, liveViewFps };
     localStorage.setItem('settings', JSON.stringify(settings));
     alert('Settings saved!');
   };
@@ -121,6 +125,36 @@ const Settings = () => {
             </div>
           </>
         )}
+        <div className="mb-6">
+          <div className="flex items-center">
+            <input
+              type="checkbox"
+              id="live-view"
+              className="mr-2"
+              checked={liveView}
+              onChange={(e) => setLiveView(e.target.checked)}
+            />
+            <label htmlFor="live-view" className="text-gray-700 text-sm font-bold">
+              Live view (stream the browser between steps)
+            </label>
+          </div>
+          {liveView && (
+            <div className="mt-3">
+              <label htmlFor="live-view-fps" className="block text-gray-700 text-sm font-bold mb-2">
+                Live view FPS
+              </label>
+              <input
+                type="number"
+                id="live-view-fps"
+                min="1"
+                max="15"
+                className="shadow appearance-none border rounded w-full py-2 px-3 text-gray-700 leading-tight focus:outline-none focus:shadow-outline"
+                value={liveViewFps}
+                onChange={(e) => setLiveViewFps(Number(e.target.value))}
+              />
+            </div>
+          )}
+        </div>
         <div className="flex justify-end">
           <button
             onClick={handleSave}
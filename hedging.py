@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+
+class LatencyTracker:
+    """
+    Rolling window of call latencies (seconds) for one client, used to derive hedge deadlines.
+    """
+    def __init__(self, window: int = 200, min_samples: int = 10):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Returns the p-th percentile (0-1), or None until enough samples have been seen."""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class HedgeStats:
+    def __init__(self):
+        self.calls = 0
+        self.hedged = 0
+        self.secondary_wins = 0
+        # Estimated from the primary's tail latency, since the cancelled primary's real latency is never seen
+        self.estimated_latency_saved = 0.0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.calls if self.calls else 0.0
+
+    def merge(self, other: "HedgeStats"):
+        self.calls += other.calls
+        self.hedged += other.hedged
+        self.secondary_wins += other.secondary_wins
+        self.estimated_latency_saved += other.estimated_latency_saved
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedge_rate, 3),
+            "secondary_wins": self.secondary_wins,
+            "estimated_latency_saved_ms": round(self.estimated_latency_saved * 1000),
+        }
+
+
+# Process-wide totals; each run merges its own stats in when it finishes.
+hedge_stats = HedgeStats()
+
+
+async def _timed(call, client, tracker: LatencyTracker):
+    start = time.perf_counter()
+    result = await call(client)
+    # Only answered calls are recorded. A cancelled primary's elapsed time is just the time
+    # until the secondary won, which would pull the tail percentile towards the deadline.
+    seconds = time.perf_counter() - start
+    tracker.record(seconds)
+    return result, seconds
+
+
+async def hedged_call(call, primary, secondary, primary_tracker: LatencyTracker,
+                      secondary_tracker: LatencyTracker, deadline: float, stats: HedgeStats):
+    """
+    Runs `call(primary)`; if it has not succeeded within `deadline` seconds, also runs
+    `call(secondary)`. The first call to return without raising wins and the other is cancelled.
+    Returns `(result, client, seconds)`: the winning result, the client that produced it and
+    the latency of that client's call.
+
+    `call` should raise (e.g. ValueError) for responses that do not contain a valid action,
+    so that an unusable fast answer does not beat a usable slow one.
+    """
+    stats.calls += 1
+    start = time.perf_counter()
+    primary_task = asyncio.ensure_future(_timed(call, primary, primary_tracker))
+    tasks = {primary_task}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=deadline)
+        if primary_task in done and primary_task.exception() is None:
+            result, seconds = primary_task.result()
+            return result, primary, seconds
+
+        stats.hedged += 1
+        logging.info(f"Hedging LLM call after {(time.perf_counter() - start) * 1000:.0f} ms")
+        secondary_task = asyncio.ensure_future(_timed(call, secondary, secondary_tracker))
+        tasks = {secondary_task} if primary_task.done() else {primary_task, secondary_task}
+        error = primary_task.exception() if primary_task.done() else None
+
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                result, seconds = task.result()
+                if task is not secondary_task:
+                    return result, primary, seconds
+                stats.secondary_wins += 1
+                # The cancelled primary would have taken at least as long as we waited; its
+                # tail percentile gives an estimate of how much longer it was likely to take.
+                elapsed = time.perf_counter() - start
+                expected = primary_tracker.percentile(0.99) or elapsed
+                stats.estimated_latency_saved += max(0.0, expected - elapsed)
+                return result, secondary, seconds
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        if not primary_task.done():
+            primary_task.cancel()
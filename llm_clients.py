@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+import httpx
+import llm_recording
+from llm_recording import RecordingChatModel, ReplayChatModel
+
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=120.0)
+
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    Keeps one connection pool per running event loop, created on first use. Pooled
+    connections belong to the loop that opened them, while clients in the registry outlive
+    any one loop (worker threads, `asyncio.run` per benchmark run, tests).
+    """
+    def __init__(self, **options):
+        self.options = options
+        self._transports = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(**self.options)
+            return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._transport().handle_async_request(request)
+
+    async def aclose(self):
+        """Closes the pool of the running loop; other loops keep theirs."""
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+# One keep-alive connection pool per loop shared by every OpenAI client in the process,
+# so consecutive runs reuse open TLS connections instead of handshaking again.
+_http_transport = LoopLocalTransport(limits=HTTP_LIMITS)
+_http_async_client = None
+
+
+def shared_http_client() -> httpx.AsyncClient:
+    global _http_async_client
+    if _http_async_client is None:
+        _http_async_client = httpx.AsyncClient(transport=_http_transport)
+    return _http_async_client
+
+
+async def close_http_connections():
+    """Closes the running loop's pooled connections; call it before the loop shuts down."""
+    await _http_transport.aclose()
+
+
+class ClientRegistry:
+    """
+    Process-level cache of chat model clients keyed by (provider, model, API-key hash, options).
+
+    Runnables derived from a client (`bind_tools`, `with_structured_output`) are cached
+    alongside it so they are built once per client rather than once per run.
+    """
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider: str, model: str, api_key: str, options: dict) -> tuple:
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        return (provider, model, key_hash, json.dumps(options, sort_keys=True))
+
+    def get(self, provider: str, model: str, api_key: str, **options):
+        """Returns a cached client, creating it on first use."""
+        key = self.make_key(provider, model, api_key, options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["client"]
+            self.misses += 1
+            client = self._create(provider, model, api_key, options)
+            self._entries[key] = {"client": client, "derived": {}}
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            logging.info(f"Created {provider} client for model {model} ({len(self._entries)} cached)")
+            return client
+
+    def derive(self, client, name: str, factory):
+        """Returns `factory(client)`, cached under `name` for the lifetime of `client` in the registry."""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry["client"] is client:
+                    if name not in entry["derived"]:
+                        entry["derived"][name] = factory(client)
+                    return entry["derived"][name]
+        # The client was evicted in the meantime; build without caching.
+        return factory(client)
+
+    def is_warm(self, client) -> bool:
+        """True when `client` has already served at least one run in this process."""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry["client"] is client:
+                    warm = entry.get("used", False)
+                    entry["used"] = True
+                    return warm
+        return False
+
+    @staticmethod
+    def _create(provider: str, model: str, api_key: str, options: dict):
+        channel = f"{provider}/{model}"
+        if llm_recording.MODE == "replay":
+            return ReplayChatModel(channel)
+
+        # Provider SDKs are slow to import, so only the one actually used gets loaded.
+        if provider == 'gemini':
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            client = ChatGoogleGenerativeAI(model=model, google_api_key=api_key, **options)
+        else:
+            from langchain_openai import ChatOpenAI
+            client = ChatOpenAI(
+                model=model,
+                openai_api_key=api_key,
+                http_async_client=shared_http_client(),
+                **options
+            )
+
+        if llm_recording.MODE == "record":
+            return RecordingChatModel(client, channel)
+        return client
+
+
+registry = ClientRegistry()
+
+
+def _get_provider_client(task, provider: str, model: str, base_url: str, openai_options: dict, gemini_options: dict):
+    if provider == 'gemini':
+        return registry.get('gemini', model or task.geminiModel, task.geminiApiKey, **gemini_options)
+    if base_url:
+        openai_options = {**openai_options, "base_url": base_url}
+    return registry.get('openai', model or task.openaiModel, task.openaiApiKey, **openai_options)
+
+
+def get_chat_client(task, openai_options: dict, gemini_options: dict):
+    """Returns the shared chat client for the provider, model and API key selected by `task`."""
+    return _get_provider_client(task, task.model, '', task.openaiBaseUrl, openai_options, gemini_options)
+
+
+def hedge_target(task) -> tuple:
+    """The (provider, model) of the secondary client; by default the provider not selected by `task.model`."""
+    provider = task.hedgeProvider or ('openai' if task.model == 'gemini' else 'gemini')
+    return provider, task.hedgeModel or (task.geminiModel if provider == 'gemini' else task.openaiModel)
+
+
+def get_hedge_client(task, openai_options: dict, gemini_options: dict):
+    """Returns the secondary client used to hedge slow calls, or None when hedging is disabled."""
+    if not task.hedging:
+        return None
+    provider, model = hedge_target(task)
+    return _get_provider_client(task, provider, model, task.hedgeBaseUrl, openai_options, gemini_options)
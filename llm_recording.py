@@ -0,0 +1,146 @@
+"""
+Record/replay of LLM calls for offline, deterministic agent runs.
+
+    WEBPILOT_LLM_MODE=record WEBPILOT_CASSETTE=runs.jsonl python server.py
+    WEBPILOT_LLM_MODE=replay WEBPILOT_CASSETTE=runs.jsonl WEBPILOT_REPLAY_LATENCY_MS=200 python server.py
+
+In record mode every `ainvoke` made through a registry client (including its `bind_tools`
+and `with_structured_output` variants) is appended to the cassette. In replay mode the
+registry hands out `ReplayChatModel`s instead, which need no API key or network and serve
+the recorded responses back in order, per channel, after a configurable latency
+(`recorded` reproduces the original latencies).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from langchain_core.messages import BaseMessage, messages_to_dict, messages_from_dict
+
+MODE = os.getenv("WEBPILOT_LLM_MODE", "")
+CASSETTE_PATH = os.getenv("WEBPILOT_CASSETTE", "llm_cassette.jsonl")
+REPLAY_LATENCY_MS = os.getenv("WEBPILOT_REPLAY_LATENCY_MS", "0")
+
+
+def _strip_images(value):
+    """Replaces inline base64 images with a digest so cassettes stay small and diffable."""
+    if isinstance(value, str) and value.startswith("data:image/"):
+        return f"<image sha1={hashlib.sha1(value.encode()).hexdigest()}>"
+    if isinstance(value, dict):
+        return {key: _strip_images(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_strip_images(item) for item in value]
+    return value
+
+
+def _serialize_request(messages) -> list:
+    if isinstance(messages, list) and all(isinstance(message, BaseMessage) for message in messages):
+        return _strip_images(messages_to_dict(messages))
+    return _strip_images(messages if isinstance(messages, (dict, list, str)) else repr(messages))
+
+
+def _request_digest(request) -> str:
+    return hashlib.sha1(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _serialize_response(response) -> dict:
+    if isinstance(response, BaseMessage):
+        return {"kind": "message", "data": messages_to_dict([response])[0]}
+    if hasattr(response, "model_dump"):
+        return {"kind": "structured", "data": response.model_dump()}
+    return {"kind": "raw", "data": response}
+
+
+class Cassette:
+    """A JSONL file of recorded calls, grouped by channel for replay."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._queues = None
+
+    def append(self, record: dict):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def next(self, channel: str) -> dict:
+        with self._lock:
+            if self._queues is None:
+                self._queues = defaultdict(deque)
+                with open(self.path) as f:
+                    for line in f:
+                        if line.strip():
+                            record = json.loads(line)
+                            self._queues[record["channel"]].append(record)
+                logging.info(f"Loaded cassette {self.path} with channels {sorted(self._queues)}")
+            if not self._queues[channel]:
+                raise RuntimeError(f"Cassette {self.path} has no more recorded calls for channel '{channel}'")
+            return self._queues[channel].popleft()
+
+
+cassette = Cassette(CASSETTE_PATH)
+
+
+class RecordingChatModel:
+    """Wraps a chat model or runnable and records every `ainvoke` to the cassette."""
+    def __init__(self, inner, channel: str):
+        self.inner = inner
+        self.channel = channel
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        start = time.perf_counter()
+        response = await self.inner.ainvoke(messages, *args, **kwargs)
+        request = _serialize_request(messages)
+        cassette.append({
+            "channel": self.channel,
+            "request_digest": _request_digest(request),
+            "request": request,
+            "response": _serialize_response(response),
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        })
+        return response
+
+    def bind_tools(self, tools, **kwargs):
+        return RecordingChatModel(self.inner.bind_tools(tools, **kwargs), f"{self.channel}+tools")
+
+    def with_structured_output(self, schema, **kwargs):
+        name = getattr(schema, "__name__", "schema")
+        return RecordingChatModel(self.inner.with_structured_output(schema, **kwargs), f"{self.channel}+structured:{name}")
+
+
+class ReplayChatModel:
+    """
+    A fake chat model that returns the responses recorded for its channel, in order.
+    Requests are compared with the recording and differences are logged, not raised, since
+    screenshots and timings legitimately vary between runs.
+    """
+    def __init__(self, channel: str, schema=None, latency_ms: str = REPLAY_LATENCY_MS):
+        self.channel = channel
+        self.schema = schema
+        self.latency_ms = latency_ms
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        record = cassette.next(self.channel)
+        latency_ms = record.get("latency_ms", 0) if self.latency_ms == "recorded" else float(self.latency_ms)
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+        if _request_digest(_serialize_request(messages)) != record["request_digest"]:
+            logging.debug(f"Replay request on '{self.channel}' differs from the recording")
+
+        response = record["response"]
+        if response["kind"] == "message":
+            return messages_from_dict([response["data"]])[0]
+        if response["kind"] == "structured" and self.schema is not None:
+            return self.schema.model_validate(response["data"])
+        return response["data"]
+
+    def bind_tools(self, tools, **kwargs):
+        return ReplayChatModel(f"{self.channel}+tools", latency_ms=self.latency_ms)
+
+    def with_structured_output(self, schema, **kwargs):
+        name = getattr(schema, "__name__", "schema")
+        return ReplayChatModel(f"{self.channel}+structured:{name}", schema=schema, latency_ms=self.latency_ms)
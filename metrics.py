@@ -0,0 +1,182 @@
+"""
+Minimal Prometheus-style metrics, rendered in the text exposition format at `/metrics`.
+
+Label sets are resolved once with `labels(...)` and the returned child is kept by the
+caller, so the hot path is a plain attribute update: no dict building, no allocation
+and no locking (updates happen on the event loop thread).
+"""
+import time
+from bisect import bisect_left
+
+_registry = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Timer:
+    """
+    Reusable context manager that observes elapsed seconds into a histogram child.
+    Not reentrant: keep one per sequential loop (e.g. one per agent for its steps).
+    """
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        _registry.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Returns the cached child for this label set; keep it instead of calling this per update."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, values, child) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            le_label = f'le="{le}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le_label)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Application metrics ---
+
+STEP_DURATION = Histogram("webpilot_step_duration_seconds", "Duration of one agent loop step.", ["agent"])
+LLM_LATENCY = Histogram("webpilot_llm_latency_seconds", "Latency of LLM calls.", ["provider", "model"])
+SCREENSHOT_BYTES = Histogram(
+    "webpilot_screenshot_bytes", "Size of annotated screenshots sent to clients.", ["agent"],
+    buckets=(25_000, 50_000, 100_000, 200_000, 400_000, 800_000, 1_600_000, 3_200_000),
+)
+STATE_TOKENS = Histogram(
+    "webpilot_state_tokens", "Tokens of the browser state sent to the LLM per step.", ["agent", "encoding"],
+    buckets=(50, 100, 250, 500, 1_000, 2_500, 5_000, 10_000, 25_000),
+)
+RUNS = Counter("webpilot_runs_total", "Agent runs started.", ["agent"])
+STEPS = Counter("webpilot_steps_total", "Agent loop steps executed.", ["agent"])
+PARSE_FAILURES = Counter("webpilot_parse_failures_total", "LLM responses that did not parse into an action.", ["stage"])
+TOOL_ERRORS = Counter("webpilot_tool_errors_total", "Pentest tool calls that raised.", ["tool"])
+ACTIVE_BROWSERS = Gauge("webpilot_active_browsers", "Browsers currently launched.")
+QUEUED_TASKS = Gauge("webpilot_queued_tasks", "Interactive tasks accepted but not yet started.")
+BATCH_QUEUE_DEPTH = Gauge("webpilot_batch_queue_depth", "Batch tasks waiting for a worker.")
+DROPPED_FRAMES = Counter("webpilot_dropped_frames_total", "Image frames dropped because the client read too slowly.", ["kind"])
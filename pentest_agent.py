@@ -3,22 +3,31 @@ import os
 import base64
 import json
 import re # Import re for regex
-from typing import Any # Import Any
-from playwright.async_api import async_playwright, Page # Import Page for type hinting
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, FunctionMessage, ToolMessage # Import FunctionMessage and ToolMessage
+from typing import Any, Optional
+from playwright.async_api import Page # Import Page for type hinting
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, FunctionMessage, ToolMessage, messages_to_dict, messages_from_dict # Import FunctionMessage and ToolMessage
 from langchain_core.output_parsers import JsonOutputParser # Import JsonOutputParser
 from langchain_core.runnables import RunnablePassthrough # Import RunnablePassthrough
 from langchain.agents import AgentExecutor, create_tool_calling_agent # Import for tool calling
-from langchain.tools import Tool # Import Tool for dynamic tool creation
+from langchain_core.tools import StructuredTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from utils import draw_bounding_boxes, check_vulnerabilities, generate_report
 import imageio
 from pydantic import BaseModel, Field, RootModel # Import RootModel
 from src.agent_tools.tools import AgentTools # Import AgentTools
 from src.browser_controller.controller import BrowserController # Import BrowserController
+from src.payload_fuzzer.fuzzer import PayloadFuzzer
+from llm_clients import get_chat_client, registry
+from ws_stream import Screencast
+from browser_pool import open_page
+from checkpoints import RunCheckpointer, restore_browser
+from auth_cache import AuthSession
+from state_encoding import StateEncoder, PENTEST_LEGEND, count_tokens
+import tracing
+import metrics
 import logging # Import logging
 import os # Import os for environment variables
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -65,6 +74,7 @@ class Vulnerability(BaseModel):
     severity: str = Field(..., description="The severity of the vulnerability (e.g., 'Low', 'Medium', 'High', 'Critical').")
     description: str = Field(..., description="A detailed description of the specific issue.")
     owasp_category: str = Field(..., description="The relevant OWASP category (e.g., 'A05:2021 - Security Misconfiguration').")
+    evidence: Optional[str] = Field(None, description="Proof collected by active testing (payload, reflection or dialog), if any.")
 
 class VulnerabilityReport(BaseModel):
     vulnerabilities: list[Vulnerability] = Field(..., description="A list of identified vulnerabilities.")
@@ -77,10 +87,39 @@ class BrowserStateSummary(BaseModel):
     report: VulnerabilityReport # Use the Pydantic model for the report
 
 
+def build_tool_schemas() -> list[dict]:
+    """
+    Builds the OpenAI-format schemas for every public AgentTools method. The schemas only
+    depend on the method signatures and docstrings, so they are computed once at import.
+    """
+    agent_tools = AgentTools(BrowserController(None))
+    schemas = []
+    for name in dir(agent_tools):
+        method = getattr(agent_tools, name)
+        if callable(method) and not name.startswith('_'):
+            # Ensure the method has a docstring for description, or provide a default
+            description = getattr(method, '__doc__')
+            if not description: # If docstring is None or empty
+                description = f"A tool for {name} functionality."
+            tool = StructuredTool.from_function(coroutine=method, name=name, description=description)
+            schemas.append(convert_to_openai_tool(tool))
+    return schemas
+
+TOOL_SCHEMAS = build_tool_schemas()
+TOOL_NAMES = {schema["function"]["name"] for schema in TOOL_SCHEMAS}
+
+# Metric children resolved once; updating them on the hot path is a plain attribute write.
+RUNS = metrics.RUNS.labels("pentest")
+STEPS = metrics.STEPS.labels("pentest")
+SCREENSHOT_BYTES = metrics.SCREENSHOT_BYTES.labels("pentest")
+TOOL_ERRORS = {name: metrics.TOOL_ERRORS.labels(name) for name in TOOL_NAMES | {"unknown"}}
+
+
 class PentestAgent:
-    def __init__(self, websocket, task):
+    def __init__(self, websocket, task, browser_pool=None):
         self.websocket = websocket
         self.task = task
+        self.browser_pool = browser_pool # Shared browsers for batch runs; None launches one per run
         self.history = []
         self.frames = []
         self.final_pentest_report = "No report generated."
@@ -89,49 +128,36 @@ class PentestAgent:
         self.intermediate_steps = [] # To store tool outputs
         self.llm_for_tool_calling = None # LLM for tool calling
         self.llm_for_structured_output = None # LLM for final structured output
+        self.confirmed_vulnerabilities = [] # Findings verified by the PayloadFuzzer
 
-        if task.model == 'gemini':
-            self.client = ChatGoogleGenerativeAI(
-                model=task.geminiModel,
-                google_api_key=task.geminiApiKey,
-                config={
-                    "response_mime_type": "application/json"
-                },
-            )
-        else:
-            self.client = ChatOpenAI(
-                model=task.openaiModel,
-                openai_api_key=task.openaiApiKey,
-                model_kwargs={"response_format": {"type": "json_object"}}
-            )
-        
-        # Bind the LLM to the Pydantic model for structured output
-        self.llm_for_structured_output = self.client.with_structured_output(VulnerabilityReport)
-        
-        # Initialize agent_tools here to make its methods available as tools
-        self.agent_tools = AgentTools(BrowserController(None)) # BrowserController will be set in run()
-
-        # Create a list of LangChain tools from AgentTools methods
-        langchain_tools = []
-        for name in dir(self.agent_tools):
-            method = getattr(self.agent_tools, name)
-            if callable(method) and not name.startswith('_'):
-                # Ensure the method has a docstring for description, or provide a default
-                description = getattr(method, '__doc__')
-                if not description: # If docstring is None or empty
-                    description = f"A tool for {name} functionality."
-                langchain_tools.append(
-                    Tool.from_function(
-                        func=method,
-                        name=name,
-                        description=description
-                    )
-                )
-        
-        # Create the tool-calling agent
-        self.llm_for_tool_calling = self.client.bind_tools(langchain_tools)
+        self.client = get_chat_client(
+            task,
+            openai_options={"model_kwargs": {"response_format": {"type": "json_object"}}},
+            gemini_options={"config": {"response_mime_type": "application/json"}},
+        )
+        self.client_warm = registry.is_warm(self.client)
+        self.step_timer = metrics.Timer(metrics.STEP_DURATION.labels("pentest"))
+        self.model_name = task.geminiModel if task.model == 'gemini' else task.openaiModel
+        self.llm_latency = metrics.LLM_LATENCY.labels(task.model, self.model_name)
+        self.screencast = Screencast.for_task(websocket, task)
+        self.checkpointer = RunCheckpointer("pentest", task)
+        self.auth = AuthSession(task)
+
+        # Each step's prompt holds only the current state, so findings are compacted but
+        # page fields are not delta-encoded.
+        self.state_encoder = StateEncoder(delta=False) if task.compactState else None
+        self.state_tokens = metrics.STATE_TOKENS.labels("pentest", "compact" if task.compactState else "json")
+
+        # Bound runnables are cached with the shared client, so they are only built once per client
+        self.llm_for_structured_output = registry.derive(
+            self.client, "structured_output", lambda client: client.with_structured_output(VulnerabilityReport)
+        )
+        self.llm_for_tool_calling = registry.derive(
+            self.client, "tool_calling", lambda client: client.bind_tools(TOOL_SCHEMAS)
+        )
 
     async def run(self):
+        RUNS.inc()
         await self.send_log(f"[PENTEST AGENT] Starting task: {self.task.instruction}")
 
         system_prompt = """
@@ -167,6 +193,7 @@ class PentestAgent:
           ]
         }
         ```
+        Entries in the `report` that carry an `evidence` field were confirmed by active payload testing; keep them and their evidence in your final report.
         If no specific vulnerabilities are found, return an object with an empty `vulnerabilities` array: `{"vulnerabilities": []}`.
 
         You can use the following tools:
@@ -178,98 +205,149 @@ class PentestAgent:
         - finish_task(summary: str): Marks the task as finished and provides a summary.
         """
 
-        self.history.append(SystemMessage(content=system_prompt))
-        self.history.append(HumanMessage(content=f"The task is: {self.task.instruction}"))
+        checkpoint = await self.checkpointer.load()
+        if checkpoint:
+            self.history = messages_from_dict(checkpoint["history"])
+            self.intermediate_steps = messages_from_dict(checkpoint["extra"]["intermediate_steps"])
+            self.confirmed_vulnerabilities = checkpoint["extra"]["confirmed_vulnerabilities"]
+            await self.send_log(f"[PENTEST AGENT] Resuming from the checkpoint after step {checkpoint['step']}")
+        else:
+            if self.task.resumeFrom:
+                await self.send_log(f"[PENTEST AGENT] No checkpoint found for run {self.task.resumeFrom}, starting from scratch")
+            self.history.append(SystemMessage(content=system_prompt))
+            self.history.append(HumanMessage(content=f"The task is: {self.task.instruction}"))
+        await self.send_log(f"[CHECKPOINT]{self.checkpointer.key}")
 
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
+        storage_state = checkpoint["browser"]["storage_state"] if checkpoint else self.auth.storage_state()
+        async with open_page(self.browser_pool, storage_state) as page:
+            if checkpoint:
+                with tracing.span("browser.restore", tabs=len(checkpoint["browser"]["tabs"])):
+                    page = await restore_browser(page, checkpoint["browser"])
             self.browser_controller = BrowserController(page)
-            # Re-initialize agent_tools with the actual browser_controller
+            # Tool schemas are bound once at import; only the instance executing the calls changes.
             self.agent_tools = AgentTools(self.browser_controller)
 
-            # Update the tools in llm_for_tool_calling with the new agent_tools instance
-            # This assumes the structure of tools (names, descriptions) remains the same,
-            # only the underlying methods' 'self' context changes.
-            langchain_tools_updated = []
-            for name in dir(self.agent_tools):
-                method = getattr(self.agent_tools, name)
-                if callable(method) and not name.startswith('_'):
-                    description = getattr(method, '__doc__')
-                    if not description:
-                        description = f"A tool for {name} functionality."
-                    langchain_tools_updated.append(
-                        Tool.from_function(
-                            func=method,
-                            name=name,
-                            description=description
-                        )
-                    )
-            self.llm_for_tool_calling = self.client.bind_tools(langchain_tools_updated)
-
-            await self.browser_controller.navigate(self.task.url)
-
-            for step_count in range(15): # Increased step limit
-                logging.info(f"Agent Step: {step_count + 1}")
+            if not checkpoint:
+                await self.browser_controller.navigate(self.task.url)
+                if await self.auth.check_seeded(page):
+                    await self.send_log(f"[PENTEST AGENT] Reusing the cached session of profile '{self.task.authProfile}'")
+            if self.screencast:
+                await self.screencast.start(page)
+
+            # Active testing ran before the first step, so a resumed run already has its findings
+            if self.task.activeTesting and not checkpoint:
+                await self.send_log("[PENTEST AGENT] Running active payload tests against discovered inputs...")
+                fuzzer = PayloadFuzzer(page.context.browser, page.url)
+                with tracing.span("pentest.active_testing"):
+                    self.confirmed_vulnerabilities = await fuzzer.run(await self.browser_controller.get_dom_state())
+                await self.send_log(f"[PENTEST AGENT] Active testing confirmed {len(self.confirmed_vulnerabilities)} vulnerabilities.")
+
+            for step_count in range(checkpoint["step"] if checkpoint else 0, 15): # Increased step limit
+                STEPS.inc()
+                with tracing.span("pentest.step", step=step_count + 1), self.step_timer:
+                    logging.info(f"Agent Step: {step_count + 1}")
                 
-                # Observe the current state
-                browser_state = await self.observe(page)
-                # Retrieve dom_state directly from the browser controller for screenshot
-                dom_state_for_screenshot = await self.browser_controller.get_dom_state()
-                screenshot_bytes = await self.send_screenshot(page, dom_state_for_screenshot)
-                image_b64 = base64.b64encode(screenshot_bytes).decode()
+                    # Observe the current state
+                    browser_state = await self.observe(page)
+                    # Retrieve dom_state directly from the browser controller for screenshot
+                    dom_state_for_screenshot = await self.browser_controller.get_dom_state()
+                    with tracing.span("pentest.screenshot"):
+                        screenshot_bytes = await self.send_screenshot(page, dom_state_for_screenshot)
+                    image_b64 = base64.b64encode(screenshot_bytes).decode()
                 
-                # Prepare messages for the LLM
-                messages = [
-                    HumanMessage(content=[
-                        {"type": "text", "text": browser_state.model_dump_json()},
+                    # Prepare messages for the LLM
+                    content = [
+                        {"type": "text", "text": await self.encode_state(browser_state)},
                         {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}}
-                    ])
-                ] + self.intermediate_steps # Include previous tool outputs
+                    ]
+                    if self.state_encoder:
+                        # The system prompt is not part of the step messages, so the legend travels with the state
+                        content.insert(0, {"type": "text", "text": PENTEST_LEGEND.strip()})
+                    messages = [HumanMessage(content=content)] + self.intermediate_steps # Include previous tool outputs
 
-                # Get LLM's next action using the tool-calling LLM
-                llm_response = await self.llm_for_tool_calling.ainvoke(messages)
+                    # Get LLM's next action using the tool-calling LLM
+                    llm_start = time.perf_counter()
+                    with tracing.span("pentest.llm", model=self.task.model, messages=len(messages)):
+                        llm_response = await self.llm_for_tool_calling.ainvoke(messages)
+                    self.llm_latency.observe(time.perf_counter() - llm_start)
+                    if step_count == 0:
+                        logging.info(f"First LLM response in {(time.perf_counter() - llm_start) * 1000:.0f} ms (warm client: {self.client_warm})")
                 
-                logging.info(f"LLM Response: {llm_response}")
+                    logging.info(f"LLM Response: {llm_response}")
                 
-                if llm_response.tool_calls:
-                    tool_call = llm_response.tool_calls[0]
-                    tool_name = tool_call['name']
-                    tool_args = tool_call['args']
+                    if llm_response.tool_calls:
+                        tool_call = llm_response.tool_calls[0]
+                        tool_name = tool_call['name']
+                        tool_args = tool_call['args']
                     
-                    await self.send_log(f"[PENTEST AGENT] Calling tool: {tool_name} with args: {tool_args}")
+                        await self.send_log(f"[PENTEST AGENT] Calling tool: {tool_name} with args: {tool_args}")
                     
-                    try:
-                        tool_method = getattr(self.agent_tools, tool_name)
-                        tool_result = await tool_method(**tool_args)
-                        self.intermediate_steps.append(ToolMessage(tool_result, tool_call_id=tool_call['id'])) # Use ToolMessage
-                        await self.send_log(f"[PENTEST AGENT] Tool result: {tool_result}")
-                    except Exception as e:
-                        error_message = f"Error calling tool '{tool_name}': {e}"
-                        logging.error(error_message)
-                        self.intermediate_steps.append(ToolMessage(f'{{"error": "{error_message}"}}', tool_call_id=tool_call['id'])) # Use ToolMessage
-                        await self.send_log(f"[PENTEST AGENT] Tool error: {error_message}")
-                else:
-                    # If LLM doesn't call a tool, it's providing a final text response.
-                    # Now, use the structured output LLM to get the final report.
-                    await self.send_log("[PENTEST AGENT] LLM provided a final text response, generating structured report...")
-                    final_report_response = await self.llm_for_structured_output.ainvoke(messages + [llm_response]) # Pass the last LLM response
+                        try:
+                            tool_method = getattr(self.agent_tools, tool_name)
+                            with tracing.span("pentest.tool", tool=tool_name):
+                                tool_result = await tool_method(**tool_args)
+                            self.intermediate_steps.append(ToolMessage(tool_result, tool_call_id=tool_call['id'])) # Use ToolMessage
+                            await self.send_log(f"[PENTEST AGENT] Tool result: {tool_result}")
+                        except Exception as e:
+                            TOOL_ERRORS.get(tool_name, TOOL_ERRORS["unknown"]).inc()
+                            error_message = f"Error calling tool '{tool_name}': {e}"
+                            logging.error(error_message)
+                            self.intermediate_steps.append(ToolMessage(f'{{"error": "{error_message}"}}', tool_call_id=tool_call['id'])) # Use ToolMessage
+                            await self.send_log(f"[PENTEST AGENT] Tool error: {error_message}")
+                    else:
+                        # If LLM doesn't call a tool, it's providing a final text response.
+                        # Now, use the structured output LLM to get the final report.
+                        await self.send_log("[PENTEST AGENT] LLM provided a final text response, generating structured report...")
+                        with tracing.span("pentest.report"):
+                            final_report_response = await self.llm_for_structured_output.ainvoke(messages + [llm_response]) # Pass the last LLM response
                     
-                    self.final_pentest_report = final_report_response # Store the Pydantic object directly
-                    await self.send_log(f"[PENTEST AGENT] Final Structured Report: {self.final_pentest_report.model_dump_json(indent=2)}")
-                    break # End the loop if LLM provides a final analysis
+                        self.final_pentest_report = final_report_response # Store the Pydantic object directly
+                        await self.send_log(f"[PENTEST AGENT] Final Structured Report: {self.final_pentest_report.model_dump_json(indent=2)}")
+                        break # End the loop if LLM provides a final analysis
+
+                    self.auth.observe_url(page.url)
+                    await self.checkpointer.save(page, step_count + 1, messages_to_dict(self.history), {
+                        "intermediate_steps": messages_to_dict(self.intermediate_steps),
+                        "confirmed_vulnerabilities": self.confirmed_vulnerabilities,
+                    })
 
-            await browser.close()
+            await self.auth.save(page)
+            if self.screencast:
+                await self.screencast.stop()
+        await self.checkpointer.finish()
 
-        await self.send_log("[FINAL_PENTEST_AGENT] Task finished. Saving video...")
-        video_filename = "pentest_agent_run.mp4"
-        imageio.mimsave(video_filename, self.frames, fps=3)
-        await self.send_log(f"[VIDEO]/{video_filename}")
+        video_filename = None
+        if self.frames:
+            await self.send_log("[FINAL_PENTEST_AGENT] Task finished. Saving video...")
+            video_filename = "pentest_agent_run.mp4"
+            with tracing.span("pentest.video", frames=len(self.frames)):
+                imageio.mimsave(video_filename, self.frames, fps=3)
+            await self.send_log(f"[VIDEO]/{video_filename}")
         await self.send_log("[DONE]")
 
         return self.history, video_filename, self.final_pentest_report
 
+    async def encode_state(self, browser_state):
+        with tracing.span("pentest.encode_state") as encode_span:
+            if self.state_encoder:
+                text = self.state_encoder.encode(browser_state.model_dump())
+            else:
+                text = browser_state.model_dump_json()
+            # Tokenizing a large page takes milliseconds, so it runs off the event loop
+            tokens = await asyncio.to_thread(count_tokens, text, self.model_name)
+            self.state_tokens.observe(tokens)
+            encode_span.set(tokens=tokens)
+            if self.state_encoder and tracing.enabled():
+                # The full-JSON size is only needed to compare the encodings in a trace
+                full = browser_state.model_dump_json()
+                encode_span.set(full_json_tokens=await asyncio.to_thread(count_tokens, full, self.model_name))
+        return text
+
     async def observe(self, page: Page):
+        with tracing.span("pentest.observe"):
+            return await self._observe(page)
+
+    async def _observe(self, page: Page):
         page_state = await page.evaluate("""
             () => {
                 return {
@@ -292,7 +370,7 @@ class PentestAgent:
         # The dom_state is now retrieved directly from the browser controller
         dom_state = await self.browser_controller.get_dom_state()
         
-        vulnerabilities = check_vulnerabilities(dom_state)
+        vulnerabilities = check_vulnerabilities(dom_state) + self.confirmed_vulnerabilities
         report_list_of_vulnerabilities = generate_report(vulnerabilities)
         vulnerability_report_instance = VulnerabilityReport(vulnerabilities=report_list_of_vulnerabilities)
         self.final_pentest_report = vulnerability_report_instance # Store the Pydantic object directly
@@ -310,8 +388,12 @@ class PentestAgent:
 
     async def send_screenshot(self, page, elements):
         screenshot_bytes = await page.screenshot(type='jpeg', quality=95)
+        if not self.task.streamFrames:
+            return screenshot_bytes # Headless run: no annotation, streaming or video frames
         self.frames.append(imageio.imread(screenshot_bytes))
         
-        screenshot_with_boxes = draw_bounding_boxes(screenshot_bytes, elements)
+        with tracing.span("pentest.annotate", elements=len(elements)):
+            screenshot_with_boxes = draw_bounding_boxes(screenshot_bytes, elements)
+        SCREENSHOT_BYTES.observe(len(screenshot_with_boxes))
         await self.websocket.send_bytes(screenshot_with_boxes)
         return screenshot_bytes
@@ -0,0 +1,528 @@
+"""
+Run-event bus: decouples the process that runs a browser from the connections watching it.
+
+Agents publish through a `RunPublisher` (a WebSocket stand-in) and clients read a run's
+events with `bus.events(run_key)` from any worker. Every event is a dict:
+
+    {"id": 12, "run": "<run key>", "type": "log" | "frame" | "status", "data": ...}
+
+Frames also carry `"live"`: true for screencast frames, false for step screenshots.
+
+A subscriber first receives the run's backlog (all logs and status changes, then the latest
+frame) and then live events, until a terminal status (`done`, `failed`, `cancelled`).
+Control commands such as `cancel` are broadcast to every worker; the one that owns the run
+acts on them. Each run is claimed by the caller that started it (`claim`/`owner`), so that
+only the same caller may follow or cancel it.
+
+Backends, selected with `WEBPILOT_EVENT_BUS`:
+    memory    single process (the default, and what `uvicorn --workers 1` needs)
+    postgres  LISTEN/NOTIFY on the application database; events are stored in `run_events`
+              and the latest frame of each run in `run_frames`, so notifications stay small
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+EVENT_BUS = os.getenv("WEBPILOT_EVENT_BUS", "memory")
+# How long events of finished runs stay available to late subscribers.
+RUN_EVENT_RETENTION = float(os.getenv("WEBPILOT_RUN_EVENT_RETENTION", str(24 * 3600)))
+# Bounds of the in-memory backend: bytes of event data (mostly frames) and number of runs
+MEMORY_BUS_MAX_BYTES = int(os.getenv("WEBPILOT_EVENT_BUS_MAX_BYTES", str(64 * 1024 * 1024)))
+MEMORY_BUS_MAX_RUNS = int(os.getenv("WEBPILOT_EVENT_BUS_MAX_RUNS", "200"))
+# Seconds between removals of expired events
+PRUNE_INTERVAL = float(os.getenv("WEBPILOT_RUN_EVENT_PRUNE_INTERVAL", "600"))
+# How long a subscription to a run without any events waits for one before ending
+SUBSCRIBE_TIMEOUT = float(os.getenv("WEBPILOT_SUBSCRIBE_TIMEOUT", "30"))
+
+TERMINAL_STATUSES = {"done", "failed", "cancelled"}
+
+EVENT_CHANNEL = "webpilot_run_events"
+CONTROL_CHANNEL = "webpilot_run_control"
+# NOTIFY payloads must be shorter than 8000 bytes; larger logs are fetched from the table instead.
+NOTIFY_LIMIT = 8000
+
+
+def is_terminal(event: dict) -> bool:
+    return event["type"] == "status" and event["data"] in TERMINAL_STATUSES
+
+
+def notify_payload(event_id: int, run_key: str, event_type: str, data: str) -> str:
+    """
+    The NOTIFY payload of a stored log or status event. `data` is inlined only if the
+    serialized payload (JSON-escaped, UTF-8 encoded) stays under the NOTIFY limit.
+    """
+    reference = {"id": event_id, "run": run_key, "type": event_type}
+    encoded = json.dumps({**reference, "data": data})
+    if len(encoded.encode()) < NOTIFY_LIMIT:
+        return encoded
+    return json.dumps(reference)
+
+
+def order_history(events: list, frame: Optional[dict]) -> list:
+    """Backlog order: logs and statuses, with the latest frame before a terminal status."""
+    if frame is None:
+        return events
+    if events and is_terminal(events[-1]):
+        return events[:-1] + [frame, events[-1]]
+    return events + [frame]
+
+
+class EventBus:
+    """Local fan-out to subscribers, shared by the backends."""
+    def __init__(self, subscribe_timeout: float = SUBSCRIBE_TIMEOUT):
+        self.subscribe_timeout = subscribe_timeout
+        self._subscribers = defaultdict(set)
+        self._control_handlers = []
+        self._prune_task = None
+
+    async def start(self):
+        self._prune_task = asyncio.create_task(self._prune_periodically())
+
+    async def stop(self):
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            self._prune_task = None
+
+    async def prune(self):
+        """Drops the events of runs that finished longer than the retention period ago."""
+
+    async def _prune_periodically(self):
+        while True:
+            await asyncio.sleep(PRUNE_INTERVAL)
+            try:
+                await self.prune()
+            except Exception as e:
+                logging.warning(f"Could not prune run events: {e}")
+
+    async def publish(self, run_key: str, event_type: str, data, live: bool = False):
+        """`live` marks screencast frames; it is ignored for other event types."""
+        raise NotImplementedError
+
+    async def claim(self, run_key: str, scope: str):
+        """Records the caller scope that started (or resumed) the run."""
+        raise NotImplementedError
+
+    async def owner(self, run_key: str) -> Optional[str]:
+        """The scope that claimed the run, or None for unknown (or pruned) runs."""
+        raise NotImplementedError
+
+    async def send_control(self, run_key: str, command: str):
+        raise NotImplementedError
+
+    async def history(self, run_key: str) -> list:
+        raise NotImplementedError
+
+    def on_control(self, handler):
+        """Registers `handler(run_key, command)`; it runs on every worker for every command."""
+        self._control_handlers.append(handler)
+
+    def _dispatch(self, event: dict):
+        for queue in self._subscribers.get(event["run"], ()):
+            queue.put_nowait(event)
+
+    def _run_control(self, run_key: str, command: str):
+        for handler in self._control_handlers:
+            try:
+                handler(run_key, command)
+            except Exception as e:
+                logging.error(f"Run control handler failed for {run_key}: {e}", exc_info=True)
+
+    async def events(self, run_key: str):
+        """
+        Yields the backlog and then live events of a run, ending after its terminal status.
+        A run without any events (unknown, pruned or evicted) ends the subscription after
+        `subscribe_timeout` seconds without one.
+        """
+        queue = asyncio.Queue()
+        # Subscribe before reading the backlog so nothing published in between is lost;
+        # events seen in both are skipped by id (frames are idempotent and not deduplicated).
+        self._subscribers[run_key].add(queue)
+        try:
+            last_id = 0
+            history = await self.history(run_key)
+            for event in history:
+                if event["type"] != "frame":
+                    last_id = max(last_id, event["id"])
+                yield event
+                if is_terminal(event):
+                    return
+            started = bool(history)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), None if started else self.subscribe_timeout)
+                except asyncio.TimeoutError:
+                    return
+                started = True
+                if event["type"] != "frame":
+                    if event["id"] <= last_id:
+                        continue
+                    last_id = event["id"]
+                yield event
+                if is_terminal(event):
+                    return
+        finally:
+            self._subscribers[run_key].discard(queue)
+            if not self._subscribers[run_key]:
+                del self._subscribers[run_key]
+
+
+class InMemoryEventBus(EventBus):
+    """
+    Keeps recent runs in process memory; only workers of the same process share it. Memory is
+    bounded by `max_bytes` of event data and `max_runs` runs: finished runs are evicted first
+    (oldest first), then the oldest logs of the largest live runs.
+    """
+    def __init__(self, backlog: int = 2000, retention: float = RUN_EVENT_RETENTION,
+                 max_bytes: int = MEMORY_BUS_MAX_BYTES, max_runs: int = MEMORY_BUS_MAX_RUNS):
+        super().__init__()
+        self.backlog = backlog
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self.max_runs = max_runs
+        self.total_bytes = 0
+        self._ids = itertools.count(1)
+        self._backlogs = defaultdict(deque)
+        self._frames = {}
+        self._sizes = defaultdict(int)
+        self._finished = {}  # run key -> finish time, oldest first
+        self._owners = {}
+
+    async def publish(self, run_key: str, event_type: str, data, live: bool = False):
+        event = {"id": next(self._ids), "run": run_key, "type": event_type, "data": data}
+        if event_type == "frame":
+            event["live"] = live
+            previous = self._frames.get(run_key)
+            if previous is not None:
+                self._account(run_key, -len(previous["data"]))
+            self._frames[run_key] = event
+        else:
+            backlog = self._backlogs[run_key]
+            if len(backlog) >= self.backlog:
+                self._account(run_key, -len(backlog.popleft()["data"]))
+            backlog.append(event)
+        self._account(run_key, len(data))
+        if is_terminal(event):
+            self._finished[run_key] = time.monotonic()
+        self._enforce_limits()
+        self._dispatch(event)
+
+    async def claim(self, run_key: str, scope: str):
+        self._owners[run_key] = scope
+
+    async def owner(self, run_key: str) -> Optional[str]:
+        return self._owners.get(run_key)
+
+    async def send_control(self, run_key: str, command: str):
+        self._run_control(run_key, command)
+
+    async def history(self, run_key: str) -> list:
+        return order_history(list(self._backlogs.get(run_key, ())), self._frames.get(run_key))
+
+    async def prune(self):
+        cutoff = time.monotonic() - self.retention
+        for run_key, finished in list(self._finished.items()):
+            if finished < cutoff:
+                self._drop_run(run_key)
+
+    def stats(self) -> dict:
+        return {"runs": len(self._sizes), "finished_runs": len(self._finished), "bytes": self.total_bytes}
+
+    def _account(self, run_key: str, size: int):
+        self._sizes[run_key] += size
+        self.total_bytes += size
+
+    def _drop_run(self, run_key: str):
+        self.total_bytes -= self._sizes.pop(run_key, 0)
+        self._backlogs.pop(run_key, None)
+        self._frames.pop(run_key, None)
+        self._finished.pop(run_key, None)
+        self._owners.pop(run_key, None)
+
+    def _enforce_limits(self):
+        while (self.total_bytes > self.max_bytes or len(self._sizes) > self.max_runs) and self._finished:
+            self._drop_run(next(iter(self._finished)))
+        while self.total_bytes > self.max_bytes and self._sizes:
+            # Only live runs are left: trim the largest one, keeping its latest frame longest
+            run_key = max(self._sizes, key=self._sizes.get)
+            backlog = self._backlogs.get(run_key)
+            if backlog:
+                self._account(run_key, -len(backlog.popleft()["data"]))
+            elif run_key in self._frames:
+                self._account(run_key, -len(self._frames.pop(run_key)["data"]))
+            else:
+                self._drop_run(run_key)
+
+
+class PostgresEventBus(EventBus):
+    """
+    Fans events out to every worker and replica through LISTEN/NOTIFY. Each worker keeps one
+    dedicated listening connection; notifications are delivered to local subscribers in order.
+    """
+    def __init__(self, retention: float = RUN_EVENT_RETENTION):
+        super().__init__()
+        self.retention = retention
+        self._pooled_connection = None
+        self._listen_connection = None
+        self._notifications = None
+        self._delivery_task = None
+        self._reconnect_task = None
+
+    async def start(self):
+        await self.prune()
+        await super().start()
+        self._notifications = asyncio.Queue()
+        await self._listen()
+        self._delivery_task = asyncio.create_task(self._deliver())
+        logging.info("Run-event bus listening on Postgres")
+
+    async def stop(self):
+        await super().stop()
+        for task in (self._reconnect_task, self._delivery_task):
+            if task is not None:
+                task.cancel()
+        self._close_listener()
+
+    async def prune(self):
+        await asyncio.to_thread(self._prune)
+
+    async def _listen(self):
+        self._listen_connection = await asyncio.to_thread(self._connect_listener)
+        asyncio.get_running_loop().add_reader(self._listen_connection.fileno(), self._on_readable)
+
+    def _close_listener(self):
+        if self._listen_connection is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._listen_connection.fileno())
+        except Exception:
+            pass  # The socket is already gone
+        try:
+            # Discarded rather than returned to the pool, since it is still listening
+            self._pooled_connection.invalidate()
+        except Exception:
+            pass
+        self._listen_connection = None
+
+    def _connect_listener(self):
+        from database import engine
+        # The pool wrapper must stay referenced, or the connection goes back to the pool
+        self._pooled_connection = engine.raw_connection()
+        connection = self._pooled_connection.driver_connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {EVENT_CHANNEL}; LISTEN {CONTROL_CHANNEL};")
+        return connection
+
+    def _on_readable(self):
+        try:
+            self._listen_connection.poll()
+        except Exception as e:
+            logging.warning(f"Run-event listener connection lost: {e}")
+            self._close_listener()
+            if self._reconnect_task is None:
+                self._reconnect_task = asyncio.create_task(self._reconnect())
+            return
+        while self._listen_connection.notifies:
+            notification = self._listen_connection.notifies.pop(0)
+            try:
+                payload = json.loads(notification.payload)
+                if notification.channel == CONTROL_CHANNEL:
+                    self._run_control(payload["run"], payload["command"])
+                elif payload["run"] in self._subscribers:
+                    self._notifications.put_nowait(payload)
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Ignoring malformed run-event notification {notification.payload[:200]!r}: {e}")
+
+    async def _reconnect(self):
+        delay = 1
+        try:
+            while True:
+                try:
+                    self._listen_connection = await asyncio.to_thread(self._connect_listener)
+                    # Notifications sent while disconnected are lost; queue what the subscribed
+                    # runs stored meanwhile ahead of new notifications, which are only read once
+                    # the reader is back. Subscribers skip events they already have by id.
+                    for run_key in list(self._subscribers):
+                        for event in await self.history(run_key):
+                            self._notifications.put_nowait(event)
+                    asyncio.get_running_loop().add_reader(self._listen_connection.fileno(), self._on_readable)
+                    break
+                except Exception as e:
+                    self._close_listener()
+                    logging.warning(f"Run-event listener reconnect failed, retrying in {delay}s: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30)
+            logging.info("Run-event listener reconnected")
+        finally:
+            self._reconnect_task = None
+
+    async def _deliver(self):
+        # One consumer keeps events in notification order even when some need a fetch.
+        while True:
+            payload = await self._notifications.get()
+            try:
+                if payload["type"] == "frame":
+                    event = await asyncio.to_thread(self._fetch_frame, payload["run"])
+                elif "data" not in payload:
+                    event = await asyncio.to_thread(self._fetch_event, payload["id"])
+                else:
+                    event = payload
+                if event is not None:
+                    self._dispatch(event)
+            except Exception as e:
+                logging.error(f"Could not deliver run event {payload}: {e}", exc_info=True)
+
+    async def publish(self, run_key: str, event_type: str, data, live: bool = False):
+        await asyncio.to_thread(self._publish, run_key, event_type, data, live)
+
+    def _publish(self, run_key: str, event_type: str, data, live: bool):
+        from sqlalchemy import select, func
+        from sqlalchemy.dialects.postgresql import insert
+        from database import engine, RunEvent, RunFrame
+
+        now = datetime.now(timezone.utc)
+        with engine.begin() as connection:
+            if event_type == "frame":
+                values = {"data": data, "live": live, "updated_at": now}
+                connection.execute(
+                    insert(RunFrame).values(run_key=run_key, **values)
+                    .on_conflict_do_update(index_elements=[RunFrame.run_key], set_=values)
+                )
+                payload = json.dumps({"run": run_key, "type": "frame"})
+            else:
+                event_id = connection.execute(
+                    insert(RunEvent).values(run_key=run_key, type=event_type, data=data, created_at=now)
+                    .returning(RunEvent.id)
+                ).scalar_one()
+                payload = notify_payload(event_id, run_key, event_type, data)
+            connection.execute(select(func.pg_notify(EVENT_CHANNEL, payload)))
+
+    async def claim(self, run_key: str, scope: str):
+        await asyncio.to_thread(self._claim, run_key, scope)
+
+    def _claim(self, run_key: str, scope: str):
+        from sqlalchemy.dialects.postgresql import insert
+        from database import engine, RunOwner
+
+        values = {"scope": scope, "created_at": datetime.now(timezone.utc)}
+        with engine.begin() as connection:
+            connection.execute(
+                insert(RunOwner).values(run_key=run_key, **values)
+                .on_conflict_do_update(index_elements=[RunOwner.run_key], set_=values)
+            )
+
+    async def owner(self, run_key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._owner, run_key)
+
+    def _owner(self, run_key: str) -> Optional[str]:
+        from database import SessionLocal, RunOwner
+        with SessionLocal() as db:
+            row = db.get(RunOwner, run_key)
+            return row.scope if row else None
+
+    async def send_control(self, run_key: str, command: str):
+        from sqlalchemy import select, func
+        from database import engine
+
+        def notify():
+            with engine.begin() as connection:
+                connection.execute(select(func.pg_notify(CONTROL_CHANNEL, json.dumps({"run": run_key, "command": command}))))
+        await asyncio.to_thread(notify)
+
+    async def history(self, run_key: str) -> list:
+        return await asyncio.to_thread(self._history, run_key)
+
+    def _history(self, run_key: str) -> list:
+        from database import SessionLocal, RunEvent, RunFrame
+        with SessionLocal() as db:
+            rows = db.query(RunEvent).filter(RunEvent.run_key == run_key).order_by(RunEvent.id).all()
+            events = [{"id": row.id, "run": run_key, "type": row.type, "data": row.data} for row in rows]
+            frame_event = _frame_event(db.get(RunFrame, run_key))
+        return order_history(events, frame_event)
+
+    def _fetch_event(self, event_id: int) -> Optional[dict]:
+        from database import SessionLocal, RunEvent
+        with SessionLocal() as db:
+            row = db.get(RunEvent, event_id)
+            return {"id": row.id, "run": row.run_key, "type": row.type, "data": row.data} if row else None
+
+    def _fetch_frame(self, run_key: str) -> Optional[dict]:
+        from database import SessionLocal, RunFrame
+        with SessionLocal() as db:
+            return _frame_event(db.get(RunFrame, run_key))
+
+    def _prune(self):
+        from database import SessionLocal, RunEvent, RunFrame, RunOwner
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.retention)
+        with SessionLocal() as db:
+            db.query(RunEvent).filter(RunEvent.created_at < cutoff).delete()
+            db.query(RunFrame).filter(RunFrame.updated_at < cutoff).delete()
+            db.query(RunOwner).filter(RunOwner.created_at < cutoff).delete()
+            db.commit()
+
+
+def _frame_event(frame) -> Optional[dict]:
+    if frame is None:
+        return None
+    return {"id": 0, "run": frame.run_key, "type": "frame", "data": frame.data, "live": bool(frame.live)}
+
+
+def create_event_bus(backend: str = EVENT_BUS) -> EventBus:
+    if backend == "postgres":
+        return PostgresEventBus()
+    if backend != "memory":
+        raise ValueError(f"Unknown WEBPILOT_EVENT_BUS backend: {backend}")
+    return InMemoryEventBus()
+
+
+class RunPublisher:
+    """
+    WebSocket stand-in handed to agents: what they send is published on the run's channel.
+    `run_key` is set once the agent (and so its checkpoint key) exists.
+
+    Frames go through a single latest-frame slot drained by one task, so they are published
+    one at a time and in order; a frame that arrives while another is being published
+    replaces any frame still waiting.
+    """
+    def __init__(self, bus: EventBus, run_key: str = ""):
+        self.bus = bus
+        self.run_key = run_key
+        self._frame = None  # (data, live) waiting to be published
+        self._frame_task = None
+
+    async def send_text(self, message: str):
+        await self.bus.publish(self.run_key, "log", message)
+
+    async def send_bytes(self, data: bytes, live: bool = False):
+        """Publishes a frame, waiting until it (or a newer one) is on the bus."""
+        self.push_frame(data, live)
+        await self.flush()
+
+    def push_frame(self, data: bytes, live: bool = False):
+        """Synchronous variant for event callbacks such as screencast frames."""
+        self._frame = (data, live)
+        if self._frame_task is None:
+            self._frame_task = asyncio.create_task(self._publish_frames())
+
+    async def flush(self):
+        """Waits until no frame is left to publish."""
+        if self._frame_task is not None:
+            await asyncio.shield(self._frame_task)
+
+    async def _publish_frames(self):
+        try:
+            while self._frame is not None:
+                data, live = self._frame
+                self._frame = None
+                try:
+                    await self.bus.publish(self.run_key, "frame", data, live)
+                except Exception as e:
+                    logging.warning(f"Could not publish a frame of run {self.run_key}: {e}")
+        finally:
+            self._frame_task = None
@@ -0,0 +1,258 @@
+"""
+Server-side search over run history.
+
+Each finished run gets a `run_search` row holding its instruction, URL, final summary and
+vulnerability findings, plus `run_search_facets` rows for its severities, OWASP categories
+and domain. Full-text matching uses a GIN index over a `tsvector` on Postgres and an FTS5
+table on SQLite, so the History page no longer has to download every run.
+
+Runs saved before the index existed are added by `backfill` at startup.
+"""
+import html
+import json
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import urlsplit
+
+from sqlalchemy import select, func, text, literal_column, column, bindparam, Integer, Float
+
+from database import SessionLocal, Run, PentestRun, RunSearchEntry, RunSearchFacet, SEARCH_DOCUMENT
+
+FACETS = ("severity", "owasp", "domain")
+# Values returned per facet, most frequent first
+FACET_LIMIT = 20
+BACKFILL_CHUNK_SIZE = 500
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+# The database marks matches with these; the text is HTML-escaped before they become <mark> tags.
+# Stored text is untrusted (pentest findings hold literal XSS payloads).
+MATCH_START = "\ue000"
+MATCH_STOP = "\ue001"
+# Highlighted fields, in run_search_fts column order
+HIGHLIGHT_FIELDS = ("instruction", "url", "summary", "findings")
+
+DONE_ACTION = re.compile(r"^\s*Done\((.*)\)\s*$", re.DOTALL)
+
+FTS_INSERT = text(
+    "INSERT INTO run_search_fts (rowid, instruction, url, summary, findings) "
+    "VALUES (:id, :instruction, :url, :summary, :findings)"
+)
+FTS_MATCH = text("SELECT rowid AS id, rank FROM run_search_fts WHERE run_search_fts MATCH :query")
+# Short fields are highlighted whole, long ones cut to snippets around the matches
+FTS_HIGHLIGHT = text(
+    "SELECT rowid, highlight(run_search_fts, 0, :start, :stop), highlight(run_search_fts, 1, :start, :stop), "
+    "snippet(run_search_fts, 2, :start, :stop, '...', 30), snippet(run_search_fts, 3, :start, :stop, '...', 30) "
+    "FROM run_search_fts WHERE run_search_fts MATCH :query AND rowid IN :ids"
+).bindparams(bindparam("ids", expanding=True))
+
+
+def domain_of(url: str) -> str:
+    host = urlsplit(url if "://" in url else f"http://{url}").hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def agent_summary(logs: Optional[str]) -> str:
+    """The summary of the run's final Done() action, if it reached one."""
+    try:
+        messages = json.loads(logs or "[]")
+    except ValueError:
+        return ""
+    for message in reversed(messages):
+        content = message.get("data", {}).get("content") if message.get("type") == "ai" else None
+        if not isinstance(content, str):
+            continue
+        try:
+            action = json.loads(content[content.find("{"):content.rfind("}") + 1]).get("action", "")
+        except (ValueError, AttributeError):
+            continue
+        match = DONE_ACTION.match(action or "")
+        if match:
+            return match.group(1).strip().strip('"\'')
+    return ""
+
+
+def facet_value(facet: str, value: str) -> str:
+    """The stored form of a facet value; applied to indexed values and to filters alike."""
+    if facet == "severity":
+        return value.strip().capitalize()
+    if facet == "domain":
+        return domain_of(value.strip().lower())
+    return value.strip()
+
+
+def _entry_for(kind: str, run) -> tuple:
+    """Builds the search entry and facet values of a runs / pentest_runs row."""
+    facets = {("domain", run.url or "")}
+    if kind == "pentest":
+        report = run.report if isinstance(run.report, dict) else {}
+        vulnerabilities = report.get("vulnerabilities") or []
+        summary = report.get("summary", "")
+        findings = "\n".join(f"{v.get('label', '')}: {v.get('description', '')}" for v in vulnerabilities)
+        for vulnerability in vulnerabilities:
+            if vulnerability.get("severity"):
+                facets.add(("severity", vulnerability["severity"]))
+            if vulnerability.get("owasp_category"):
+                facets.add(("owasp", vulnerability["owasp_category"]))
+    else:
+        summary = agent_summary(run.logs)
+        findings = ""
+    entry = RunSearchEntry(kind=kind, run_id=run.id, url=run.url, instruction=run.instruction,
+                           summary=summary, findings=findings, created_at=datetime.now(timezone.utc))
+    facets = {(facet, facet_value(facet, value)) for facet, value in facets}
+    return entry, sorted((facet, value) for facet, value in facets if value)
+
+
+def _add(db, kind: str, run):
+    entry, facets = _entry_for(kind, run)
+    db.add(entry)
+    db.flush()
+    db.add_all(RunSearchFacet(entry_id=entry.id, facet=facet, value=value) for facet, value in facets)
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(FTS_INSERT, {field: getattr(entry, field) or "" for field in HIGHLIGHT_FIELDS} | {"id": entry.id})
+
+
+def index_run(db, kind: str, run):
+    """Adds a saved run to the search index. Indexing errors are logged, never raised to the run."""
+    try:
+        _add(db, kind, run)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logging.warning(f"Could not index {kind} run {run.id} for search: {e}")
+
+
+def backfill():
+    """Indexes runs saved before the search index existed (or while indexing failed)."""
+    db = SessionLocal()
+    try:
+        for kind, model in (("agent", Run), ("pentest", PentestRun)):
+            indexed = select(RunSearchEntry.run_id).where(RunSearchEntry.kind == kind)
+            count = 0
+            while True:
+                runs = db.query(model).filter(model.id.not_in(indexed)).order_by(model.id).limit(BACKFILL_CHUNK_SIZE).all()
+                if not runs:
+                    break
+                for run in runs:
+                    _add(db, kind, run)
+                db.commit()
+                count += len(runs)
+            if count:
+                logging.info(f"Indexed {count} existing {kind} runs for search")
+    finally:
+        db.close()
+
+
+def fts_query(q: str) -> str:
+    """Turns free text into an FTS5 query matching all words, so user input cannot break its syntax."""
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", q))
+
+
+def search(db, q: str = "", kind: Optional[str] = None, filters: Optional[dict] = None,
+           offset: int = 0, limit: int = 20) -> dict:
+    """
+    Matches `q` against instruction, URL, summary and findings; `filters` maps facet names to
+    a required value. Returns a page of highlighted results (best match first, or newest first
+    without `q`), the total and facet counts over all matches.
+    """
+    postgres = db.get_bind().dialect.name == "postgresql"
+    query = db.query(RunSearchEntry)
+    if kind:
+        query = query.filter(RunSearchEntry.kind == kind)
+    for facet, value in (filters or {}).items():
+        if value:
+            value = facet_value(facet, value)
+            query = query.filter(RunSearchEntry.id.in_(
+                select(RunSearchFacet.entry_id).where(RunSearchFacet.facet == facet, RunSearchFacet.value == value)
+            ))
+
+    order = [RunSearchEntry.id.desc()]
+    if q.strip() and postgres:
+        tsquery = func.websearch_to_tsquery("english", q)
+        document = literal_column(SEARCH_DOCUMENT)
+        query = query.filter(document.op("@@")(tsquery))
+        order.insert(0, func.ts_rank_cd(document, tsquery).desc())
+    elif not postgres and fts_query(q):
+        matches = FTS_MATCH.bindparams(query=fts_query(q)).columns(
+            column("id", Integer), column("rank", Float)
+        ).subquery("matches")
+        query = query.join(matches, matches.c.id == RunSearchEntry.id)
+        order.insert(0, matches.c.rank)  # bm25: lower is better
+
+    total = query.count()
+    entries = query.order_by(*order).offset(offset).limit(limit).all()
+    ids = [entry.id for entry in entries]
+    highlights = _highlights(db, postgres, q, ids) if q.strip() else {}
+    entry_facets = _entry_facets(db, ids)
+
+    return {
+        "total": total,
+        "results": [
+            {
+                "kind": entry.kind,
+                "run_id": entry.run_id,
+                "url": entry.url,
+                "instruction": entry.instruction,
+                "summary": entry.summary,
+                "facets": entry_facets.get(entry.id, {}),
+                "highlights": highlights.get(entry.id, {}),
+            }
+            for entry in entries
+        ],
+        "facets": _facet_counts(db, query.with_entities(RunSearchEntry.id).subquery()),
+        "next_offset": offset + limit if offset + limit < total else None,
+    }
+
+
+def _facet_counts(db, matching) -> dict:
+    """Number of matching runs per facet value."""
+    count = func.count(RunSearchFacet.id)
+    rows = (
+        db.query(RunSearchFacet.facet, RunSearchFacet.value, count)
+        .filter(RunSearchFacet.entry_id.in_(select(matching.c.id)))
+        .group_by(RunSearchFacet.facet, RunSearchFacet.value)
+        .order_by(count.desc(), RunSearchFacet.value)
+        .all()
+    )
+    counts = {facet: [] for facet in FACETS}
+    for facet, value, n in rows:
+        if len(counts.setdefault(facet, [])) < FACET_LIMIT:
+            counts[facet].append({"value": value, "count": n})
+    return counts
+
+
+def _entry_facets(db, ids: list) -> dict:
+    values = {}
+    if ids:
+        for row in db.query(RunSearchFacet).filter(RunSearchFacet.entry_id.in_(ids)).order_by(RunSearchFacet.id):
+            values.setdefault(row.entry_id, {}).setdefault(row.facet, []).append(row.value)
+    return values
+
+
+def highlight_html(marked: str) -> str:
+    """HTML-escapes highlighted text, keeping only the <mark> tags around matches as markup."""
+    return html.escape(marked).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_STOP, HIGHLIGHT_STOP)
+
+
+def _highlights(db, postgres: bool, q: str, ids: list) -> dict:
+    """Fields of the given entries that match `q`, as HTML with matches wrapped in <mark> tags."""
+    if not ids:
+        return {}
+    if postgres:
+        tsquery = func.websearch_to_tsquery("english", q)
+        options = f'StartSel="{MATCH_START}", StopSel="{MATCH_STOP}", MaxFragments=2, MaxWords=30'
+        columns = [func.ts_headline("english", func.coalesce(getattr(RunSearchEntry, field), ""), tsquery, options)
+                   for field in HIGHLIGHT_FIELDS]
+        rows = db.query(RunSearchEntry.id, *columns).filter(RunSearchEntry.id.in_(ids)).all()
+    else:
+        if not fts_query(q):
+            return {}
+        rows = db.execute(FTS_HIGHLIGHT, {"query": fts_query(q), "ids": ids, "start": MATCH_START,
+                                          "stop": MATCH_STOP}).all()
+    return {
+        row[0]: {field: highlight_html(value) for field, value in zip(HIGHLIGHT_FIELDS, row[1:])
+                 if value and MATCH_START in value}
+        for row in rows
+    }
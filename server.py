@@ -1,22 +1,30 @@
 import asyncio
+import importlib
 import logging
 import base64
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, BackgroundTasks
-from fastapi.responses import HTMLResponse, FileResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, BackgroundTasks, HTTPException, Header
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import FileResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from pathlib import Path
 from dotenv import load_dotenv
 import os
-from agent import Agent
-from pentest_agent import PentestAgent
-from database import SessionLocal, engine, Run, PentestRun, get_db
+from trajectory_cache import trajectory_cache, caller_scope, key_scope
+import tracing
+from ws_stream import FrameStream
+from batch_runner import batch_runner, progress, AGENT_KINDS
+from checkpoints import checkpoint_store
+from auth_cache import auth_cache
+from run_events import create_event_bus, is_terminal, RunPublisher
+import run_search
+import metrics
+from database import SessionLocal, engine, Run, PentestRun, Batch, get_db, init_db
 from sqlalchemy.orm import Session
 from fastapi import Depends
 import json
-from langchain_core.messages import messages_to_dict
 
 # Load environment variables based on ENV setting
 env_path = Path('.') / '.env.dev'
@@ -27,7 +35,61 @@ load_dotenv(dotenv_path=env_path)
 logging.basicConfig(level=logging.INFO)
 is_prod = os.getenv("ENV") == "prod"
 
-app = FastAPI()
+# Agent modules pull in LangChain, imageio and Playwright. They are imported lazily so the
+# server can bind its port quickly, and preloaded in the background once it is up.
+AGENT_MODULES = ("agent", "pentest_agent")
+
+readiness = {"database": False, "agents": False}
+
+QUEUED_TASKS = metrics.QUEUED_TASKS.labels()
+BATCH_QUEUE_DEPTH = metrics.BATCH_QUEUE_DEPTH.labels()
+
+# Runs publish logs, frames and status here; any worker can serve a client following a run.
+run_bus = create_event_bus()
+# Runs executing on this worker, by run key
+active_runs = {}
+
+def handle_run_control(key: str, command: str):
+    run = active_runs.get(key)
+    if run is not None and command == "cancel":
+        run.cancel()
+
+async def prepare_service():
+    delay = 1
+    while not readiness["database"]:
+        try:
+            await asyncio.to_thread(init_db)
+            readiness["database"] = True
+        except Exception as e:
+            logging.warning(f"Database not ready, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+    try:
+        await asyncio.to_thread(run_search.backfill)
+    except Exception as e:
+        logging.warning(f"Could not index existing runs for search: {e}")
+    run_bus.on_control(handle_run_control)
+    await run_bus.start()
+    for module_name in AGENT_MODULES:
+        await asyncio.to_thread(importlib.import_module, module_name)
+    readiness["agents"] = True
+    logging.info("Service ready")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    prepare_task = asyncio.create_task(prepare_service())
+    yield
+    prepare_task.cancel()
+    for run in active_runs.values():
+        run.cancel()
+    await asyncio.gather(*active_runs.values(), return_exceptions=True)
+    await batch_runner.stop()
+    await run_bus.stop()
+    if readiness["agents"]:
+        # Loaded with the agent modules; close the pooled LLM connections of this loop
+        await importlib.import_module("llm_clients").close_http_connections()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS Middleware
 app.add_middleware(
@@ -38,6 +100,49 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.get("/api/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/api/ready")
+async def ready():
+    status_code = 200 if all(readiness.values()) else 503
+    return JSONResponse(status_code=status_code, content=readiness)
+
+@app.get("/metrics")
+async def get_metrics():
+    BATCH_QUEUE_DEPTH.set(batch_runner.queue_depth())
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/trajectory-cache")
+async def get_trajectory_cache_stats():
+    return trajectory_cache.stats()
+
+@app.get("/api/auth-cache")
+async def get_auth_cache_stats():
+    return auth_cache.stats()
+
+@app.delete("/api/auth-cache")
+async def clear_auth_cache(profile: str = None, x_api_key: str = Header("")):
+    # Only the caller's own sessions; callers without an API key have none
+    await asyncio.to_thread(auth_cache.clear, key_scope(x_api_key), profile)
+    return auth_cache.stats()
+
+# Checkpoints belong to the caller that started the run, identified by the API key it used
+@app.get("/api/checkpoints")
+async def get_checkpoints(x_api_key: str = Header("")):
+    return await asyncio.to_thread(checkpoint_store.list, key_scope(x_api_key))
+
+@app.delete("/api/checkpoints/{key}")
+async def delete_checkpoint(key: str, x_api_key: str = Header("")):
+    try:
+        deleted = await asyncio.to_thread(checkpoint_store.delete, key, key_scope(x_api_key))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Checkpoint not found")
+    return {"deleted": key}
+
 @app.get("/video/{filename}")
 async def get_video(filename: str):
     return FileResponse(filename, media_type="video/mp4")
@@ -52,66 +157,252 @@ async def get_pentest_runs(db: Session = Depends(get_db)):
     runs = db.query(PentestRun).all()
     return runs
 
+@app.get("/api/search")
+async def search_runs(q: str = "", kind: str = None, severity: str = None, owasp: str = None, domain: str = None,
+                      offset: int = 0, limit: int = 20, db: Session = Depends(get_db)):
+    """
+    Full-text search over instruction, URL, final summary and pentest findings, with facet
+    counts (severity, owasp, domain) over all matches. Facet parameters filter by exact value.
+    """
+    if kind is not None and kind not in AGENT_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {AGENT_KINDS}")
+    filters = {"severity": severity, "owasp": owasp, "domain": domain}
+    return run_search.search(db, q, kind=kind, filters=filters, offset=max(offset, 0), limit=min(max(limit, 1), 100))
 
+def trace_response(kind: str, run_id: int):
+    path = tracing.trace_path(kind, run_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No trace recorded for this run. Send tasks with \"tracing\": true.")
+    return FileResponse(path, media_type="application/json", filename=f"{kind}_{run_id}_trace.json")
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)):
-    await websocket.accept()
-    logging.info(f"UI Client connected from {websocket.client.host}:{websocket.client.port}")
+@app.get("/api/runs/{run_id}/trace")
+async def get_run_trace(run_id: int):
+    return trace_response("run", run_id)
+
+@app.get("/api/pentest-runs/{run_id}/trace")
+async def get_pentest_run_trace(run_id: int):
+    return trace_response("pentest_run", run_id)
+
+
+
+# Tasks are stored and queued in chunks while an NDJSON upload is still being read.
+BATCH_CHUNK_SIZE = 500
+
+def parse_batch_entry(entry, line_number: int):
     try:
-        while True:
-            data = await websocket.receive_text()
-            task = AgentTask.model_validate_json(data)
-            
-            agent = Agent(websocket, task)
-            logs, video_filename = await agent.run()
+        if isinstance(entry, (bytes, str)):
+            return AgentTask.model_validate_json(entry), None
+        return AgentTask.model_validate(entry), None
+    except ValidationError as e:
+        return None, f"Invalid task #{line_number}: {e.errors(include_url=False)}"
 
-            # Convert logs to a serializable format
-            serializable_logs = messages_to_dict(logs)
+@app.post("/api/batches", status_code=202)
+async def create_batch(request: Request, agent: str = "agent", db: Session = Depends(get_db)):
+    """
+    Accepts a JSON list of tasks (or {"tasks": [...]}), or an NDJSON stream with one task per
+    line (Content-Type: application/x-ndjson). Invalid entries are recorded as failed tasks.
+    """
+    if agent not in AGENT_KINDS:
+        raise HTTPException(status_code=400, detail=f"agent must be one of {AGENT_KINDS}")
 
-            # Save the run to the database
-            run = Run(
-                url=task.url,
-                instruction=task.instruction,
-                logs=json.dumps(serializable_logs),
-                video_url=video_filename
-            )
-            db.add(run)
-            db.commit()
-            db.refresh(run)
+    ndjson = "ndjson" in request.headers.get("content-type", "")
+    if not ndjson:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON list of tasks or NDJSON")
+        entries = body.get("tasks") if isinstance(body, dict) else body
+        if not isinstance(entries, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON list of tasks or NDJSON")
 
-    except WebSocketDisconnect:
-        logging.info(f"UI Client disconnected from {websocket.client.host}:{websocket.client.port}")
+    batch = batch_runner.create_batch(db, agent)
+    chunk = []  # Parsed entries not stored yet
+    # Whatever happens to the upload, the batch must leave "submitting" to finish its queued tasks
+    try:
+        if not ndjson:
+            for start in range(0, len(entries), BATCH_CHUNK_SIZE):
+                chunk = [parse_batch_entry(entry, start + i + 1)
+                         for i, entry in enumerate(entries[start:start + BATCH_CHUNK_SIZE])]
+                batch_runner.add_tasks(db, batch, chunk)
+                chunk = []
+        else:
+            buffer, line_number = b"", 0
+            async for data in request.stream():
+                *lines, buffer = (buffer + data).split(b"\n")
+                for line in lines:
+                    line_number += 1
+                    if line.strip():
+                        chunk.append(parse_batch_entry(line, line_number))
+                if len(chunk) >= BATCH_CHUNK_SIZE:
+                    batch_runner.add_tasks(db, batch, chunk)
+                    chunk = []
+            if buffer.strip():
+                chunk.append(parse_batch_entry(buffer, line_number + 1))
+            if chunk:
+                batch_runner.add_tasks(db, batch, chunk)
+                chunk = []
     except Exception as e:
-        logging.error(f"An error occurred in the websocket endpoint: {e}", exc_info=True)
+        # Tasks received so far still run; the interruption is recorded as a failed task, so
+        # the batch shows why it has fewer tasks than were sent
+        logging.warning(f"Submission of batch {batch.id} was interrupted: {e!r}")
+        db.rollback()
+        batch_runner.add_tasks(db, batch, chunk + [(None, f"Submission interrupted: {type(e).__name__}: {e}")])
+        raise
+    finally:
+        batch_runner.finish_submission(db, batch)
+    return progress(batch)
 
-@app.websocket("/ws/pentest")
-async def pentest_websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)):
-    await websocket.accept()
-    logging.info(f"UI Client connected from {websocket.client.host}:{websocket.client.port} for pentesting")
+def get_batch_or_404(db: Session, batch_id: int) -> Batch:
+    batch = db.get(Batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+@app.get("/api/batches/{batch_id}")
+async def get_batch_results(batch_id: int, offset: int = 0, limit: int = 100, status: str = None, db: Session = Depends(get_db)):
+    batch = get_batch_or_404(db, batch_id)
+    return batch_runner.page(db, batch, offset=offset, limit=min(max(limit, 0), 1000), status=status)
+
+@app.get("/api/batches/{batch_id}/events")
+async def get_batch_events(batch_id: int, db: Session = Depends(get_db)):
+    get_batch_or_404(db, batch_id)
+    return StreamingResponse(batch_runner.events(batch_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+async def _run_and_save(kind: str, agent, publisher: RunPublisher, task, tracer):
+    """Runs an agent to completion, saves the run and publishes its final status."""
+    key = agent.checkpointer.key
+    status = "failed"
+    QUEUED_TASKS.dec()  # Counted as queued from acceptance in execute_run until here
     try:
-        while True:
-            data = await websocket.receive_text()
-            task = AgentTask.model_validate_json(data)
-            
-            agent = PentestAgent(websocket, task)
-            logs, video_filename, report = await agent.run()
+        await run_bus.claim(key, caller_scope(task))
+        await run_bus.publish(key, "status", "running")
+        with tracing.activate(tracer):
+            if kind == "pentest":
+                with tracing.span("pentest.run"):
+                    logs, video_filename, report = await agent.run()
+                report = report.model_dump() if hasattr(report, "model_dump") else {"summary": str(report)}
+                run = PentestRun(url=task.url, instruction=task.instruction, report=report, video_url=video_filename)
+            else:
+                from langchain_core.messages import messages_to_dict
+                with tracing.span("agent.run"):
+                    logs, video_filename = await agent.run()
+                run = Run(url=task.url, instruction=task.instruction,
+                          logs=json.dumps(messages_to_dict(logs)), video_url=video_filename)
 
             # Save the run to the database
-            run = PentestRun(
-                url=task.url,
-                instruction=task.instruction,
-                report=report.model_dump(), # Pass the dictionary representation
-                video_url=video_filename
-            )
-            db.add(run)
-            db.commit()
-            db.refresh(run)
+            with tracing.span("db.save_run"):
+                db = SessionLocal()
+                try:
+                    db.add(run)
+                    db.commit()
+                    run_search.index_run(db, kind, run)
+                    db.refresh(run)
+                finally:
+                    db.close()
+        if tracer:
+            tracer.save(tracing.trace_path("pentest_run" if kind == "pentest" else "run", run.id))
+        status = "done"
+    except asyncio.CancelledError:
+        status = "cancelled"
+        logging.info(f"Run {key} cancelled")
+    except Exception as e:
+        logging.error(f"Run {key} failed: {e}", exc_info=True)
+    finally:
+        active_runs.pop(key, None)
+        await publisher.flush()  # The last frame goes before the terminal status
+        await run_bus.publish(key, "status", status)
+
+def execute_run(kind: str, task) -> str:
+    """Starts a run on this worker, publishing to the run-event bus; returns its run key."""
+    QUEUED_TASKS.inc()
+    try:
+        if kind == "pentest":
+            from pentest_agent import PentestAgent as agent_class
+            tracer_name = f"pentest: {task.url}"
+        else:
+            from agent import Agent as agent_class
+            tracer_name = f"agent: {task.instruction[:60]}"
+        tracer = tracing.Tracer(tracer_name) if task.tracing or tracing.TRACING_DEFAULT else None
+        publisher = RunPublisher(run_bus)
+        agent = agent_class(publisher, task)
+        # The checkpoint key doubles as the run key, so a resumed run keeps its channel
+        publisher.run_key = agent.checkpointer.key
+    except Exception:
+        QUEUED_TASKS.dec()
+        raise
+    active_runs[publisher.run_key] = asyncio.create_task(_run_and_save(kind, agent, publisher, task, tracer))
+    return publisher.run_key
+
+async def run_in_progress(key: str) -> bool:
+    """Whether a run with this key is executing on this or any other worker."""
+    if key in active_runs:
+        return True
+    statuses = [event for event in await run_bus.history(key) if event["type"] == "status"]
+    return bool(statuses) and not is_terminal(statuses[-1])
 
+async def forward_run(stream: FrameStream, key: str):
+    """Relays the events of a run, wherever it executes, to one client connection."""
+    async for event in run_bus.events(key):
+        if event["type"] == "frame":
+            await stream.send_bytes(event["data"], event.get("live", False))
+        elif event["type"] == "status":
+            await stream.send_text(f"[STATUS]{key}:{event['data']}")
+        else:
+            await stream.send_text(event["data"])
+
+async def serve_client(websocket: WebSocket, kind: str):
+    """
+    Each message is a task to start, {"subscribe": "<run key>"} to follow a run started
+    elsewhere (e.g. after a reconnect, or on another worker), or {"cancel": "<run key>"}.
+    Subscribe and cancel messages carry the API key the run was started with as "apiKey".
+    Runs keep going when the client that started them disconnects.
+    """
+    stream = FrameStream(websocket).start()
+    forwarders = []
+    try:
+        while True:
+            message = json.loads(await websocket.receive_text())
+            if "cancel" in message or "subscribe" in message:
+                key = message.get("cancel") or message.get("subscribe")
+                # Unknown runs and runs of other callers get the same answer
+                if not isinstance(key, str) or await run_bus.owner(key) != key_scope(message.get("apiKey", "")):
+                    await stream.send_text(f"[ERROR] Unknown run {key}")
+                    continue
+            if "cancel" in message:
+                await run_bus.send_control(key, "cancel")
+                continue
+            if "subscribe" not in message:
+                task = AgentTask.model_validate(message)
+                if task.resumeFrom:
+                    # The resumed run reuses the key, so it would share files and channel with a live run
+                    if await run_in_progress(task.resumeFrom):
+                        await stream.send_text(f"[ERROR] Run {task.resumeFrom} is still in progress and cannot be resumed")
+                        continue
+                    task = checkpoint_store.resume_task(task)
+                key = execute_run(kind, task)
+            forwarders.append(asyncio.create_task(forward_run(stream, key)))
     except WebSocketDisconnect:
         logging.info(f"UI Client disconnected from {websocket.client.host}:{websocket.client.port}")
     except Exception as e:
-        logging.error(f"An error occurred in the pentest websocket endpoint: {e}", exc_info=True)
+        logging.error(f"An error occurred in the {kind} websocket endpoint: {e}", exc_info=True)
+    finally:
+        for forwarder in forwarders:
+            forwarder.cancel()
+        await asyncio.gather(*forwarders, return_exceptions=True)
+        await stream.close()
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    logging.info(f"UI Client connected from {websocket.client.host}:{websocket.client.port}")
+    await serve_client(websocket, "agent")
+
+@app.websocket("/ws/pentest")
+async def pentest_websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    logging.info(f"UI Client connected from {websocket.client.host}:{websocket.client.port} for pentesting")
+    await serve_client(websocket, "pentest")
 
 class AgentTask(BaseModel):
     url: str
@@ -121,6 +412,33 @@ class AgentTask(BaseModel):
     geminiApiKey: str = ''
     openaiModel: str = 'gpt-4o'
     geminiModel: str = 'gemini-1.5-flash'
+    openaiBaseUrl: str = ''
+    activeTesting: bool = False
+    useTrajectoryCache: bool = True
+    tracing: bool = False
+    streamFrames: bool = True # Annotated screenshots and video; batch runs turn this off
+    # Opt-in: checkpoints are saved after every step, including the browser's cookies; send
+    # resumeFrom (the run key logged as [CHECKPOINT]<key>) with API keys to continue a run.
+    checkpoint: bool = False
+    resumeFrom: str = ''
+    # Name of the credentials this task logs in with; enables the authenticated-state cache
+    authProfile: str = ''
+    # Live view: CDP screencast frames at up to liveViewFps, scaled to fit the given size
+    liveView: bool = False
+    liveViewFps: float = 5
+    liveViewWidth: int = 1280
+    liveViewHeight: int = 720
+    liveViewQuality: int = 60
+    # Latency hedging: after the primary's hedgePercentile latency (or hedgeDeadlineMs until
+    # enough samples exist) the same request is also sent to the secondary provider.
+    hedging: bool = False
+    hedgeProvider: str = ''
+    hedgeModel: str = ''
+    hedgeBaseUrl: str = ''
+    hedgePercentile: float = 0.9
+    hedgeDeadlineMs: int = 8000
+    # Compact, delta-encoded browser state with short keys instead of the full state JSON
+    compactState: bool = False
 
 
 # Serve the React frontend in production
@@ -1,7 +1,11 @@
 from playwright.async_api import Page
+from tracing import traced
 import base64
 import json
 
+# Elements reported by get_dom_state; the `id` of each entry is its index in this query.
+INTERACTIVE_SELECTOR = 'form, input, textarea, select, button, a'
+
 class BrowserController:
     """
     A controller to manage browser interactions using Playwright.
@@ -9,22 +13,25 @@ class BrowserController:
     def __init__(self, page: Page):
         self.page = page
 
+    @traced("browser.navigate")
     async def navigate(self, url: str):
         """Navigates the browser to the specified URL."""
         await self.page.goto(url)
 
+    @traced("browser.get_page_content")
     async def get_page_content(self) -> str:
         """Returns the full HTML content of the current page."""
         return await self.page.content()
 
+    @traced("browser.get_dom_state")
     async def get_dom_state(self):
         """
         Returns a structured representation of the DOM, including forms and input fields.
         """
         dom_state = await self.page.evaluate('''
-            () => {
+            (selector) => {
                 const elements = [];
-                document.querySelectorAll('form, input, textarea, select, button, a').forEach((el, index) => {
+                document.querySelectorAll(selector).forEach((el, index) => {
                     const rect = el.getBoundingClientRect();
                     elements.push({
                         id: index,
@@ -48,17 +55,20 @@ class BrowserController:
                 });
                 return elements;
             }
-        ''')
+        ''', INTERACTIVE_SELECTOR)
         return dom_state
 
+    @traced("browser.click")
     async def click(self, x: int, y: int):
         """Clicks at a specific x,y coordinate."""
         await self.page.mouse.click(x, y)
 
+    @traced("browser.type_text")
     async def type_text(self, selector: str, text: str):
         """Types text into an element identified by a CSS selector."""
         await self.page.fill(selector, text)
 
+    @traced("browser.scroll_page")
     async def scroll_page(self, direction: str):
         """Scrolls the page up or down."""
         if direction == "up":
@@ -66,6 +76,7 @@ class BrowserController:
         else:
             await self.page.evaluate("window.scrollBy(0, window.innerHeight)")
 
+    @traced("browser.capture_screenshot")
     async def capture_screenshot(self) -> str:
         """Takes a screenshot of the current page and returns it as a base64 encoded string."""
         screenshot_bytes = await self.page.screenshot(type='jpeg', quality=95)
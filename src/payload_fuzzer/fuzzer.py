@@ -0,0 +1,184 @@
+from typing import Optional
+from playwright.async_api import Browser, TimeoutError as PlaywrightTimeoutError
+from src.browser_controller.controller import INTERACTIVE_SELECTOR
+import asyncio
+import logging
+import time
+import uuid
+
+# Payload templates; `{marker}` is replaced with a unique token per probe so that
+# reflections and dialogs can be attributed to the exact input that caused them.
+XSS_PAYLOADS = [
+    '{marker}',
+    '<script>alert("{marker}")</script>',
+    '"><img src=x onerror=alert("{marker}")>',
+    "'><svg onload=alert('{marker}')>",
+    '</textarea><script>alert("{marker}")</script>',
+]
+
+# Looks for elements created by a payload: scripts carrying the marker, or elements whose
+# attributes (event handlers included) do. Only markup parsed from the payload can produce
+# them; an escaped reflection stays text.
+INJECTED_ELEMENT_PROBE = """
+    marker => [...document.querySelectorAll('script, svg, img, iframe, [onerror], [onload]')].some(element =>
+        (element.tagName === 'SCRIPT' && element.textContent.includes(marker)) ||
+        [...element.attributes].some(attribute => attribute.value.includes(marker)))
+"""
+
+# Input types that cannot carry a text payload.
+SKIPPED_INPUT_TYPES = {'hidden', 'submit', 'button', 'reset', 'image', 'checkbox', 'radio', 'file', 'range', 'color'}
+
+
+class RateLimiter:
+    """
+    Spaces out submissions so that no more than `rate` probes start per second.
+    """
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class PayloadFuzzer:
+    """
+    Submits payload corpora into the inputs discovered by `BrowserController.get_dom_state`
+    and reports the ones whose payload is reflected unescaped or executed.
+
+    Reflection is judged on the raw body of the response to the submission, since the
+    browser's re-serialized DOM re-encodes attributes and entities. Forms that update the
+    page without navigating are checked with a DOM probe for elements carrying the marker.
+
+    Every probe runs in its own browser context so cookies, storage and dialogs from one
+    payload can never leak into another.
+    """
+    def __init__(self, browser: Browser, url: str, payloads: Optional[list[str]] = None,
+                 concurrency: int = 4, rate: float = 5.0, timeout_ms: int = 10000):
+        self.browser = browser
+        self.url = url
+        self.payloads = payloads or XSS_PAYLOADS
+        self.timeout_ms = timeout_ms
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._rate_limiter = RateLimiter(rate)
+
+    def get_targets(self, dom_state: list[dict]) -> list[dict]:
+        """Returns the text-like inputs and textareas in `dom_state` that can receive a payload."""
+        targets = []
+        for element in dom_state:
+            if element['tag'] == 'textarea' or (
+                element['tag'] == 'input' and (element.get('type') or 'text') not in SKIPPED_INPUT_TYPES
+            ):
+                targets.append(element)
+        return targets
+
+    async def run(self, dom_state: list[dict]) -> list[dict]:
+        """
+        Fuzzes every target in `dom_state` and returns confirmed findings as dictionaries
+        compatible with the `Vulnerability` model, including an `evidence` entry.
+        """
+        targets = self.get_targets(dom_state)
+        logging.info(f"PayloadFuzzer: testing {len(targets)} inputs with {len(self.payloads)} payloads each")
+        results = await asyncio.gather(*(self._fuzz_target(target) for target in targets))
+        return [finding for finding in results if finding]
+
+    async def _fuzz_target(self, target: dict) -> Optional[dict]:
+        reflected = None
+        for template in self.payloads:
+            marker = f"wp{uuid.uuid4().hex[:10]}"
+            payload = template.format(marker=marker)
+            result = await self._probe(target, payload, marker)
+            if result is None:
+                continue
+            if result['executed']:
+                # Execution is the strongest evidence, no need to try the remaining payloads.
+                return self._finding(target, result, executed=True)
+            if result['reflected'] and payload != marker and reflected is None:
+                reflected = result
+        if reflected:
+            return self._finding(target, reflected, executed=False)
+        return None
+
+    async def _probe(self, target: dict, payload: str, marker: str) -> Optional[dict]:
+        async with self._semaphore:
+            await self._rate_limiter.acquire()
+            context = await self.browser.new_context()
+            dialogs = []
+            try:
+                page = await context.new_page()
+                page.set_default_timeout(self.timeout_ms)
+
+                async def on_dialog(dialog):
+                    dialogs.append(dialog.message)
+                    await dialog.dismiss()
+                page.on("dialog", on_dialog)
+
+                await page.goto(self.url)
+                element = page.locator(INTERACTIVE_SELECTOR).nth(target['id'])
+                await element.fill(payload)
+                response = None
+                try:
+                    async with page.expect_navigation(wait_until="load", timeout=self.timeout_ms) as navigation:
+                        await element.press("Enter")
+                    response = await navigation.value
+                except PlaywrightTimeoutError:
+                    # Client-side forms may update the DOM without navigating.
+                    pass
+                # Give inline handlers such as onerror a moment to fire.
+                await page.wait_for_timeout(200)
+                return {
+                    'payload': payload,
+                    'url': page.url,
+                    'executed': any(marker in message for message in dialogs),
+                    'dialog': next((message for message in dialogs if marker in message), None),
+                    'reflected': await self._reflected(page, response, payload, marker),
+                }
+            except Exception as e:
+                logging.warning(f"PayloadFuzzer: probe on input {target['id']} failed: {e}")
+                return None
+            finally:
+                await context.close()
+
+    @staticmethod
+    async def _reflected(page, response, payload: str, marker: str) -> bool:
+        """True if the response body holds the payload verbatim or the page holds elements it injected."""
+        if response is not None:
+            try:
+                if payload in await response.text():
+                    return True
+            except Exception:
+                pass  # Redirects and aborted responses have no body
+        return await page.evaluate(INJECTED_ELEMENT_PROBE, marker)
+
+    @staticmethod
+    def _finding(target: dict, result: dict, executed: bool) -> dict:
+        name = target.get('name') or f"#{target['id']}"
+        if executed:
+            label = 'Confirmed Cross-Site Scripting (XSS) (OWASP A03:2021 - Injection)'
+            severity = 'Critical'
+            description = (
+                f"Input '{name}' executed an injected script: submitting the payload raised a JavaScript dialog "
+                f"on {result['url']}. Untrusted input is written into the page without output encoding."
+            )
+            evidence = f"payload={result['payload']!r} dialog={result['dialog']!r} url={result['url']}"
+        else:
+            label = 'Reflected Unescaped Input (OWASP A03:2021 - Injection)'
+            severity = 'High'
+            description = (
+                f"Input '{name}' reflects HTML metacharacters unescaped on {result['url']}. "
+                f"The payload did not execute in the test browser but the missing output encoding makes XSS likely."
+            )
+            evidence = f"payload={result['payload']!r} reflected verbatim at url={result['url']}"
+        return {
+            'label': label,
+            'severity': severity,
+            'description': description,
+            'owasp_category': 'A03:2021 - Injection',
+            'evidence': evidence,
+        }
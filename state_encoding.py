@@ -0,0 +1,153 @@
+"""
+Compact, delta-encoded browser state for LLM prompts.
+
+By default the agents send `BrowserStateSummary.model_dump_json()` every step: long keys,
+float bounding boxes and, for pentests, the full vulnerability report again and again.
+With `compactState` a `StateEncoder` sends short keys, rounded numbers and only what
+changed since the previous step:
+
+    {"u": url, "t": title, "tabs": [[url, title]], "vp": [vw, vh, pw, ph, sx, sy],
+     "e": [[id, tag, text, [x, y, w, h]], ...]}
+
+A delta (`"d": 1`) omits unchanged fields, lists added or changed elements under `e+` and
+the ids of removed ones under `e-`. When a delta would not be shorter (e.g. after a
+navigation) the full state is sent. With deltas, findings are sent in full the first time
+(`f+`) and as `[label, severity, count]` groups afterwards (`f`); findings that carry
+evidence are always sent in full. Without deltas (the pentest prompt only holds the
+current state) every finding is sent in full at every step.
+
+`count_tokens` measures each step's state so the two encodings can be compared.
+"""
+import json
+from functools import lru_cache
+
+AGENT_LEGEND = """
+        The browser state is sent as compact JSON: u=URL, t=title, tabs=[[url, title]],
+        vp=[viewport width, viewport height, page width, page height, scroll x, scroll y],
+        e=interactive elements as [id, tag, text, [x, y, width, height]].
+        A state with "d":1 only lists changes since your previous state: e+ are elements that
+        were added or changed, e- are ids of elements that are gone, omitted fields are unchanged.
+        """
+
+PENTEST_LEGEND = """
+        The browser state is sent as compact JSON: u=URL, t=title, tabs=[[url, title]],
+        vp=[viewport width, viewport height, page width, page height, scroll x, scroll y].
+        f+ lists the identified vulnerabilities as {l: label, s: severity, o: owasp_category,
+        d: description, ev: evidence}.
+        """
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _box(box):
+    if not box:
+        return None
+    return [round(box["x"]), round(box["y"]), round(box["width"]), round(box["height"])]
+
+
+def _element(element: dict) -> list:
+    text = " ".join((element.get("text") or "").split())
+    return [element["id"], element["tag"], text, _box(element.get("bounding_box"))]
+
+
+def _finding(finding: dict) -> dict:
+    compact = {
+        "l": finding.get("label"),
+        "s": finding.get("severity"),
+        "o": finding.get("owasp_category"),
+        "d": finding.get("description"),
+    }
+    if finding.get("evidence"):
+        compact["ev"] = finding["evidence"]
+    return compact
+
+
+class StateEncoder:
+    """
+    Encodes the successive states of one run. `delta` should only be enabled when the LLM
+    sees earlier states (the agent keeps them in its history; the pentest prompt does not).
+    """
+    def __init__(self, delta: bool = True):
+        self.delta = delta
+        self.previous = None
+        self.elements = {}
+        self.seen_findings = set()
+
+    def encode(self, state: dict) -> str:
+        """`state` is a `BrowserStateSummary.model_dump()` of either agent."""
+        page_info = state["page_info"]
+        full = {
+            "u": state["url"],
+            "t": state["title"],
+            "tabs": [[tab["url"], tab["title"]] for tab in state["tabs"]],
+            "vp": [round(page_info[key]) for key in
+                   ("viewport_width", "viewport_height", "page_width", "page_height", "scroll_x", "scroll_y")],
+        }
+        elements = {element["id"]: _element(element) for element in state.get("dom_state", ())}
+        if "dom_state" in state:
+            full["e"] = list(elements.values())
+        if "report" in state:
+            full.update(self._findings(state["report"]["vulnerabilities"]))
+
+        encoded = _dumps(full)
+        if self.delta and self.previous is not None:
+            delta = {"d": 1}
+            delta.update({key: value for key, value in full.items()
+                          if key not in ("e", "f", "f+") and value != self.previous.get(key)})
+            added = [element for element_id, element in elements.items() if self.elements.get(element_id) != element]
+            removed = [element_id for element_id in self.elements if element_id not in elements]
+            if added:
+                delta["e+"] = added
+            if removed:
+                delta["e-"] = removed
+            delta.update({key: full[key] for key in ("f", "f+") if key in full})
+            delta_encoded = _dumps(delta)
+            if len(delta_encoded) < len(encoded):
+                encoded = delta_encoded
+        self.previous = full
+        self.elements = elements
+        return encoded
+
+    def _findings(self, vulnerabilities: list) -> dict:
+        new, known, step_keys = [], {}, set()
+        for finding in vulnerabilities:
+            compact = _finding(finding)
+            key = _dumps(compact)
+            if key in step_keys:
+                continue  # Duplicate entry within this report
+            step_keys.add(key)
+            # Grouping only works when the LLM still sees the earlier state that had it in full
+            if not self.delta or key not in self.seen_findings or "ev" in compact:
+                new.append(compact)
+                self.seen_findings.add(key)
+            else:
+                group = (compact["l"], compact["s"])
+                known[group] = known.get(group, 0) + 1
+        findings = {}
+        if new:
+            findings["f+"] = new
+        if known:
+            findings["f"] = [[label, severity, count] for (label, severity), count in known.items()]
+        return findings
+
+
+@lru_cache(maxsize=16)
+def _encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Token count with the model's tiktoken encoding; about 4 characters per token without tiktoken."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,5 @@
+import os
+
+# Modules that import `database` get an in-memory SQLite engine instead of the application
+# database; tests that need a database create their own.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
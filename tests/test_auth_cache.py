@@ -0,0 +1,75 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from auth_cache import AuthSession, AuthStateCache, looks_logged_out
+from trajectory_cache import caller_scope
+
+STATE = {"cookies": [{"name": "session", "value": "secret"}], "origins": []}
+
+
+def make_task(api_key="sk-alice", profile="admin", model="openai"):
+    return SimpleNamespace(url="https://app.example.com/dashboard", authProfile=profile, model=model,
+                           openaiApiKey=api_key, geminiApiKey="")
+
+
+def test_entries_are_scoped_to_the_caller():
+    cache = AuthStateCache(directory="")
+    alice, mallory = caller_scope(make_task("sk-alice")), caller_scope(make_task("sk-mallory"))
+    cache.put("https://app.example.com/login", "admin", alice, STATE)
+    assert cache.get("https://APP.example.com/other", "admin", alice) == STATE
+    assert cache.get("https://app.example.com/", "admin", mallory) is None
+    assert cache.get("https://app.example.com/", "viewer", alice) is None
+
+
+def test_tasks_without_an_api_key_never_use_the_cache():
+    cache = AuthStateCache(directory="")
+    cache.put("https://app.example.com/", "admin", "", STATE)
+    session = AuthSession(make_task(api_key=""), cache)
+    assert session.storage_state() is None
+    assert cache.lookups == 0
+
+
+def test_entries_expire(monkeypatch):
+    cache = AuthStateCache(ttl=60, directory="")
+    cache.put("https://app.example.com/", "admin", "scope", STATE)
+    now = time.time()
+    monkeypatch.setattr("auth_cache.time.time", lambda: now + 61)
+    assert cache.get("https://app.example.com/", "admin", "scope") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_entries_are_private_and_respect_maxsize(tmp_path):
+    writer = AuthStateCache(directory=str(tmp_path))
+    for i in range(3):
+        writer.put(f"https://site{i}.example.com/", "admin", "scope", STATE)
+    assert all(oct(os.stat(tmp_path / name).st_mode & 0o777) == "0o600" for name in os.listdir(tmp_path))
+
+    reader = AuthStateCache(maxsize=2, directory=str(tmp_path))
+    for i in range(3):
+        assert reader.get(f"https://site{i}.example.com/", "admin", "scope") == STATE
+    assert reader.stats()["entries"] == 2
+
+
+def test_clear_only_removes_the_callers_entries(tmp_path):
+    cache = AuthStateCache(directory=str(tmp_path))
+    cache.put("https://app.example.com/", "admin", "a", STATE)
+    cache.put("https://app.example.com/", "viewer", "a", STATE)
+    cache.put("https://app.example.com/", "admin", "b", STATE)
+    cache.clear("a", "admin")
+    assert len(os.listdir(tmp_path)) == 2
+    assert cache.get("https://app.example.com/", "viewer", "a") == STATE
+
+    cache.clear("")  # No caller, nothing to clear
+    cache.clear("a")
+    assert len(os.listdir(tmp_path)) == 1
+    assert AuthStateCache(directory=str(tmp_path)).get("https://app.example.com/", "admin", "b") == STATE
+
+
+@pytest.mark.parametrize("url", ["https://x.test/login", "https://x.test/sign_in?next=/", "https://x.test/auth/"])
+def test_login_urls_look_logged_out(url):
+    page = SimpleNamespace(url=url)
+    assert asyncio.run(looks_logged_out(page))
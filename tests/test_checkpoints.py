@@ -0,0 +1,83 @@
+import os
+import stat
+from types import SimpleNamespace
+
+import pytest
+
+from checkpoints import CheckpointStore, RunCheckpointer, is_valid_key
+from trajectory_cache import key_scope
+
+PIXEL = "data:image/jpeg;base64,/9j/4AAQSkZJRg=="
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_checkpoints_are_private_and_round_trip(tmp_path):
+    root = tmp_path / "checkpoints"
+    store = CheckpointStore(str(root))
+    checkpoint = {"kind": "agent", "scope": "alice", "step": 2, "history": [{"content": [{"image_url": PIXEL}]}],
+                  "browser": {"storage_state": {"cookies": [{"name": "session", "value": "secret"}]}}}
+    store.save("run1", checkpoint)
+
+    directory = root / "run1"
+    assert mode(root) == 0o700
+    assert mode(directory) == 0o700
+    assert mode(directory / "screenshots") == 0o700
+    assert mode(directory / "checkpoint.json") == 0o600
+    (image,) = (directory / "screenshots").iterdir()
+    assert mode(image) == 0o600
+    assert PIXEL not in (directory / "checkpoint.json").read_text()
+    assert store.load("run1", "alice") == checkpoint
+
+    store.delete("run1")
+    assert store.load("run1", "alice") is None
+
+
+def make_task(api_key="sk-alice", resume_from=""):
+    return SimpleNamespace(model="openai", openaiApiKey=api_key, geminiApiKey="", checkpoint=True,
+                           resumeFrom=resume_from)
+
+
+def save(store, key, api_key):
+    store.save(key, {"kind": "agent", "scope": key_scope(api_key), "task": {"url": "https://example.com"},
+                     "step": 1, "browser": {"url": "https://example.com"}, "updated_at": 1.0})
+
+
+def test_checkpoints_belong_to_the_caller(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    save(store, "alices-run", "sk-alice")
+    alice, mallory = key_scope("sk-alice"), key_scope("sk-mallory")
+
+    assert [summary["key"] for summary in store.list(alice)] == ["alices-run"]
+    assert store.list(mallory) == [] and store.list("") == []
+    assert store.load("alices-run", mallory) is None
+    assert not store.delete("alices-run", mallory)
+    assert store.owns("alices-run", alice)
+
+
+def test_run_key_is_only_reused_for_the_callers_own_checkpoint(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    save(store, "alices-run", "sk-alice")
+
+    assert RunCheckpointer("agent", make_task("sk-alice", "alices-run"), store).key == "alices-run"
+    # Another caller, or a key without a checkpoint, gets a fresh run key
+    assert RunCheckpointer("agent", make_task("sk-mallory", "alices-run"), store).key != "alices-run"
+    assert RunCheckpointer("agent", make_task("sk-alice", "finished-run"), store).key != "finished-run"
+    # Tasks without an API key of their own are never checkpointed
+    assert not RunCheckpointer("agent", make_task(""), store).enabled
+
+
+@pytest.mark.parametrize("key,valid", [
+    ("3f2a9c1e0b7d4e5f", True),
+    ("run-1.json", True),
+    ("", False),
+    ("..", False),
+    (".hidden", False),
+    ("../etc/passwd", False),
+    ("nested/key", False),
+    (f"nested{os.sep}key", False),
+])
+def test_keys_cannot_leave_the_checkpoints_directory(key, valid):
+    assert is_valid_key(key) is valid
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from fixtures import fake_llm_server
+from hedging import HedgeStats, LatencyTracker, hedged_call
+
+httpx = pytest.importorskip("httpx")
+
+
+@pytest.fixture
+def fake_llm():
+    """Starts fake OpenAI-compatible servers with the given latency and returns their base URLs."""
+    servers = []
+
+    def start(latency_ms):
+        server = fake_llm_server.serve(port=0, latency_ms=latency_ms)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+async def race(primary, secondary, deadline, primary_tracker, stats):
+    async with httpx.AsyncClient(timeout=10) as http:
+        async def call(base_url):
+            response = await http.post(f"{base_url}/chat/completions", json={"messages": []})
+            content = json.loads(response.json()["choices"][0]["message"]["content"])
+            return content["action"]
+
+        return await hedged_call(call, primary, secondary, primary_tracker, LatencyTracker(), deadline, stats)
+
+
+def test_a_slow_primary_is_hedged_and_the_secondary_answers(fake_llm):
+    slow, fast = fake_llm(1000), fake_llm(50)
+    primary_tracker, stats = LatencyTracker(min_samples=1), HedgeStats()
+    action, client, seconds = asyncio.run(race(slow, fast, 0.2, primary_tracker, stats))
+
+    assert action == 'Scroll("down")'
+    assert client == fast and seconds < 1
+    assert (stats.calls, stats.hedged, stats.secondary_wins) == (1, 1, 1)
+    assert stats.as_dict()["estimated_latency_saved_ms"] >= 0
+    # The cancelled primary never answered, so it contributes no latency sample
+    assert list(primary_tracker.samples) == []
+
+
+def test_a_fast_primary_is_not_hedged(fake_llm):
+    fast, unused = fake_llm(20), fake_llm(20)
+    primary_tracker, stats = LatencyTracker(min_samples=1), HedgeStats()
+    action, client, seconds = asyncio.run(race(fast, unused, 1.0, primary_tracker, stats))
+
+    assert client == fast
+    assert (stats.calls, stats.hedged, stats.secondary_wins) == (1, 0, 0)
+    assert primary_tracker.percentile(0.99) == pytest.approx(seconds)
+
+
+def test_a_failing_primary_falls_back_to_the_secondary(fake_llm):
+    working = fake_llm(20)
+    stats = HedgeStats()
+    action, client, _ = asyncio.run(race("http://127.0.0.1:9/v1", working, 1.0, LatencyTracker(), stats))
+    assert (action, client, stats.hedged) == ('Scroll("down")', working, 1)
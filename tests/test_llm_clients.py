@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+
+from fixtures import fake_llm_server
+
+httpx = pytest.importorskip("httpx")
+llm_clients = pytest.importorskip("llm_clients")
+
+
+def test_the_shared_http_client_works_across_event_loops():
+    server = fake_llm_server.serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    client = llm_clients.shared_http_client()
+    transport = llm_clients._http_transport
+
+    async def complete():
+        response = await client.post(url, json={"messages": []})
+        return response.status_code, transport._transport()
+
+    try:
+        # Each asyncio.run is a new loop, like a benchmark run or a worker thread
+        first_status, first_pool = asyncio.run(complete())
+        second_status, second_pool = asyncio.run(complete())
+        assert first_status == second_status == 200
+        assert first_pool is not second_pool
+        assert client is llm_clients.shared_http_client()
+
+        async def complete_and_close():
+            loop = asyncio.get_running_loop()
+            await complete()
+            assert loop in transport._transports
+            await llm_clients.close_http_connections()
+            return loop not in transport._transports
+        assert asyncio.run(complete_and_close())
+        # Closing one loop's pool leaves the shared client usable on the next loop
+        assert asyncio.run(complete())[0] == 200
+    finally:
+        server.shutdown()
+        server.server_close()
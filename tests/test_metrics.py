@@ -0,0 +1,40 @@
+import metrics
+
+
+def test_counters_and_gauges_render_with_help_type_and_escaped_labels():
+    requests = metrics.Counter("test_requests_total", "Requests served.", ["path"])
+    requests.labels('/a"b\\c\nd').inc()
+    requests.labels('/a"b\\c\nd').inc(2)
+    depth = metrics.Gauge("test_queue_depth", "Queued items.")
+    depth.labels().set(5)
+    depth.labels().dec()
+
+    assert requests.render() == [
+        "# HELP test_requests_total Requests served.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{path="/a\\"b\\\\c\\nd"} 3.0',
+    ]
+    assert depth.render()[1:] == ["# TYPE test_queue_depth gauge", "test_queue_depth 4.0"]
+
+
+def test_histograms_render_cumulative_buckets_sum_and_count():
+    latency = metrics.Histogram("test_latency_seconds", "Latency.", ["provider"], buckets=(0.5, 0.1))
+    child = latency.labels("openai")
+    for value in (0.05, 0.1, 0.3, 2.0):
+        child.observe(value)
+
+    assert latency.render()[2:] == [
+        'test_latency_seconds_bucket{provider="openai",le="0.1"} 2',
+        'test_latency_seconds_bucket{provider="openai",le="0.5"} 3',
+        'test_latency_seconds_bucket{provider="openai",le="+Inf"} 4',
+        'test_latency_seconds_sum{provider="openai"} 2.45',
+        'test_latency_seconds_count{provider="openai"} 4',
+    ]
+
+
+def test_render_exposes_every_registered_metric():
+    metrics.Gauge("test_workers", "Busy workers.").labels().inc()
+    text = metrics.render()
+    assert text.endswith("\n")
+    assert "# TYPE webpilot_llm_latency_seconds histogram" in text
+    assert "test_workers 1.0\n" in text
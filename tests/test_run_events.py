@@ -0,0 +1,264 @@
+import asyncio
+import json
+import os
+import threading
+import uuid
+
+import pytest
+
+from run_events import NOTIFY_LIMIT, InMemoryEventBus, PostgresEventBus, RunPublisher, notify_payload
+
+TEST_DATABASE_URL = os.getenv("WEBPILOT_TEST_DATABASE_URL", "postgresql://postgres@localhost:5432/postgres")
+
+
+def test_notify_payload_inlines_short_data():
+    payload = json.loads(notify_payload(7, "run", "log", "hello"))
+    assert payload == {"id": 7, "run": "run", "type": "log", "data": "hello"}
+
+
+def test_notify_payload_measures_escaped_and_encoded_size():
+    # Both are under 4000 characters but far over the limit once escaped or UTF-8 encoded
+    for data in ('"' * 3999, "é" * 3999, "\\x00" * 2000):
+        encoded = notify_payload(1, "run", "log", data)
+        assert len(encoded.encode()) < NOTIFY_LIMIT
+        assert "data" not in json.loads(encoded)
+
+
+def test_notify_payload_at_the_limit():
+    overhead = len(notify_payload(1, "run", "log", "").encode())
+    fits = "a" * (NOTIFY_LIMIT - overhead - 1)
+    assert json.loads(notify_payload(1, "run", "log", fits))["data"] == fits
+    assert "data" not in json.loads(notify_payload(1, "run", "log", fits + "a"))
+
+
+def test_subscriber_gets_backlog_then_live_events():
+    async def scenario():
+        bus = InMemoryEventBus()
+        publisher = RunPublisher(bus, "run")
+        await bus.publish("run", "status", "running")
+        await publisher.send_text("first")
+        await publisher.send_bytes(b"frame-1")
+
+        received = []
+
+        async def follow():
+            async for event in bus.events("run"):
+                received.append((event["type"], event["data"]))
+
+        follower = asyncio.create_task(follow())
+        await asyncio.sleep(0)
+        await publisher.send_text("second")
+        await bus.publish("run", "status", "done")
+        await asyncio.wait_for(follower, 1)
+        return received
+
+    assert asyncio.run(scenario()) == [
+        ("status", "running"), ("log", "first"), ("frame", b"frame-1"), ("log", "second"), ("status", "done"),
+    ]
+
+
+async def follow(bus, run_key, received):
+    async for event in bus.events(run_key):
+        received.append(event)
+
+
+def test_publisher_keeps_only_the_latest_pending_frame_and_its_live_flag():
+    async def scenario():
+        bus = InMemoryEventBus()
+        published = []
+        publish = bus.publish
+
+        async def slow_publish(run_key, event_type, data, live=False):
+            await asyncio.sleep(0.01)
+            published.append((data, live))
+            await publish(run_key, event_type, data, live)
+
+        bus.publish = slow_publish
+        publisher = RunPublisher(bus, "run")
+        for i in range(5):
+            publisher.push_frame(f"live-{i}".encode(), live=True)
+            await asyncio.sleep(0)
+        await publisher.send_bytes(b"step")
+        return published, await bus.history("run")
+
+    published, history = asyncio.run(scenario())
+    # The first frame is taken at once, the ones arriving meanwhile collapse into the newest
+    assert published == [(b"live-0", True), (b"step", False)]
+    assert history == [{"id": 2, "run": "run", "type": "frame", "data": b"step", "live": False}]
+
+
+def test_subscriptions_to_runs_without_events_end():
+    async def scenario():
+        bus = InMemoryEventBus()
+        bus.subscribe_timeout = 0.01
+        received = []
+        await asyncio.wait_for(follow(bus, "unknown", received), 1)
+        return received, bus._subscribers
+
+    assert asyncio.run(scenario()) == ([], {})
+
+
+def test_runs_remember_their_owner_until_evicted():
+    async def scenario():
+        bus = InMemoryEventBus(max_runs=1)
+        await bus.claim("a", "alice")
+        await bus.publish("a", "status", "done")
+        owners = [await bus.owner("a"), await bus.owner("b")]
+        await bus.claim("b", "bob")
+        await bus.publish("b", "status", "running")  # Evicts the finished run
+        return owners + [await bus.owner("a"), await bus.owner("b")]
+
+    assert asyncio.run(scenario()) == ["alice", None, None, "bob"]
+
+
+def test_memory_bus_evicts_finished_runs_first():
+    async def scenario():
+        bus = InMemoryEventBus(max_bytes=10_000, max_runs=100)
+        await bus.publish("old", "frame", b"x" * 4000)
+        await bus.publish("old", "status", "done")
+        await bus.publish("live", "frame", b"y" * 4000)
+        await bus.publish("live", "frame", b"z" * 4000)  # Replaces the previous frame
+        await bus.publish("new", "frame", b"w" * 4000)
+        return bus, await bus.history("old"), await bus.history("live")
+
+    bus, old, live = asyncio.run(scenario())
+    assert old == []
+    assert [event["data"] for event in live] == [b"z" * 4000]
+    assert bus.total_bytes == 8000
+
+
+def test_memory_bus_trims_live_runs_to_the_byte_budget():
+    async def scenario():
+        bus = InMemoryEventBus(max_bytes=1000)
+        for i in range(100):
+            await bus.publish("run", "log", f"{i:020d}")
+        return bus, await bus.history("run")
+
+    bus, history = asyncio.run(scenario())
+    assert bus.total_bytes <= 1000
+    assert history[-1]["data"] == f"{99:020d}"
+
+
+def test_memory_bus_limits_run_count_and_prunes_expired_runs():
+    async def scenario():
+        bus = InMemoryEventBus(max_runs=2, retention=-1)
+        for key in ("a", "b", "c"):
+            await bus.publish(key, "status", "done")
+        assert set(bus._sizes) == {"b", "c"}
+        await bus.prune()
+        return bus.stats()
+
+    assert asyncio.run(scenario()) == {"runs": 0, "finished_runs": 0, "bytes": 0}
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    """Points the database module at WEBPILOT_TEST_DATABASE_URL; skips when it is not reachable."""
+    sqlalchemy = pytest.importorskip("sqlalchemy")
+    pytest.importorskip("psycopg2")
+    import database
+
+    engine = sqlalchemy.create_engine(TEST_DATABASE_URL)
+    try:
+        engine.connect().close()
+    except sqlalchemy.exc.OperationalError:
+        pytest.skip(f"No Postgres database reachable at {TEST_DATABASE_URL}")
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(database, "SessionLocal", sqlalchemy.orm.sessionmaker(bind=engine))
+    tables = [database.RunEvent.__table__, database.RunFrame.__table__, database.RunOwner.__table__]
+    database.Base.metadata.create_all(engine, tables=tables)
+    run_keys = []
+    yield run_keys
+    with engine.begin() as connection:
+        for table in tables:
+            connection.execute(table.delete().where(table.c.run_key.in_(run_keys)))
+    engine.dispose()
+
+
+def run_postgres(postgres, scenario):
+    """Runs `scenario(bus, run_key)` on a started Postgres bus with a fresh run key."""
+    async def main():
+        bus = PostgresEventBus()
+        await bus.start()
+        try:
+            return await scenario(bus, run_key)
+        finally:
+            await bus.stop()
+
+    run_key = uuid.uuid4().hex
+    postgres.append(run_key)
+    return asyncio.run(main())
+
+
+async def until(condition):
+    while not condition():
+        await asyncio.sleep(0.01)
+
+
+def test_postgres_round_trip(postgres):
+    async def scenario(bus, run_key):
+        await bus.claim(run_key, "alice")
+        await bus.publish(run_key, "status", "running")
+        received = []
+        follower = asyncio.create_task(follow(bus, run_key, received))
+        await until(lambda: received)
+        await bus.publish(run_key, "log", "hello")
+        await bus.publish(run_key, "frame", b"jpeg", live=True)
+        await until(lambda: len(received) == 3)
+        await bus.publish(run_key, "status", "done")
+        await asyncio.wait_for(follower, 5)
+        return await bus.owner(run_key), [(event["type"], event["data"], event.get("live")) for event in received]
+
+    owner, received = run_postgres(postgres, scenario)
+    assert owner == "alice"
+    assert received == [("status", "running", None), ("log", "hello", None), ("frame", b"jpeg", True),
+                        ("status", "done", None)]
+
+
+def test_postgres_fetches_logs_too_large_for_a_notification(postgres):
+    large = "é" * NOTIFY_LIMIT
+
+    async def scenario(bus, run_key):
+        received = []
+        follower = asyncio.create_task(follow(bus, run_key, received))
+        await asyncio.sleep(0.1)
+        await bus.publish(run_key, "log", large)
+        await bus.publish(run_key, "status", "done")
+        await asyncio.wait_for(follower, 5)
+        return [event["data"] for event in received]
+
+    received = run_postgres(postgres, scenario)
+    assert received == [large, "done"]
+
+
+def test_postgres_listener_reconnects_and_replays_missed_events(postgres):
+    async def scenario(bus, run_key):
+        from sqlalchemy import text
+        import database
+
+        gate = threading.Event()
+        connect = bus._connect_listener
+
+        def gated_connect():
+            gate.wait(5)
+            return connect()
+
+        bus._connect_listener = gated_connect
+        received = []
+        follower = asyncio.create_task(follow(bus, run_key, received))
+        await bus.publish(run_key, "log", "before")
+        await until(lambda: received)
+
+        with database.engine.begin() as connection:
+            connection.execute(text("SELECT pg_terminate_backend(:pid)"),
+                               {"pid": bus._listen_connection.get_backend_pid()})
+        await until(lambda: bus._reconnect_task is not None)
+        await bus.publish(run_key, "log", "while disconnected")  # Its notification is lost
+        gate.set()
+        await until(lambda: bus._reconnect_task is None)
+        await bus.publish(run_key, "status", "done")
+        await asyncio.wait_for(follower, 5)
+        return [event["data"] for event in received]
+
+    received = run_postgres(postgres, scenario)
+    assert received == ["before", "while disconnected", "done"]
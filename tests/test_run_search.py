@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import run_search  # noqa: E402
+from database import Base, PentestRun, Run  # noqa: E402
+
+XSS = "<script>alert(1)</script>"
+
+
+def agent_logs(summary):
+    content = json.dumps({"thought": "...", "action": f'Done("{summary}")'})
+    return json.dumps([{"type": "human", "data": {"content": "state"}}, {"type": "ai", "data": {"content": content}}])
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        runs = [
+            ("agent", Run(url="https://www.shop.example.com/cart", instruction="Buy the cheapest laptop",
+                          logs=agent_logs("Ordered the laptop"))),
+            ("agent", Run(url="https://docs.example.org", instruction="Find the laptop return policy",
+                          logs=agent_logs("Returns within 30 days"))),
+            ("pentest", PentestRun(url="https://shop.example.com/search", instruction="Test the search form", report={
+                "summary": "Reflected XSS in the search form",
+                "vulnerabilities": [
+                    {"label": "Reflected XSS", "severity": "high ", "owasp_category": "A03:2021-Injection",
+                     "description": f"The q parameter reflects {XSS} unescaped"},
+                    {"label": "Missing CSP", "severity": "Low", "owasp_category": "A05:2021-Security Misconfiguration",
+                     "description": "No Content-Security-Policy header"},
+                ],
+            })),
+        ]
+        for kind, run in runs:
+            session.add(run)
+            session.commit()
+            run_search.index_run(session, kind, run)
+        yield session
+
+
+def keys(result):
+    return [(entry["kind"], entry["run_id"]) for entry in result["results"]]
+
+
+def test_matches_every_word_and_filters_by_kind(db):
+    assert sorted(keys(run_search.search(db, "laptop"))) == [("agent", 1), ("agent", 2)]
+    assert keys(run_search.search(db, "laptop return")) == [("agent", 2)]
+    assert keys(run_search.search(db, "search", kind="pentest")) == [("pentest", 1)]
+    assert run_search.search(db, "search", kind="agent")["total"] == 0
+    # Without a query, newest first
+    assert keys(run_search.search(db)) == [("pentest", 1), ("agent", 2), ("agent", 1)]
+
+
+def test_facet_counts_and_filters(db):
+    facets = run_search.search(db)["facets"]
+    assert facets["domain"] == [{"value": "shop.example.com", "count": 2}, {"value": "docs.example.org", "count": 1}]
+    assert facets["severity"] == [{"value": "High", "count": 1}, {"value": "Low", "count": 1}]
+    # Filters are normalised like the indexed values
+    assert keys(run_search.search(db, filters={"severity": "high"})) == [("pentest", 1)]
+    assert keys(run_search.search(db, filters={"domain": "WWW.Shop.example.com"})) == [("pentest", 1), ("agent", 1)]
+    filtered = run_search.search(db, filters={"domain": "shop.example.com"})["facets"]
+    assert filtered["domain"] == [{"value": "shop.example.com", "count": 2}]
+
+
+def test_pagination(db):
+    first = run_search.search(db, limit=2)
+    assert len(first["results"]) == 2 and first["total"] == 3 and first["next_offset"] == 2
+    last = run_search.search(db, offset=2, limit=2)
+    assert keys(last) == [("agent", 1)] and last["next_offset"] is None
+
+
+def test_highlights_escape_stored_text(db):
+    (result,) = run_search.search(db, "unescaped")["results"]
+    findings = result["highlights"]["findings"]
+    assert "<mark>unescaped</mark>" in findings
+    assert "&lt;script&gt;alert(1)&lt;/script&gt;" in findings
+    assert "<script>" not in findings
+    assert list(result["highlights"]) == ["findings"]
@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+from trajectory_cache import key_scope  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A SQLite database for the request handlers; batch tasks are queued but not run."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import database
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'webpilot.db'}")
+    database.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    def get_db():
+        session = Session()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def start():
+        if server.batch_runner.queue is None:
+            server.batch_runner.queue = asyncio.Queue()
+
+    monkeypatch.setitem(server.app.dependency_overrides, server.get_db, get_db)
+    monkeypatch.setattr(server.batch_runner, "start", start)
+    monkeypatch.setattr(server.batch_runner, "queue", None)
+    with Session() as session:
+        yield session
+
+
+def batch_tasks(db, batch_id):
+    from database import BatchTask
+    return db.query(BatchTask).filter(BatchTask.batch_id == batch_id).order_by(BatchTask.position).all()
+
+
+TASK = {"url": "https://example.com", "instruction": "Find the pricing page", "openaiApiKey": "sk-alice"}
+
+
+def test_runs_are_only_followed_and_cancelled_by_their_caller(client, monkeypatch):
+    cancelled = []
+
+    async def send_control(key, command):
+        cancelled.append(key)
+    monkeypatch.setattr(server.run_bus, "send_control", send_control)
+
+    async def start_run():
+        await server.run_bus.claim("alices-run", key_scope("sk-alice"))
+        await server.run_bus.publish("alices-run", "log", "secret page")
+        await server.run_bus.publish("alices-run", "status", "done")
+    asyncio.run(start_run())
+
+    with client.websocket_connect("/ws") as websocket:
+        for message in ({"subscribe": "alices-run", "apiKey": "sk-mallory"}, {"subscribe": "alices-run"},
+                        {"cancel": "alices-run", "apiKey": "sk-mallory"}, {"subscribe": "no-such-run"}):
+            websocket.send_json(message)
+            assert websocket.receive_text().startswith("[ERROR] Unknown run")
+        assert cancelled == []
+
+        websocket.send_json({"cancel": "alices-run", "apiKey": "sk-alice"})
+        websocket.send_json({"subscribe": "alices-run", "apiKey": "sk-alice"})
+        assert websocket.receive_text() == "secret page"
+        assert websocket.receive_text() == "[STATUS]alices-run:done"
+        assert cancelled == ["alices-run"]
+        websocket.close()
+
+
+def test_batches_accept_a_json_list(client, db):
+    response = client.post("/api/batches", json={"tasks": [TASK, {"url": "https://example.com"}]})
+    assert response.status_code == 202
+    batch = response.json()
+    assert (batch["status"], batch["total"], batch["failed"], batch["pending"]) == ("running", 2, 1, 1)
+
+    queued, invalid = batch_tasks(db, batch["id"])
+    assert queued.status == "pending" and "openaiApiKey" not in queued.task
+    assert invalid.status == "failed" and invalid.error.startswith("Invalid task #2")
+    assert server.batch_runner.queue.qsize() == 1
+
+
+def test_batches_accept_an_ndjson_stream(client, db):
+    lines = [json.dumps(TASK), "", "not json", json.dumps(TASK)]
+    response = client.post("/api/batches?agent=pentest", content="\n".join(lines),
+                           headers={"Content-Type": "application/x-ndjson"})
+    batch = response.json()
+    assert (batch["agent"], batch["total"], batch["failed"]) == ("pentest", 3, 1)
+    assert [task.status for task in batch_tasks(db, batch["id"])] == ["pending", "failed", "pending"]
+
+
+def test_interrupted_ndjson_uploads_still_leave_submitting(client, db, monkeypatch):
+    from starlette.requests import ClientDisconnect
+
+    async def stream(request):
+        yield (json.dumps(TASK) + "\n").encode()
+        raise ClientDisconnect()
+    monkeypatch.setattr(server.Request, "stream", stream)
+
+    with pytest.raises(ClientDisconnect):
+        client.post("/api/batches", content=b"", headers={"Content-Type": "application/x-ndjson"})
+
+    from database import Batch
+    batch = db.query(Batch).one()
+    assert (batch.status, batch.total, batch.failed) == ("running", 2, 1)
+    assert batch_tasks(db, batch.id)[-1].error == "Submission interrupted: ClientDisconnect: "
+
+
+def test_clearing_the_auth_cache_only_touches_the_callers_sessions(client, monkeypatch):
+    from auth_cache import AuthStateCache
+    cache = AuthStateCache(directory="")
+    monkeypatch.setattr(server, "auth_cache", cache)
+    alice, bob = key_scope("sk-alice"), key_scope("sk-bob")
+    cache.put("https://app.example.com/", "admin", alice, {"cookies": []})
+    cache.put("https://app.example.com/", "admin", bob, {"cookies": []})
+
+    assert client.delete("/api/auth-cache").json()["entries"] == 2
+    assert client.delete("/api/auth-cache", headers={"X-Api-Key": "sk-alice"}).json()["entries"] == 1
+    assert cache.get("https://app.example.com/", "admin", bob) is not None
@@ -0,0 +1,93 @@
+import json
+
+from state_encoding import StateEncoder, count_tokens
+
+PAGE_INFO = {"viewport_width": 1280, "viewport_height": 720, "page_width": 1280.4,
+             "page_height": 2400, "scroll_x": 0, "scroll_y": 0}
+
+
+def element(id, tag="a", text="Link", x=10.4):
+    return {"id": id, "tag": tag, "text": text, "bounding_box": {"x": x, "y": 20, "width": 100.6, "height": 30}}
+
+
+def agent_state(elements, url="https://example.com/", scroll_y=0):
+    return {"url": url, "title": "Example", "tabs": [{"url": url, "title": "Example"}],
+            "page_info": {**PAGE_INFO, "scroll_y": scroll_y}, "dom_state": elements}
+
+
+def finding(label="Missing CSP", severity="Medium", evidence=None):
+    return {"label": label, "severity": severity, "owasp_category": "A05:2021 - Security Misconfiguration",
+            "description": f"{label} on the login page", "evidence": evidence}
+
+
+def pentest_state(findings):
+    return {"url": "https://example.com/", "title": "Example", "tabs": [],
+            "page_info": PAGE_INFO, "report": {"vulnerabilities": findings}}
+
+
+def apply(previous: dict, encoded: str) -> dict:
+    """Rebuilds the full compact state from `previous` and a delta, the way the LLM is told to read it."""
+    state = json.loads(encoded)
+    if not state.pop("d", 0):
+        return state
+    elements = {item[0]: item for item in previous["e"]}
+    for item in state.pop("e+", []):
+        elements[item[0]] = item
+    for element_id in state.pop("e-", []):
+        del elements[element_id]
+    return {**previous, **state, "e": sorted(elements.values())}
+
+
+def test_full_state_uses_short_keys_and_rounded_boxes():
+    encoded = json.loads(StateEncoder().encode(agent_state([element(0, text="  Sign \n in ")])))
+    assert encoded == {"u": "https://example.com/", "t": "Example", "tabs": [["https://example.com/", "Example"]],
+                       "vp": [1280, 720, 1280, 2400, 0, 0], "e": [[0, "a", "Sign in", [10, 20, 101, 30]]]}
+
+
+def test_deltas_round_trip_to_the_full_state():
+    steps = [
+        agent_state([element(i, text=f"Link {i}") for i in range(20)]),
+        agent_state([element(i, text=f"Link {i}") for i in range(20)], scroll_y=300),
+        agent_state([element(i, text=f"Link {i}") for i in range(1, 20)] + [element(20, "button", "More")]),
+        agent_state([element(i, text=f"Link {i}", x=50) for i in range(20)]),
+    ]
+    encoder, reference, decoded = StateEncoder(), StateEncoder(delta=False), None
+    for step, state in enumerate(steps):
+        encoded = encoder.encode(state)
+        full = json.loads(reference.encode(state))
+        decoded = apply(decoded, encoded) if decoded else json.loads(encoded)
+        assert decoded == {**full, "e": sorted(full["e"])}
+        if step in (1, 2):
+            assert json.loads(encoded)["d"] == 1 and len(encoded) < len(json.dumps(full))
+
+
+def test_unchanged_state_is_an_empty_delta():
+    encoder = StateEncoder()
+    encoder.encode(agent_state([element(0)]))
+    assert json.loads(encoder.encode(agent_state([element(0)]))) == {"d": 1}
+
+
+def test_repeated_findings_are_grouped_when_the_llm_keeps_earlier_states():
+    encoder = StateEncoder()
+    first = json.loads(encoder.encode(pentest_state([finding(), finding(), finding("No HSTS", "Low")])))
+    assert [f["l"] for f in first["f+"]] == ["Missing CSP", "No HSTS"]
+
+    evidence = finding("Reflected XSS", "High", evidence="payload=<script>")
+    later = json.loads(encoder.encode(pentest_state([finding(), finding("No HSTS", "Low"), evidence])))
+    assert later["f"] == [["Missing CSP", "Medium", 1], ["No HSTS", "Low", 1]]
+    assert later["f+"] == [{"l": "Reflected XSS", "s": "High", "o": evidence["owasp_category"],
+                            "d": evidence["description"], "ev": "payload=<script>"}]
+    # Findings with evidence are never collapsed
+    assert json.loads(encoder.encode(pentest_state([evidence])))["f+"][0]["ev"] == "payload=<script>"
+
+
+def test_findings_stay_in_full_without_deltas():
+    encoder = StateEncoder(delta=False)
+    encoder.encode(pentest_state([finding()]))
+    again = json.loads(encoder.encode(pentest_state([finding()])))
+    assert "f" not in again
+    assert again["f+"][0]["d"] == "Missing CSP on the login page"
+
+
+def test_count_tokens_is_positive_and_grows_with_the_text():
+    assert 0 < count_tokens('{"u":"https://example.com/"}') < count_tokens('{"u":"https://example.com/"}' * 10)
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from trajectory_cache import TrajectoryCache, caller_scope, dom_fingerprint, normalize_url
+
+STEPS = [{"fingerprint": "f0", "action": "Click(3)"}, {"fingerprint": "f1", "action": "Done(\"found it\")"}]
+
+
+def test_urls_are_normalized():
+    assert normalize_url("HTTPS://Example.com:443/pricing/?b=2&a=1#top") == "https://example.com/pricing?a=1&b=2"
+    assert normalize_url("http://example.com:8080") == "http://example.com:8080/"
+
+
+def test_fingerprint_ignores_free_text_but_not_labels():
+    page = [{"id": 0, "tag": "a", "text": "Pricing"}, {"id": 1, "tag": "div", "text": "12:01"}]
+    ticked = [page[0], {"id": 1, "tag": "div", "text": "12:02"}]
+    relabelled = [{"id": 0, "tag": "a", "text": "Plans"}, page[1]]
+    assert dom_fingerprint(page) == dom_fingerprint(ticked) != dom_fingerprint(relabelled)
+
+
+def test_entries_are_keyed_by_url_instruction_fingerprint_and_caller():
+    cache = TrajectoryCache()
+    cache.put("https://example.com/", "Find  the Pricing page", "f0", "alice", STEPS)
+    assert cache.get("https://EXAMPLE.com", "find the pricing page", "f0", "alice") == STEPS
+    assert cache.get("https://example.com/", "find the pricing page", "f0", "bob") is None
+    assert cache.get("https://example.com/", "find the pricing page", "other", "alice") is None
+    assert cache.get("https://example.com/docs", "find the pricing page", "f0", "alice") is None
+
+    gemini = SimpleNamespace(model="gemini", geminiApiKey="g-key", openaiApiKey="sk-key")
+    assert caller_scope(gemini) != caller_scope(SimpleNamespace(**{**vars(gemini), "model": "openai"}))
+    assert caller_scope(SimpleNamespace(model="openai", openaiApiKey="", geminiApiKey="")) == ""
+
+
+def test_trajectories_that_type_are_not_stored():
+    cache = TrajectoryCache()
+    typed = [{"fingerprint": "f0", "action": 'Type(2, "hunter2")'}] + STEPS
+    assert not cache.put("https://example.com/", "log in", "f0", "alice", typed)
+    assert not cache.put("https://example.com/", "log in", "f0", "alice", [{"fingerprint": "f0", "action": {"action": "type"}}])
+    assert cache.get("https://example.com/", "log in", "f0", "alice") is None
+
+
+def test_entries_expire_from_when_they_were_first_stored(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("trajectory_cache.time.monotonic", lambda: now[0])
+    cache = TrajectoryCache(ttl=60)
+    cache.put("https://example.com/", "find pricing", "f0", "alice", STEPS)
+    now[0] += 50
+    cache.put("https://example.com/", "find pricing", "f0", "alice", STEPS)  # Refreshed by a replay
+    now[0] += 20
+    assert cache.get("https://example.com/", "find pricing", "f0", "alice") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = TrajectoryCache(maxsize=2)
+    for fingerprint in ("a", "b"):
+        cache.put("https://example.com/", "find pricing", fingerprint, "alice", STEPS)
+    cache.get("https://example.com/", "find pricing", "a", "alice")
+    cache.put("https://example.com/", "find pricing", "c", "alice", STEPS)
+    assert cache.get("https://example.com/", "find pricing", "b", "alice") is None
+    assert cache.get("https://example.com/", "find pricing", "a", "alice") == STEPS
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from ws_stream import FrameStream, Screencast, SLOW_CLIENT_CLOSE_CODE
+
+
+class StalledWebSocket:
+    """Accepts `stall_after` text messages and then never completes a send, like a client that stopped reading."""
+    def __init__(self, stall_after=1):
+        self.stall_after = stall_after
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, message):
+        self.sent.append(message)
+        if sum(isinstance(item, str) for item in self.sent) > self.stall_after:
+            await asyncio.Event().wait()
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_slow_clients_are_disconnected_once_pending_text_exceeds_the_budget():
+    async def scenario():
+        websocket = StalledWebSocket()
+        stream = FrameStream(websocket, max_pending_text_bytes=12).start()
+        await stream.send_text("first")
+        await stream.send_text("second")  # 11 bytes pending, within the budget
+        while len(websocket.sent) < 2:  # The sender takes both and stalls on the second
+            await asyncio.sleep(0)
+        assert stream.pending_text_bytes == 0
+        await stream.send_text("ab")
+        await stream.send_text("cdé")  # 4 bytes
+        assert stream.pending_text_bytes == 6
+        with pytest.raises(ConnectionError):
+            await stream.send_text("fghijkl")
+        assert websocket.closed_with == SLOW_CLIENT_CLOSE_CODE
+        assert stream.pending_text_bytes == 0 and not stream.pending
+        with pytest.raises(ConnectionError):
+            await stream.send_text("x")
+        stream.push_frame(b"frame")  # Dropped silently
+        assert not stream.pending
+
+    asyncio.run(scenario())
+
+
+def test_frames_do_not_count_against_the_text_budget():
+    async def scenario():
+        websocket = StalledWebSocket()
+        stream = FrameStream(websocket, max_pending_frames=1, max_pending_text_bytes=5).start()
+        stream.push_frame(b"x" * 100)
+        stream.push_frame(b"y" * 100)
+        await stream.send_text("hello")
+        await stream.drain()
+        assert websocket.sent == [b"y" * 100, "hello"]
+        assert stream.dropped["step"] == 1
+        await stream.close()
+
+    asyncio.run(scenario())
+
+
+class Emitter:
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    once = on
+
+    def remove_listener(self, event, handler):
+        self.handlers[event].remove(handler)
+
+    async def emit(self, event, *args):
+        for handler in list(self.handlers.get(event, ())):
+            await handler(*args)
+
+
+class FakeSession(Emitter):
+    def __init__(self, page):
+        super().__init__()
+        self.page = page
+        self.sent = []
+
+    async def send(self, method, params=None):
+        self.sent.append(method)
+
+    async def detach(self):
+        self.sent.append("detach")
+
+
+class FakeContext(Emitter):
+    def __init__(self):
+        super().__init__()
+        self.pages = []
+        self.sessions = []
+
+    async def new_page(self):
+        page = FakePage(self)
+        self.pages.append(page)
+        await self.emit("page", page)
+        return page
+
+    async def new_cdp_session(self, page):
+        self.sessions.append(FakeSession(page))
+        return self.sessions[-1]
+
+
+class FakePage(Emitter):
+    def __init__(self, context):
+        super().__init__()
+        self.context = context
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+        self.context.pages.remove(self)
+        await self.emit("close", self)
+
+
+def test_screencast_follows_new_tabs_and_returns_when_they_close():
+    async def scenario():
+        context = FakeContext()
+        first = FakePage(context)
+        context.pages.append(first)
+        screencast = Screencast(FrameStream(StalledWebSocket()))
+        await screencast.start(first)
+        assert screencast.page is first
+
+        popup = await context.new_page()
+        assert screencast.page is popup
+        assert context.sessions[0].sent == ["Page.startScreencast", "Page.stopScreencast", "detach"]
+        assert context.sessions[1].page is popup
+
+        await popup.close()
+        assert screencast.page is first
+        assert context.sessions[2].page is first
+
+        await screencast.stop()
+        assert screencast.page is None and screencast.session is None
+        await context.new_page()  # No longer followed
+        assert len(context.sessions) == 3
+
+    asyncio.run(scenario())
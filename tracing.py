@@ -0,0 +1,147 @@
+"""
+Per-run span tracing with Chrome trace export (open the JSON in https://ui.perfetto.dev).
+
+The active tracer lives in a context variable, so code anywhere in a run can open spans
+without a tracer being passed around:
+
+    with tracing.span("agent.observe", step=3):
+        ...
+
+When no tracer is active, `span` returns a shared no-op context manager, so the cost of
+disabled tracing is a context-variable lookup per span.
+"""
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+TRACES_DIR = os.getenv("WEBPILOT_TRACES_DIR", "traces")
+TRACING_DEFAULT = os.getenv("WEBPILOT_TRACING", "") == "1"
+
+_current_tracer: ContextVar[Optional["Tracer"]] = ContextVar("current_tracer", default=None)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start", "tid")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.tid = self.tracer.thread_id()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer.add(self.name, self.start, end, self.tid, self.args)
+        return False
+
+    def set(self, **args):
+        """Attaches extra arguments (e.g. sizes known only at the end) to the span."""
+        self.args.update(args)
+
+
+class Tracer:
+    """Collects complete ("X") events for one run."""
+    def __init__(self, name: str = "run"):
+        self.name = name
+        self.origin = time.perf_counter()
+        self.events = []
+        self._tids = {}
+        self._lock = threading.Lock()
+
+    def thread_id(self) -> int:
+        # Concurrent asyncio tasks get their own track so their spans nest correctly.
+        try:
+            key = id(asyncio.current_task())
+        except RuntimeError:
+            key = threading.get_ident()
+        with self._lock:
+            return self._tids.setdefault(key, len(self._tids) + 1)
+
+    def add(self, name: str, start: float, end: float, tid: int, args: dict):
+        category = name.split(".", 1)[0]
+        with self._lock:
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round((start - self.origin) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": 1,
+                "tid": tid,
+                "args": args,
+            })
+
+    def to_chrome_trace(self) -> dict:
+        metadata = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": self.name}}]
+        return {"traceEvents": metadata + sorted(self.events, key=lambda event: event["ts"]), "displayTimeUnit": "ms"}
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+def span(name: str, **args):
+    """Opens a span on the active tracer, or returns a no-op when tracing is off."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return _NOOP_SPAN
+    return _Span(tracer, name, args)
+
+
+def enabled() -> bool:
+    """True when a tracer is active, so diagnostics that are only useful in traces are worth computing."""
+    return _current_tracer.get() is not None
+
+
+def traced(name: str):
+    """Decorator that wraps every call of an async function in a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _current_tracer.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def activate(tracer: Optional[Tracer]):
+    """Makes `tracer` the active tracer for the enclosed code (a no-op for None)."""
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+def trace_path(kind: str, run_id: int) -> str:
+    return os.path.join(TRACES_DIR, f"{kind}_{run_id}.json")
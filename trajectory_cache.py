@@ -0,0 +1,145 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Tags whose visible text identifies them well enough to be part of the structure.
+LABELLED_TAGS = {"a", "button"}
+
+# Typed text can be a password or other personal data, so it is never cached.
+TYPE_ACTION = re.compile(r"\s*type\s*(\(|$)", re.IGNORECASE)
+
+
+def normalize_url(url: str) -> str:
+    """Lowercases scheme and host, drops default ports, fragments and trailing slashes, and sorts the query."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not (scheme == "http" and parts.port == 80 or scheme == "https" and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def caller_scope(task) -> str:
+    """
+    Identifies who submitted a task, by a hash of the LLM API key it carries. Cached state
+    that can hold credentials is only shared between tasks with the same key; tasks without
+    a key of their own get "" and should not use such caches.
+    """
+    return key_scope(task.geminiApiKey if task.model == "gemini" else task.openaiApiKey)
+
+
+def key_scope(api_key: str) -> str:
+    """The `caller_scope` of tasks carrying `api_key`; REST clients send it as `X-Api-Key`."""
+    if not api_key:
+        return ""
+    return hashlib.sha256(f"webpilot-caller:{api_key}".encode()).hexdigest()[:32]
+
+
+def normalize_instruction(instruction: str) -> str:
+    return " ".join(instruction.lower().split())
+
+
+def types_input(steps: list[dict]) -> bool:
+    """Whether any step is a Type action, given as "Type(id, text)" or as an `{"action": "type"}` dict."""
+    def name(action) -> str:
+        return action.get("action", "") if isinstance(action, dict) else action or ""
+    return any(TYPE_ACTION.match(name(step["action"])) for step in steps)
+
+
+def dom_fingerprint(dom_state: list) -> str:
+    """
+    Hashes the structure of the interactive elements: their ids and tags, plus the text of
+    links and buttons. Free text in other elements is ignored so that dynamic content does
+    not change the fingerprint, while a moved or relabelled click target does.
+    """
+    digest = hashlib.sha1()
+    for element in dom_state:
+        text = element.get("text", "").strip()[:40] if element["tag"] in LABELLED_TAGS else ""
+        digest.update(f"{element['id']}:{element['tag']}:{text}|".encode())
+    return digest.hexdigest()
+
+
+class TrajectoryCache:
+    """
+    LRU cache with TTL of successful action sequences, keyed by (normalized URL,
+    normalized instruction, fingerprint of the starting DOM, caller scope).
+
+    Each cached step stores the DOM fingerprint seen before the action so that a replay
+    can detect the first divergence and hand control back to the LLM. Trajectories that
+    type into inputs are not stored, since the typed values may be secrets.
+    """
+    def __init__(self, maxsize: int = 512, ttl: float = 24 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lookups = 0
+        self.hits = 0
+        self.llm_calls_saved = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(url: str, instruction: str, fingerprint: str, scope: str) -> tuple:
+        return (normalize_url(url), normalize_instruction(instruction), fingerprint, scope)
+
+    def get(self, url: str, instruction: str, fingerprint: str, scope: str) -> Optional[list[dict]]:
+        """Returns the cached steps (`{"fingerprint", "action"}` dicts) or None."""
+        key = self.make_key(url, instruction, fingerprint, scope)
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["created"] > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry["steps"])
+
+    def put(self, url: str, instruction: str, fingerprint: str, scope: str, steps: list[dict]) -> bool:
+        """
+        Stores `steps` unless they type into an input; returns whether they were stored.
+        Refreshing an entry keeps its original creation time, so replays do not extend the TTL.
+        """
+        if types_input(steps):
+            return False
+        key = self.make_key(url, instruction, fingerprint, scope)
+        with self._lock:
+            previous = self._entries.get(key)
+            created = previous["created"] if previous else time.monotonic()
+            self._entries[key] = {"steps": list(steps), "created": created}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, url: str, instruction: str, fingerprint: str, scope: str):
+        with self._lock:
+            self._entries.pop(self.make_key(url, instruction, fingerprint, scope), None)
+
+    def record_saved_calls(self, count: int):
+        with self._lock:
+            self.llm_calls_saved += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+                "llm_calls_saved": self.llm_calls_saved,
+                "evictions": self.evictions,
+            }
+
+
+trajectory_cache = TrajectoryCache()
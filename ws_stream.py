@@ -0,0 +1,255 @@
+"""
+Backpressure-aware outbound WebSocket streaming.
+
+Agents write to a `FrameStream` instead of the raw WebSocket. A single sender task per
+connection drains it in order, so a slow client never blocks the agent loop. Text frames
+(logs, `[DONE]`, `[VIDEO]...`) are delivered in order up to a byte budget; a client that
+falls further behind is disconnected and can resubscribe to the run's backlog. Image frames
+are bounded and the oldest pending image is dropped when a new one arrives, so a slow client
+always sees the latest view instead of an ever-growing backlog.
+
+`Screencast` streams a live view of a page via CDP `Page.startScreencast` into the same
+stream, throttled to the FPS and resolution the client asked for. It follows the run to
+tabs and popups opened in the page's context.
+"""
+import asyncio
+import base64
+import logging
+import os
+import time
+from collections import deque
+
+from metrics import DROPPED_FRAMES
+
+MAX_PENDING_FRAMES = int(os.getenv("WEBPILOT_MAX_PENDING_FRAMES", "2"))
+# Text a client may leave unsent before it is disconnected as too slow
+MAX_PENDING_TEXT_BYTES = int(os.getenv("WEBPILOT_MAX_PENDING_TEXT_BYTES", str(4 * 1024 * 1024)))
+# WebSocket close code "Try Again Later"
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+# Limits applied to the live-view settings requested by clients.
+MAX_SCREENCAST_FPS = 15
+MAX_SCREENCAST_WIDTH = 1920
+MAX_SCREENCAST_HEIGHT = 1080
+
+_TEXT = 0
+_IMAGE = 1
+
+
+class FrameStream:
+    """
+    Per-connection outbound queue with the `send_text`/`send_bytes` interface of a WebSocket.
+    Sends only enqueue; if the sender task failed (e.g. the client disconnected) the error is
+    raised from the next send so the agent run stops as it did with direct sends.
+    """
+    def __init__(self, websocket, max_pending_frames: int = MAX_PENDING_FRAMES,
+                 max_pending_text_bytes: int = MAX_PENDING_TEXT_BYTES):
+        self.websocket = websocket
+        self.max_pending_frames = max(1, max_pending_frames)
+        self.max_pending_text_bytes = max_pending_text_bytes
+        self.pending = deque()
+        self.pending_frames = 0
+        self.pending_text_bytes = 0
+        self.dropped = {"step": 0, "live": 0}
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._error = None
+        self._sender = None
+        self._live_child = DROPPED_FRAMES.labels("live")
+        self._step_child = DROPPED_FRAMES.labels("step")
+
+    def start(self):
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send_loop())
+        return self
+
+    async def close(self):
+        if self._sender is not None:
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
+            self._sender = None
+
+    async def send_text(self, message: str):
+        if self._error is not None:
+            raise self._error
+        size = len(message.encode())
+        if self.pending_text_bytes + size > self.max_pending_text_bytes:
+            await self._disconnect_slow_client()
+            raise self._error
+        self.pending_text_bytes += size
+        self._enqueue(_TEXT, (message, size))
+
+    async def send_bytes(self, data: bytes, live: bool = False):
+        if self._error is not None:
+            raise self._error
+        self.push_frame(data, live)
+
+    def push_frame(self, data: bytes, live: bool = False):
+        """Synchronous variant of `send_bytes` for event callbacks; never blocks or raises."""
+        if self._error is not None:
+            return
+        if self.pending_frames >= self.max_pending_frames:
+            self._drop_oldest_frame()
+        self.pending_frames += 1
+        self._enqueue(_IMAGE, (data, live))
+
+    async def drain(self):
+        """Waits until everything queued so far has been handed to the WebSocket."""
+        if self._sender is None:
+            return
+        await self._idle.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _enqueue(self, kind: int, item):
+        self.start()
+        self.pending.append((kind, item))
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def _disconnect_slow_client(self):
+        logging.warning(f"Disconnecting a client with {self.pending_text_bytes} bytes of unsent text")
+        self._error = ConnectionError("Client is too slow to keep up with the run")
+        await self.close()
+        self._clear()
+        try:
+            await self.websocket.close(code=SLOW_CLIENT_CLOSE_CODE)
+        except Exception:
+            pass  # Already closed
+
+    def _clear(self):
+        self.pending.clear()
+        self.pending_frames = 0
+        self.pending_text_bytes = 0
+        self._idle.set()
+
+    def _drop_oldest_frame(self):
+        for index, (kind, item) in enumerate(self.pending):
+            if kind == _IMAGE:
+                del self.pending[index]
+                self.pending_frames -= 1
+                live = item[1]
+                self.dropped["live" if live else "step"] += 1
+                (self._live_child if live else self._step_child).inc()
+                return
+
+    async def _send_loop(self):
+        try:
+            while True:
+                if not self.pending:
+                    self._idle.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                kind, item = self.pending.popleft()
+                if kind == _TEXT:
+                    self.pending_text_bytes -= item[1]
+                    await self.websocket.send_text(item[0])
+                else:
+                    self.pending_frames -= 1
+                    await self.websocket.send_bytes(item[0])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+            self._clear()
+
+
+class Screencast:
+    """
+    Mirrors a page into a `FrameStream` (or anything with `push_frame`) via CDP screencast
+    frames. Once started it moves to every page the context opens, and back to the newest
+    remaining page when the mirrored one closes.
+    """
+    def __init__(self, stream, fps: float = 5, max_width: int = 1280, max_height: int = 720, quality: int = 60):
+        self.stream = stream
+        self.interval = 1 / min(max(fps, 0.5), MAX_SCREENCAST_FPS)
+        self.max_width = min(max(max_width, 160), MAX_SCREENCAST_WIDTH)
+        self.max_height = min(max(max_height, 90), MAX_SCREENCAST_HEIGHT)
+        self.quality = min(max(quality, 10), 100)
+        self.session = None
+        self.page = None
+        self.context = None
+        self._lock = asyncio.Lock()
+        self.last_frame = 0.0
+        self.frames = 0
+
+    @classmethod
+    def for_task(cls, stream, task):
+        if not getattr(task, "liveView", False) or not hasattr(stream, "push_frame"):
+            return None
+        return cls(stream, task.liveViewFps, task.liveViewWidth, task.liveViewHeight, task.liveViewQuality)
+
+    async def start(self, page):
+        """Starts (or moves) the screencast to `page`; a no-op if it is already attached there."""
+        if self.context is None:
+            self.context = page.context
+            self.context.on("page", self._on_page)
+        async with self._lock:
+            if page is self.page or page.is_closed():
+                return
+            await self._detach()
+            try:
+                self.session = await page.context.new_cdp_session(page)
+            except Exception as e:
+                # CDP is only available on Chromium; fall back to per-step screenshots.
+                logging.warning(f"Live view unavailable: {e}")
+                return
+            self.page = page
+            page.once("close", self._on_close)
+            self.session.on("Page.screencastFrame", self._on_frame)
+            await self.session.send("Page.startScreencast", {
+                "format": "jpeg",
+                "quality": self.quality,
+                "maxWidth": self.max_width,
+                "maxHeight": self.max_height,
+            })
+
+    async def stop(self):
+        if self.context is not None:
+            self.context.remove_listener("page", self._on_page)
+            self.context = None
+        async with self._lock:
+            await self._detach()
+
+    async def _on_page(self, page):
+        try:
+            await self.start(page)
+        except Exception as e:
+            logging.warning(f"Live view could not follow a new page: {e}")
+
+    async def _on_close(self, page):
+        if page is not self.page or self.context is None:
+            return
+        self.page = None
+        open_pages = [other for other in self.context.pages if not other.is_closed()]
+        if open_pages:
+            await self._on_page(open_pages[-1])
+
+    async def _detach(self):
+        if self.session is None:
+            return
+        try:
+            await self.session.send("Page.stopScreencast")
+            await self.session.detach()
+        except Exception:
+            pass  # The page or browser may already be closed
+        self.session = None
+        self.page = None
+
+    async def _on_frame(self, params):
+        session = self.session
+        if session is None:
+            return
+        # Chrome keeps sending frames only while they are acknowledged; frames above the
+        # requested rate are acknowledged but not forwarded.
+        now = time.monotonic()
+        if now - self.last_frame >= self.interval:
+            self.last_frame = now
+            self.frames += 1
+            self.stream.push_frame(base64.b64decode(params["data"]), live=True)
+        try:
+            await session.send("Page.screencastFrameAck", {"sessionId": params["sessionId"]})
+        except Exception:
+            pass